@@ -0,0 +1,444 @@
+from libsbml import *
+import hashlib
+import json
+import os
+import warnings
+import numpy as np
+
+# Bump when the compiled form changes, so that cached models of older versions are not read
+CONVERTER_VERSION = 2
+
+# Arrays of an SBMLCRN stored in the model cache
+_CACHED_ARRAYS = ["x_init", "params_values", "stoich_rows", "stoich_cols", "stoich_values", "term_coefs", "term_parameters",
+                  "term_species", "term_reactions", "general", "_jac_rows", "_jac_cols", "_jac_terms", "_jac_slots", "_jac_values"]
+
+
+def _numpy_printer():
+    # NumPyPrinter moved from sympy.printing.pycode to sympy.printing.numpy in SymPy 1.8
+    try:
+        from sympy.printing.numpy import NumPyPrinter
+    except ImportError:
+        from sympy.printing.pycode import NumPyPrinter
+    return NumPyPrinter({'fully_qualified_modules': False, 'inline': True, 'allow_unknown_functions': True})
+
+
+class SBMLImportError(RuntimeError):
+    '''Raised when an SBML file cannot be read'''
+
+
+def read_sbml(filename):
+    '''A function that reads an SBML file and returns doc, mod.
+    Local parameters are promoted to global parameters and initial assignments and function
+    definitions are expanded, as sbml_to_ode2 expects. Raises SBMLImportError if the file cannot
+    be read, conversions that fail only issue a warning. Keep doc alive while mod is in use.'''
+    doc = readSBMLFromFile(filename)
+    if doc.getNumErrors(LIBSBML_SEV_FATAL) or doc.getModel() is None:
+        raise SBMLImportError('Encountered serious errors while reading ' + str(filename) + '\n' + doc.getErrorLog().toString())
+
+    doc.getErrorLog().clearLog()
+
+    for option in ["promoteLocalParameters", "expandInitialAssignments", "expandFunctionDefinitions"]:
+        props = ConversionProperties()
+        props.addOption(option, True)
+        if doc.convert(props) != LIBSBML_OPERATION_SUCCESS:
+            warnings.warn('The document could not be converted (' + option + ')\n' + doc.getErrorLog().toString())
+
+    return doc, doc.getModel()
+
+
+def _monomials(ast, species_index, parameter_index, constants):
+    '''Expands a kinetic law AST into a list of monomials (coefficient, parameter indices, species
+    indices), or returns None if it is not a polynomial in the species and parameters'''
+    t = ast.getType()
+    children = [ast.getChild(i) for i in range(ast.getNumChildren())]
+
+    if t == AST_NAME:
+        name = ast.getName()
+        if name in species_index:
+            return [(1.0, [], [species_index[name]])]
+        if name in parameter_index:
+            return [(1.0, [parameter_index[name]], [])]
+        if name in constants:
+            return [(constants[name], [], [])]
+        return None
+    if t in (AST_INTEGER, AST_REAL, AST_REAL_E, AST_RATIONAL):
+        return [(ast.getValue(), [], [])]
+
+    terms = [_monomials(c, species_index, parameter_index, constants) for c in children]
+    if any(term is None for term in terms):
+        return None
+
+    if t == AST_TIMES:
+        result = [(1.0, [], [])]
+        for factor in terms:
+            result = [(c1 * c2, p1 + p2, s1 + s2) for c1, p1, s1 in result for c2, p2, s2 in factor]
+        return result
+    if t == AST_PLUS:
+        return [m for term in terms for m in term]
+    if t == AST_MINUS:
+        negated = [(-c, p, s) for c, p, s in terms[-1]]
+        return negated if len(terms) == 1 else terms[0] + negated
+    if t == AST_DIVIDE and len(terms[1]) == 1 and not terms[1][0][1] and not terms[1][0][2]:
+        return [(c / terms[1][0][0], p, s) for c, p, s in terms[0]]
+    if t in (AST_POWER, AST_FUNCTION_POWER) and len(terms[1]) == 1 and not terms[1][0][1] and not terms[1][0][2]:
+        exponent = terms[1][0][0]
+        if exponent == int(exponent) and 0 <= exponent <= 8:
+            result = [(1.0, [], [])]
+            for i in range(int(exponent)):
+                result = [(c1 * c2, p1 + p2, s1 + s2) for c1, p1, s1 in result for c2, p2, s2 in terms[0]]
+            return result
+    return None
+
+
+def _padded(lists, fill):
+    # Rectangular int array of lists, padded with fill
+    width = max([len(l) for l in lists] + [1])
+    out = np.full((len(lists), width), fill, dtype = int)
+    for i, l in enumerate(lists):
+        out[i, :len(l)] = l
+    return out
+
+
+class SBMLCRN:
+    '''Numeric form of an SBML reaction network built without SymPy, see sbml_to_crn.
+    species, parameters: lists of ids; x_init, params_values: arrays in the same order
+    stoichiometry: sparse (len(species) x number of reactions) net stoichiometry matrix
+    formulas: kinetic law of every reaction as a string
+    names, compartments: name and compartment id of every species (names default to the ids)
+    constants: size of every compartment
+    Rate laws that are polynomials in the species and parameters (mass action, reversible mass
+    action) are stored as monomials: term_coefs, term_parameters, term_species, term_reactions.
+    Any other rate law is compiled with SymPy, only for the reactions that need it.
+    fun, jac, jac_sparse take (t, x, p) like the functions of ode_functions, with p the parameter
+    values in the order of parameters.
+    jacobian_structure, general_code: precomputed outputs of _jacobian_structure and _generate_general,
+    as stored by the model cache.'''
+    def __init__(self, species, parameters, x_init, params_values, stoich_rows, stoich_cols, stoich_values, formulas,
+                 term_coefs, term_parameters, term_species, term_reactions, general, constants = None, filename = None,
+                 names = None, compartments = None, jacobian_structure = None, general_code = None):
+        self.species = list(species)
+        self.parameters = list(parameters)
+        self.x_init = np.asarray(x_init, dtype = float)
+        self.params_values = np.asarray(params_values, dtype = float)
+        self.formulas = list(formulas)
+        self.constants = dict(constants or {})
+        self.filename = filename
+        self.names = list(species) if names is None else list(names)
+        self.compartments = [None] * len(self.species) if compartments is None else list(compartments)
+        self.species_index = {s: i for i, s in enumerate(self.species)}
+        n = len(self.species)
+        n_reactions = len(self.formulas)
+
+        self.stoich_rows = np.asarray(stoich_rows, dtype = int)
+        self.stoich_cols = np.asarray(stoich_cols, dtype = int)
+        self.stoich_values = np.asarray(stoich_values, dtype = float)
+        self._stoichiometry = None
+
+        # Stoichiometry entries grouped by reaction (compressed columns), built with NumPy so that reading a model,
+        # e.g. for sbml_to_ode2, does not import scipy.sparse
+        order = np.lexsort((self.stoich_rows, self.stoich_cols))
+        self._column_indptr = np.append(0, np.cumsum(np.bincount(self.stoich_cols, minlength = n_reactions)))
+        self._column_rows = self.stoich_rows[order]
+        self._column_values = self.stoich_values[order]
+
+        self.term_coefs = np.asarray(term_coefs, dtype = float)
+        self.term_parameters = np.asarray(term_parameters, dtype = int)
+        self.term_species = np.asarray(term_species, dtype = int)
+        self.term_reactions = np.asarray(term_reactions, dtype = int)
+        self.general = np.asarray(general, dtype = int)
+
+        if jacobian_structure is None:
+            jacobian_structure = self._jacobian_structure()
+        self._jac_rows, self._jac_cols, self._jac_terms, self._jac_slots, self._jac_values = jacobian_structure
+
+        self._general = None
+        if len(self.general):
+            self.general_code = self._generate_general() if general_code is None else general_code
+            self._general = self._compile_general()
+        else:
+            self.general_code = []
+
+    @property
+    def stoichiometry(self):
+        if self._stoichiometry is None:
+            from scipy.sparse import csr_matrix
+
+            shape = (len(self.species), len(self.formulas))
+            self._stoichiometry = csr_matrix((self.stoich_values, (self.stoich_rows, self.stoich_cols)), shape = shape)
+        return self._stoichiometry
+
+    def _jacobian_structure(self):
+        '''Rows, columns, terms, species slots and stoichiometry of the Jacobian entries of the monomials:
+        for every species slot of every term, one entry per nonzero stoichiometry entry of its reaction'''
+        n = len(self.species)
+        indptr = self._column_indptr
+        entry_rows, entry_cols, entry_terms, entry_slots, entry_values = [], [], [], [], []
+        for slot in range(self.term_species.shape[1]):
+            for term in np.nonzero(self.term_species[:, slot] < n)[0]:
+                r = self.term_reactions[term]
+                rows = self._column_rows[indptr[r]:indptr[r + 1]]
+                entry_rows.append(rows)
+                entry_cols.append(np.full(len(rows), self.term_species[term, slot]))
+                entry_terms.append(np.full(len(rows), term))
+                entry_slots.append(np.full(len(rows), slot))
+                entry_values.append(self._column_values[indptr[r]:indptr[r + 1]])
+        return (np.concatenate(entry_rows + [np.zeros(0, dtype = int)]).astype(int),
+                np.concatenate(entry_cols + [np.zeros(0, dtype = int)]).astype(int),
+                np.concatenate(entry_terms + [np.zeros(0, dtype = int)]).astype(int),
+                np.concatenate(entry_slots + [np.zeros(0, dtype = int)]).astype(int),
+                np.concatenate(entry_values + [np.zeros(0)]))
+
+    def _generate_general(self):
+        '''NumPy source of the rate and gradient of the rate laws that are not polynomials, generated with SymPy.
+        Returns a list of (reaction, species the rate depends on, rate source, gradient source), the sources being
+        expressions of x[i] and p[j] that are stored by the model cache'''
+        from sympy import Symbol, sympify
+
+        printer = _numpy_printer()
+        names = {Symbol(s): Symbol('x[%d]' % i) for i, s in enumerate(self.species)}
+        names.update({Symbol(s): Symbol('p[%d]' % j) for j, s in enumerate(self.parameters)})
+        generated = []
+        for r in self.general:
+            rate = sympify(self.formulas[r]).subs({Symbol(c): v for c, v in self.constants.items()})
+            depends = sorted(self.species_index[s.name] for s in rate.free_symbols if s.name in self.species_index)
+            gradient = [rate.diff(Symbol(self.species[i])).xreplace(names) for i in depends]
+            generated.append((int(r), depends, printer.doprint(rate.xreplace(names)), "[" + ", ".join(printer.doprint(g) for g in gradient) + "]"))
+        return generated
+
+    def _compile_general(self):
+        '''Rate and gradient functions of the rate laws that are not polynomials, from general_code'''
+        namespace = dict(vars(np))
+        return [(r, np.array(depends, dtype = int), eval("lambda x, p: " + rate, namespace), eval("lambda x, p: " + gradient, namespace))
+                for r, depends, rate, gradient in self.general_code]
+
+    def propensities(self, t, x, p):
+        '''Rate of every reaction, x of shape (n,) or (n, m) for m states at once'''
+        x = np.asarray(x, dtype = float)
+        xe = np.concatenate([x, np.ones((1,) + x.shape[1:])])
+        pe = np.concatenate([np.asarray(p, dtype = float), [1.0]])
+        coefs = self.term_coefs * np.prod(pe[self.term_parameters], axis = 1)
+        terms = coefs.reshape((-1,) + (1,) * (x.ndim - 1)) * np.prod(xe[self.term_species], axis = 1)
+        rates = np.zeros((len(self.formulas),) + x.shape[1:])
+        np.add.at(rates, self.term_reactions, terms)
+        if self._general is not None:
+            for r, depends, rate, gradient in self._general:
+                rates[r] = rate(x, pe[:-1])
+        return rates
+
+    def fun(self, t, x, p):
+        '''Right hand side of the ODE, as ode_functions'''
+        return self.stoichiometry @ self.propensities(t, x, p)
+
+    def _jacobian_entries(self, t, x, p):
+        # Rows, columns and values of the Jacobian entries, duplicates to be summed
+        x = np.asarray(x, dtype = float)
+        xe = np.append(x, 1.0)
+        pe = np.append(np.asarray(p, dtype = float), 1.0)
+        factors = xe[self.term_species[self._jac_terms]]
+        factors[np.arange(len(self._jac_terms)), self._jac_slots] = 1.0
+        values = self._jac_values * self.term_coefs[self._jac_terms] * np.prod(pe[self.term_parameters[self._jac_terms]], axis = 1) * \
+                 np.prod(factors, axis = 1)
+        rows, cols = [self._jac_rows], [self._jac_cols]
+        values = [values]
+        if self._general is not None:
+            indptr = self._column_indptr
+            for r, depends, rate, gradient in self._general:
+                g = np.asarray(gradient(x, pe[:-1]), dtype = float).reshape(-1)
+                stoich_rows = self._column_rows[indptr[r]:indptr[r + 1]]
+                stoich = self._column_values[indptr[r]:indptr[r + 1]]
+                rows.append(np.repeat(stoich_rows, len(depends)))
+                cols.append(np.tile(depends, len(stoich_rows)))
+                values.append(np.outer(stoich, g).ravel())
+        return np.concatenate(rows), np.concatenate(cols), np.concatenate(values)
+
+    def jac_sparse(self, t, x, p):
+        '''Jacobian df/dx as a scipy.sparse csc_matrix, as ode_functions'''
+        from scipy.sparse import csc_matrix
+        n = len(self.species)
+        rows, cols, values = self._jacobian_entries(t, x, p)
+        return csc_matrix((values, (rows, cols)), shape = (n, n))
+
+    def jac(self, t, x, p):
+        '''Jacobian df/dx as a dense array, as ode_functions'''
+        return self.jac_sparse(t, x, p).toarray()
+
+    def symbolic(self):
+        '''Returns x, f, P, params_values, x_init as sbml_to_ode2, building the SymPy expressions'''
+        from sympy import Symbol, sympify
+
+        x = [Symbol(s) for s in self.species]
+        P = [Symbol(s) for s in self.parameters]
+        rates = [sympify(formula) for formula in self.formulas]
+        f = [0] * len(x)
+        for i, r, v in zip(self.stoich_rows, self.stoich_cols, self.stoich_values):
+            f[i] += rates[r] if v == 1.0 else (-rates[r] if v == -1.0 else rates[r] * v)
+        return x, f, P, self.params_values.tolist(), self.x_init.tolist()
+
+
+def _compile_sbml(filename):
+    # Reads an SBML file into an SBMLCRN, see sbml_to_crn
+    doc, mod = read_sbml(filename)
+
+    species, x_init, names, compartments = [], [], [], []
+    for i in range(mod.getNumSpecies()):
+        s = mod.getSpecies(i)
+        species.append(s.getId())
+        names.append(s.getName() if s.isSetName() else s.getId())
+        compartments.append(s.getCompartment())
+        if s.isSetInitialConcentration():
+            x_init.append(s.getInitialConcentration())
+        elif s.isSetInitialAmount():
+            x_init.append(s.getInitialAmount())
+        else:
+            x_init.append(0)
+    species_index = {s: i for i, s in enumerate(species)}
+
+    parameters, params_values = [], []
+    for i in range(mod.getNumParameters()):
+        parameters.append(mod.getParameter(i).getId())
+        params_values.append(mod.getParameter(i).getValue())
+    parameter_index = {s: i for i, s in enumerate(parameters)}
+    constants = {}
+    for i in range(mod.getNumCompartments()):
+        c = mod.getCompartment(i)
+        constants[c.getId()] = c.getSize() if c.isSetSize() else 1.0
+
+    stoich = {}
+    formulas = []
+    term_coefs, term_parameters, term_species, term_reactions = [], [], [], []
+    general = []
+    for r in range(mod.getNumReactions()):
+        reaction = mod.getReaction(r)
+        kinetics = reaction.getKineticLaw()
+        if kinetics is None or kinetics.getMath() is None:
+            raise SBMLImportError('Reaction ' + reaction.getId() + ' of ' + str(filename) + ' has no kinetic law')
+        formulas.append(kinetics.getFormula())
+
+        for j in range(reaction.getNumReactants()):
+            ref = reaction.getReactant(j)
+            key = (species_index[ref.getSpecies()], r)
+            stoich[key] = stoich.get(key, 0.0) - ref.getStoichiometry()
+        for j in range(reaction.getNumProducts()):
+            ref = reaction.getProduct(j)
+            key = (species_index[ref.getSpecies()], r)
+            stoich[key] = stoich.get(key, 0.0) + ref.getStoichiometry()
+
+        monomials = _monomials(kinetics.getMath(), species_index, parameter_index, constants)
+        if monomials is None:
+            general.append(r)
+            continue
+        for coef, params, spec in monomials:
+            term_coefs.append(coef)
+            term_parameters.append(params)
+            term_species.append(spec)
+            term_reactions.append(r)
+
+    keys = [key for key, value in stoich.items() if value != 0]
+    return SBMLCRN(species, parameters, x_init, params_values, [i for i, r in keys], [r for i, r in keys], [stoich[key] for key in keys],
+                   formulas, term_coefs, _padded(term_parameters, len(parameters)), _padded(term_species, len(species)),
+                   term_reactions, general, constants = constants, filename = filename, names = names,
+                   compartments = compartments)
+
+
+def sbml_cache_key(filename):
+    '''Content hash of an SBML file, the libSBML version and CONVERTER_VERSION, used as the name of its cache entry'''
+    h = hashlib.sha256()
+    with open(filename, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    h.update(("%s/%d" % (getLibSBMLDottedVersion(), CONVERTER_VERSION)).encode())
+    return h.hexdigest()[:32]
+
+
+def _write_cached(path, crn):
+    # One file: 8 byte header length, JSON header (ids, formulas, generated code, array layout), then the arrays 64 byte aligned
+    arrays = [np.ascontiguousarray(getattr(crn, name)) for name in _CACHED_ARRAYS]
+    header = {"species": crn.species, "parameters": crn.parameters, "formulas": crn.formulas, "constants": crn.constants,
+              "names": crn.names, "compartments": crn.compartments,
+              "general_code": crn.general_code, "arrays": []}
+    offset = 0
+    for name, a in zip(_CACHED_ARRAYS, arrays):
+        header["arrays"].append([name, a.dtype.str, list(a.shape), offset])
+        offset += -(-a.nbytes // 64) * 64
+    encoded = json.dumps(header).encode()
+    start = -(-(8 + len(encoded)) // 64) * 64
+
+    tmp = path + ".%d.tmp" % os.getpid()
+    with open(tmp, "wb") as f:
+        f.write(np.uint64(len(encoded)).tobytes())
+        f.write(encoded)
+        for (name, dtype, shape, offset), a in zip(header["arrays"], arrays):
+            f.seek(start + offset)
+            f.write(a.tobytes())
+        f.truncate(start + (header["arrays"][-1][3] + arrays[-1].nbytes if arrays else 0))
+    os.replace(tmp, path)
+
+
+def _read_cached(path, filename):
+    # Memory-maps a file written by _write_cached, the arrays are read-only views of the map
+    buffer = np.memmap(path, dtype = np.uint8, mode = "r")
+    length = int(buffer[:8].view(np.uint64)[0])
+    header = json.loads(buffer[8:8 + length].tobytes())
+    start = -(-(8 + length) // 64) * 64
+    arrays = {}
+    for name, dtype, shape, offset in header["arrays"]:
+        dtype = np.dtype(dtype)
+        count = int(np.prod(shape))
+        arrays[name] = buffer[start + offset:start + offset + count * dtype.itemsize].view(dtype).reshape(shape)
+    structure = tuple(arrays.pop(name) for name in ["_jac_rows", "_jac_cols", "_jac_terms", "_jac_slots", "_jac_values"])
+    return SBMLCRN(header["species"], header["parameters"], formulas = header["formulas"], constants = header["constants"],
+                   names = header["names"], compartments = header["compartments"], filename = filename, jacobian_structure = structure, general_code = header["general_code"], **arrays)
+
+
+def _evict(cache_dir, max_cache_size):
+    # Removes the least recently used compiled models until the cache holds at most max_cache_size bytes
+    entries = []
+    for name in os.listdir(cache_dir):
+        if name.endswith(".crn"):
+            path = os.path.join(cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+    total = sum(size for mtime, size, path in entries)
+    for mtime, size, path in sorted(entries):
+        if total <= max_cache_size:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        total -= size
+
+
+def sbml_to_crn(filename, cache_dir = None, max_cache_size = 256 * 2**20):
+    '''A function that takes in an SBML file and returns an SBMLCRN, without using SymPy for
+    mass action rate laws. Species ids are looked up in a dictionary, the stoichiometry is
+    assembled as a sparse matrix and rate laws are read from their libSBML syntax trees.
+    Compiled models are cached in cache_dir/sbml, keyed by sbml_cache_key, so loading an unchanged
+    file again (from any notebook or process) is one memory-mapped read without libSBML conversions.
+    The least recently used entries are removed once the cache exceeds max_cache_size bytes.
+    The cache is opt-in: cache_dir = None (the default) reads the file every time, e.g. pass
+    os.path.expanduser("~/.cache/genelet") to share compiled models between notebooks.
+    Raises SBMLImportError if the file cannot be read.'''
+    if cache_dir is None:
+        return _compile_sbml(filename)
+    if not os.path.exists(filename):
+        raise SBMLImportError('SBML file ' + str(filename) + ' does not exist')
+
+    directory = os.path.join(cache_dir, "sbml")
+    path = os.path.join(directory, sbml_cache_key(filename) + ".crn")
+    if os.path.exists(path):
+        try:
+            crn = _read_cached(path, filename)
+            os.utime(path)
+            return crn
+        except (OSError, ValueError, KeyError, TypeError):
+            warnings.warn('Ignoring unreadable cached model ' + path)
+
+    crn = _compile_sbml(filename)
+    os.makedirs(directory, exist_ok = True)
+    _write_cached(path, crn)
+    _evict(directory, max_cache_size)
+    return crn
@@ -0,0 +1,187 @@
+import numpy as np
+
+
+def mass_action_channels(crn, p = None):
+    '''A function that takes an SBMLCRN (see sbml_crn.py) and returns rates, slots, S, the network
+    split into irreversible mass action channels, one per monomial of its polynomial rate laws.
+    A monomial with a negative coefficient, such as the reverse part kd * Y of the transport law
+    kb * X - kd * Y, runs its reaction backwards.
+    rates is the rate constant of every channel (coefficient times parameters, p defaults to params_values)
+    slots is the (channels x order) array of reactant species, padded with len(crn.species)
+    S is the sparse (len(species) x channels) stoichiometry of the channels
+    Reactions with non-polynomial rate laws have no channel.'''
+    from scipy.sparse import diags
+
+    p = crn.params_values if p is None else np.asarray(p, dtype = float)
+    coefs = crn.term_coefs * np.prod(np.append(p, 1.0)[crn.term_parameters], axis = 1)
+    S = (crn.stoichiometry.tocsc()[:, crn.term_reactions] @ diags(np.sign(coefs))).tocsc()
+    return np.abs(coefs), crn.term_species, S
+
+
+def hybrid_simulation(crn, timepoints, x_init = None, p = None, volume = 1.0, threshold = 100, hysteresis = 2.0,
+                      max_firings = 100, stochastic_species = None, deterministic_species = None, interval = None, method = 'BDF',
+                      rtol = 1e-4, atol = 1e-3, seed = None):
+    '''A function that simulates an SBMLCRN with low-copy species treated stochastically and the rest
+    with ODEs, and returns solutions, discrete.
+    The network is split into mass action channels (see mass_action_channels). Channels that change a
+    stochastic species fire one at a time; all other channels are integrated as ODEs, together with the
+    integral of the total propensity of the stochastic channels, and a stochastic channel fires whenever
+    that integral reaches an exponential random threshold (Haseltine and Rawlings 2002, Salis and
+    Kaznessis 2005). Species below threshold molecules are stochastic and become deterministic again above
+    threshold * hysteresis, unless a channel changing them is fast, firing more than max_firings times per
+    interval (Genelet binding steps are): fast channels are always integrated, and so are the species they
+    change. The partition is revised after every stochastic firing and at least every interval (defaults to
+    1/50 of the simulated time, rounded up to the next timepoint). Species promoted to stochastic are rounded
+    to whole molecules, up or down at random so their mean is unchanged.
+    x_init, p default to the initial conditions and parameter values of the SBML file
+    volume is the number of molecules per unit of concentration (1 treats concentrations as counts)
+    rtol, atol are the integrator tolerances, atol in molecules
+    stochastic_species, deterministic_species are lists of species ids that are never repartitioned,
+    species changed by non-polynomial rate laws are always deterministic
+    method is the stiff integrator ('BDF' or 'Radau'), given the analytic Jacobian of the
+    channels when every rate law is polynomial; it keeps its step size across stochastic firings
+    solutions is of shape (len(timepoints), n), in concentrations
+    discrete is a boolean array of the same shape marking the species that were stochastic at each timepoint'''
+    from scipy.integrate import BDF, Radau
+    from scipy.optimize import brentq
+
+    rng = np.random.default_rng(seed)
+    timepoints = np.asarray(timepoints, dtype = float)
+    n = len(crn.species)
+    T = len(timepoints)
+    p = crn.params_values if p is None else np.asarray(p, dtype = float)
+    rates, slots, S = mass_action_channels(crn, p)
+
+    # Channel propensities in molecules: rate * x1 * ... * xk / volume^(k - 1)
+
+    order = np.sum(slots < n, axis = 1)
+    rates = rates * volume ** (1.0 - order)
+    touches = abs(S).T.tocsr()
+    S_dense = S.toarray()
+
+    general = crn.general
+    S_general = crn.stoichiometry.tocsc()[:, general]
+    fixed = {}
+    for s in stochastic_species or []:
+        fixed[crn.species_index[s]] = True
+    for s in deterministic_species or []:
+        fixed[crn.species_index[s]] = False
+    for i in np.unique(S_general.indices):
+        fixed[i] = False
+
+    def propensities(x):
+        xe = np.append(np.maximum(x, 0.0), 1.0)
+        return rates * np.prod(xe[slots], axis = 1)
+
+    def general_rates(x):
+        if len(general) == 0:
+            return 0.0
+        all_rates = crn.propensities(0, np.maximum(x, 0.0) / volume, p)
+        return np.append(S_general @ all_rates[general] * volume, 0.0)
+
+    def partition(x, discrete):
+        # Threshold with hysteresis, excluding species changed by fast channels; promoted species are rounded
+        # to whole molecules without bias
+        fast = propensities(x) * interval >= max_firings
+        new = np.where(discrete, x <= threshold * hysteresis, x < threshold) & ~(touches.T @ fast.astype(float) > 0)
+        for i, value in fixed.items():
+            new[i] = value
+        promoted = new & ~discrete
+        if np.any(promoted):
+            low = np.floor(x[promoted])
+            x[promoted] = low + (rng.random(len(low)) < x[promoted] - low)
+        stochastic = touches @ new.astype(float) > 0
+        return new, stochastic
+
+    # Jacobian of the channel propensities: one entry per species slot of every channel
+
+    channel_of = np.repeat(np.arange(len(rates)), slots.shape[1])
+    slot_of = np.tile(np.arange(slots.shape[1]), len(rates))
+    used = slots.ravel() < n
+    channel_of, slot_of = channel_of[used], slot_of[used]
+
+    species_of = slots[channel_of, slot_of]
+    entries = np.arange(len(channel_of))
+
+    def propensity_jacobian(x):
+        xe = np.append(np.maximum(x, 0.0), 1.0)
+        others = xe[slots[channel_of]]
+        others[entries, slot_of] = 1.0
+        dA = np.zeros((len(rates), n))
+        np.add.at(dA, (channel_of, species_of), rates[channel_of] * np.prod(others, axis = 1))
+        return dA
+
+    x = np.asarray(crn.x_init if x_init is None else x_init, dtype = float) * volume
+    solutions = np.empty((T, n))
+    discrete_out = np.zeros((T, n), dtype = bool)
+    interval = (timepoints[-1] - timepoints[0]) / 50 if interval is None else interval
+    discrete, stochastic = partition(x, np.zeros(n, dtype = bool))
+    if method not in ('BDF', 'Radau'):
+        raise RuntimeError('Hybrid simulation method must be BDF or Radau')
+    solver_class = BDF if method == 'BDF' else Radau
+
+    t = timepoints[0]
+    record = 0
+    while record < T and timepoints[record] <= t:
+        solutions[record], discrete_out[record] = x / volume, discrete
+        record += 1
+
+    # Integrate to the next stochastic firing or the end of the interval, keeping the step size across restarts
+
+    integral, target = 0.0, rng.exponential()
+    step = None
+    while record < T:
+
+        # Dense arrays: liposome models have tens of species, too few for sparse algebra to pay off
+
+        S_deterministic = S_dense * (stochastic == False)
+        weights = np.vstack([S_deterministic, stochastic.astype(float)])
+
+        def rhs(t, y):
+            return weights @ propensities(y[:n]) + general_rates(y[:n])
+
+        def jac(t, y):
+            J = np.zeros((n + 1, n + 1))
+            J[:, :n] = weights @ propensity_jacobian(y[:n])
+            return J
+
+        end = timepoints[min(np.searchsorted(timepoints, t + interval), T - 1)]
+        solver = solver_class(rhs, t, np.append(x, integral), end, rtol = rtol, atol = atol,
+                              jac = None if len(general) else jac,
+                              first_step = None if step is None else min(step, end - t))
+        fired = None
+        while solver.status == 'running':
+            t_old = solver.t
+            message = solver.step()
+            if solver.status == 'failed':
+                raise RuntimeError('Simulation failed: ' + str(message))
+            dense = None
+            if solver.y[n] >= target:
+                dense = solver.dense_output()
+                fired = brentq(lambda s: dense(s)[n] - target, t_old, solver.t) if dense(t_old)[n] < target else t_old
+            last = solver.t if fired is None else fired
+            while record < T and timepoints[record] <= last:
+                dense = dense or solver.dense_output()
+                solutions[record], discrete_out[record] = np.maximum(dense(timepoints[record])[:n], 0.0) / volume, discrete
+                record += 1
+            if fired is not None:
+                break
+        step = solver.step_size if solver.step_size else step
+
+        if fired is not None:
+            t = fired
+            x = np.maximum(dense(fired)[:n], 0.0)
+            a = propensities(x) * stochastic
+            if a.sum() > 0:
+                j = min(np.searchsorted(np.cumsum(a), rng.random() * a.sum(), side = 'right'), len(a) - 1)
+                x[S.indices[S.indptr[j]:S.indptr[j + 1]]] += S.data[S.indptr[j]:S.indptr[j + 1]]
+                x = np.maximum(x, 0.0)
+            integral, target = 0.0, rng.exponential()
+        else:
+            t = solver.t
+            x = np.maximum(solver.y[:n], 0.0)
+            integral = solver.y[n]
+
+        discrete, stochastic = partition(x, discrete)
+
+    return solutions, discrete_out
@@ -0,0 +1,364 @@
+import numpy as np
+
+# Smallest pivot of the unpivoted cell block elimination of _bordered_lu, relative to the largest entry of its
+# cell block; a smaller pivot falls back to a general sparse LU
+PIVOT_TOLERANCE = 1e-6
+
+
+def _mapped_terms(crn, index, one, p):
+    # Monomials of crn with its species renumbered through index; padding slots point at one
+    p = crn.params_values if p is None else np.asarray(p, dtype = float)
+    coefs = crn.term_coefs * np.prod(np.append(p, 1.0)[crn.term_parameters], axis = 1)
+    mapping = np.append(index, one)
+    return coefs, mapping[crn.term_species]
+
+
+def poisson_loading(concentrations, n_cells, molecules, seed = None):
+    '''A function that returns the concentrations encapsulated in n_cells liposomes, each species a
+    Poisson number of molecules around its mean, as a dictionary of species -> array of n_cells values.
+    concentrations is a dictionary of species -> mean concentration
+    molecules is the number of molecules per unit of concentration in one liposome, either one value
+    or an array of n_cells values for liposomes of different sizes'''
+    rng = np.random.default_rng(seed)
+    molecules = np.broadcast_to(np.asarray(molecules, dtype = float), (n_cells,))
+    return {s: rng.poisson(c * molecules) / molecules for s, c in concentrations.items()}
+
+
+class LiposomePopulation:
+    '''N liposomes, each with its own copy of an internal CRN and a membrane, exchanging species
+    with one shared external reservoir, integrated as a single vectorized ODE system.
+    internal, membrane, reservoir are SBMLCRNs (see sbml_crn.py), e.g. of NOR_CRN.xml, membrane.xml
+    and rI4_external_reservoir.xml. As in subsbml, membrane species are matched by name: those in
+    the 'internal' compartment to species of the internal CRN, those in the 'external' compartment to
+    species of the reservoir; membrane species without a match (e.g. transport proteins) are added
+    to every cell or to the reservoir.
+    Every cell has the state of the internal CRN and of its own membrane, the reservoir has one state.
+    Species moved across a membrane change the reservoir concentration by the cell volume over the
+    reservoir volume, so the reservoir sees the sum of the transport of every cell.
+    n_cells is the number of liposomes
+    x_init gives the initial conditions of the cells: an (n_cells x len(species)) array, or a
+    dictionary of species name or id -> value or array of n_cells values (see poisson_loading) that
+    overrides the initial conditions of the SBML files
+    reservoir_init is a dictionary of reservoir species name or id -> value
+    cell_volume (one value or n_cells values) and reservoir_volume default to the compartment sizes
+    of the internal and reservoir SBML files
+    internal_p, membrane_p, reservoir_p are parameter values of each CRN (default params_values)
+    Only polynomial (mass action) rate laws are supported.'''
+    def __init__(self, internal, membrane, reservoir, n_cells, x_init = None, reservoir_init = None, cell_volume = None,
+                 reservoir_volume = None, internal_p = None, membrane_p = None, reservoir_p = None):
+        from scipy.sparse import csr_matrix
+
+        for crn in (internal, membrane, reservoir):
+            if len(crn.general):
+                raise RuntimeError('LiposomePopulation only supports polynomial rate laws, ' + str(crn.filename) + ' has others')
+        self.internal, self.membrane, self.reservoir = internal, membrane, reservoir
+        self.n_cells = N = int(n_cells)
+
+        # Species of every cell: the internal CRN then unmatched internal membrane species.
+        # Shared species: the reservoir then unmatched external membrane species.
+
+        self.species = list(internal.species)
+        self.names = list(internal.names)
+        self.reservoir_species = list(reservoir.species)
+        self.reservoir_names = list(reservoir.names)
+        by_name = {name: i for i, name in enumerate(internal.names)}
+        shared_by_name = {name: i for i, name in enumerate(reservoir.names)}
+        membrane_index = np.empty(len(membrane.species), dtype = int)
+        membrane_shared = np.zeros(len(membrane.species), dtype = bool)
+        x0 = list(internal.x_init)
+        e0 = list(reservoir.x_init)
+        for i, (s, name, compartment) in enumerate(zip(membrane.species, membrane.names, membrane.compartments)):
+            if compartment == 'internal':
+                if name not in by_name:
+                    by_name[name] = len(self.species)
+                    self.species.append(s)
+                    self.names.append(name)
+                    x0.append(membrane.x_init[i])
+                membrane_index[i] = by_name[name]
+            elif compartment == 'external':
+                if name not in shared_by_name:
+                    shared_by_name[name] = len(self.reservoir_species)
+                    self.reservoir_species.append(s)
+                    self.reservoir_names.append(name)
+                    e0.append(membrane.x_init[i])
+                membrane_index[i] = shared_by_name[name]
+                membrane_shared[i] = True
+            else:
+                raise RuntimeError('Membrane species ' + s + ' must be in the internal or external compartment, not ' + str(compartment))
+        L = self.n_local = len(self.species)
+        R = self.n_shared = len(self.reservoir_species)
+        one = L + R
+
+        # Cell reactions (internal and membrane) over the extended species [cell species, shared species, 1]
+
+        coefs, slots = _mapped_terms(internal, np.arange(len(internal.species)), one, internal_p)
+        m_coefs, m_slots = _mapped_terms(membrane, np.where(membrane_shared, L + membrane_index, membrane_index), one, membrane_p)
+        width = max(slots.shape[1], m_slots.shape[1])
+        pad = lambda a: np.hstack([a, np.full((len(a), width - a.shape[1]), one, dtype = int)])
+        self._coefs = np.concatenate([coefs, m_coefs])
+        self._slots = np.vstack([pad(slots), pad(m_slots)])
+        n_internal = len(internal.formulas)
+        self._term_reactions = np.concatenate([internal.term_reactions, n_internal + membrane.term_reactions])
+        n_reactions = n_internal + len(membrane.formulas)
+        self._terms_to_reactions = csr_matrix((np.ones(len(self._coefs)), (np.arange(len(self._coefs)), self._term_reactions)),
+                                              shape = (len(self._coefs), n_reactions))
+
+        rows = np.concatenate([internal.stoich_rows, np.where(membrane_shared, L + membrane_index, membrane_index)[membrane.stoich_rows]])
+        cols = np.concatenate([internal.stoich_cols, n_internal + membrane.stoich_cols])
+        values = np.concatenate([internal.stoich_values, membrane.stoich_values])
+        S = csr_matrix((values, (rows, cols)), shape = (L + R, n_reactions))
+        self._S_local = S[:L].T.tocsr()
+        self._S_shared = S[L:].tocsr()
+        self._reservoir_p = reservoir.params_values if reservoir_p is None else np.asarray(reservoir_p, dtype = float)
+
+        # Volumes: transport changes the reservoir by cell volume / reservoir volume
+
+        internal_size = [size for c, size in internal.constants.items() if c in set(internal.compartments)]
+        reservoir_size = [size for c, size in reservoir.constants.items() if c in set(reservoir.compartments)]
+        cell_volume = (internal_size[0] if internal_size else 1.0) if cell_volume is None else cell_volume
+        reservoir_volume = (reservoir_size[0] if reservoir_size else 1.0) if reservoir_volume is None else reservoir_volume
+        self.cell_volume = np.broadcast_to(np.asarray(cell_volume, dtype = float), (N,)).copy()
+        self.reservoir_volume = float(reservoir_volume)
+        self.volume_ratio = self.cell_volume / self.reservoir_volume
+
+        # Initial states
+
+        self.x0 = np.tile(np.asarray(x0, dtype = float), (N, 1))
+        if isinstance(x_init, dict):
+            index = {**{s: i for i, s in enumerate(self.species)}, **{n: i for i, n in enumerate(self.names)}}
+            for s, value in x_init.items():
+                if s not in index:
+                    raise RuntimeError('Unknown cell species ' + str(s))
+                self.x0[:, index[s]] = value
+        elif x_init is not None:
+            self.x0 = np.asarray(x_init, dtype = float).reshape(N, L).copy()
+        self.e0 = np.asarray(e0, dtype = float)
+        if reservoir_init is not None:
+            index = {**{s: i for i, s in enumerate(self.reservoir_species)}, **{n: i for i, n in enumerate(self.reservoir_names)}}
+            for s, value in reservoir_init.items():
+                if s not in index:
+                    raise RuntimeError('Unknown reservoir species ' + str(s))
+                self.e0[index[s]] = value
+
+        self._jacobian_structure()
+
+    def _extended(self, y):
+        # (n_cells x (cell species + shared species + 1)) array of every cell's view of the state
+        N, L, R = self.n_cells, self.n_local, self.n_shared
+        Z = np.empty((N, L + R + 1))
+        Z[:, :L] = y[:N * L].reshape(N, L)
+        Z[:, L:L + R] = y[N * L:]
+        Z[:, -1] = 1.0
+        return Z
+
+    def _reservoir_rhs(self, e):
+        out = np.zeros(self.n_shared)
+        if len(self.reservoir.formulas):
+            out[:len(self.reservoir.species)] = self.reservoir.fun(0, e[:len(self.reservoir.species)], self._reservoir_p)
+        return out
+
+    def rhs(self, t, y):
+        '''Time derivative of the state y: every cell's species (cell-major), then the shared species'''
+        N, L = self.n_cells, self.n_local
+        Z = self._extended(y)
+        terms = self._coefs * np.prod(Z[:, self._slots], axis = 2)
+        rates = (self._terms_to_reactions.T @ terms.T).T
+        dX = (self._S_local.T @ rates.T).T
+        dE = self._S_shared @ (rates.T @ self.volume_ratio) + self._reservoir_rhs(y[N * L:])
+        return np.concatenate([dX.ravel(), dE])
+
+    def _jacobian_structure(self):
+        # Entries of d(rhs)/d(state): for every species slot of every term, one entry per stoichiometry entry of its reaction
+        N, L, R = self.n_cells, self.n_local, self.n_shared
+        S = self._S_local.T.tocsc()
+        S_shared = self._S_shared.tocsc()
+        e_term, e_slot, e_row, e_value = [], [], [], []
+        for slot in range(self._slots.shape[1]):
+            for term in np.nonzero(self._slots[:, slot] < L + R)[0]:
+                r = self._term_reactions[term]
+                for matrix, offset in ((S, 0), (S_shared, L)):
+                    rows = matrix.indices[matrix.indptr[r]:matrix.indptr[r + 1]]
+                    e_term.append(np.full(len(rows), term))
+                    e_slot.append(np.full(len(rows), slot))
+                    e_row.append(rows + offset)
+                    e_value.append(matrix.data[matrix.indptr[r]:matrix.indptr[r + 1]])
+        self._e_term = np.concatenate(e_term + [np.zeros(0, dtype = int)]).astype(int)
+        self._e_slot = np.concatenate(e_slot + [np.zeros(0, dtype = int)]).astype(int)
+        e_row = np.concatenate(e_row + [np.zeros(0, dtype = int)]).astype(int)
+        e_col = self._slots[self._e_term, self._e_slot]
+        self._e_value = np.concatenate(e_value + [np.zeros(0)]) * self._coefs[self._e_term]
+        self._e_shared_row = e_row >= L
+
+        # Global row and column of every entry in every cell: cell species of cell k at k * L, shared species at N * L
+
+        cells = np.arange(N)[:, np.newaxis]
+        self._jac_rows = np.where(e_row < L, cells * L + e_row, N * L + e_row - L).ravel()
+        self._jac_cols = np.where(e_col < L, cells * L + e_col, N * L + e_col - L).ravel()
+        self._block_elimination()
+
+    def jacobian(self, t, y):
+        '''Sparse Jacobian of rhs: one block per cell, coupled through the shared species'''
+        from scipy.sparse import csc_matrix
+
+        N, L, R = self.n_cells, self.n_local, self.n_shared
+        Z = self._extended(y)
+        others = Z[:, self._slots[self._e_term]]
+        others[:, np.arange(len(self._e_term)), self._e_slot] = 1.0
+        values = self._e_value * np.prod(others, axis = 2)
+        values[:, self._e_shared_row] *= self.volume_ratio[:, np.newaxis]
+        J = csc_matrix((values.ravel(), (self._jac_rows, self._jac_cols)), shape = (N * L + R, N * L + R))
+        if len(self.reservoir.formulas):
+            n_r = len(self.reservoir.species)
+            J_r = self.reservoir.jac_sparse(0, y[N * L:N * L + n_r], self._reservoir_p).tocoo()
+            J = J + csc_matrix((J_r.data, (N * L + J_r.row, N * L + J_r.col)), shape = J.shape)
+        return J
+
+    def _block_elimination(self):
+        # Every cell block of the Newton matrix I - c J has the sparsity of the cell Jacobian: order it by
+        # minimum degree once and record, for every pivot, the rows and columns it updates (fill included)
+        N, L = self.n_cells, self.n_local
+        local = (self._jac_rows < N * L) & (self._jac_cols < N * L) & (self._jac_rows < L)
+        pattern = np.eye(L, dtype = bool)
+        pattern[self._jac_rows[local], self._jac_cols[local]] = True
+        graph = pattern | pattern.T
+        remaining = list(range(L))
+        order = []
+        while remaining:
+            i = min(remaining, key = lambda i: graph[i, remaining].sum())
+            neighbours = [j for j in remaining if graph[i, j]]
+            graph[np.ix_(neighbours, neighbours)] = True
+            order.append(i)
+            remaining.remove(i)
+        self._order = np.array(order)
+        filled = pattern[np.ix_(self._order, self._order)]
+        self._pivot_rows, self._pivot_cols = [], []
+        for k in range(L):
+            rows = k + 1 + np.nonzero(filled[k + 1:, k])[0]
+            cols = k + 1 + np.nonzero(filled[k, k + 1:])[0]
+            filled[np.ix_(rows, cols)] = True
+            self._pivot_rows.append(rows)
+            self._pivot_cols.append(cols)
+
+    def _block_solve(self, LU, b):
+        # Solve every cell block at once with the factors of _bordered_lu, b of shape (n_cells, L, m);
+        # factors and right-hand sides are stored species-major so every update is contiguous over cells
+        x = np.ascontiguousarray(b.transpose(1, 2, 0)[self._order])
+        for k, rows in enumerate(self._pivot_rows):
+            x[rows] -= LU[rows, k][:, np.newaxis] * x[k]
+        for k in range(len(self._order) - 1, -1, -1):
+            cols = self._pivot_cols[k]
+            x[k] = (x[k] - np.einsum('jk,jmk->mk', LU[k, cols], x[cols])) / LU[k, k]
+        out = np.empty_like(x)
+        out[self._order] = x
+        return out.transpose(2, 0, 1)
+
+    def _bordered_lu(self, A):
+        # Factor A = I - c J by blocks: one (cell species x cell species) block per cell, the borders
+        # B (cell -> shared) and C (shared -> cell) and the shared block D, eliminated through the Schur
+        # complement D - sum_k C_k inv(A_k) B_k, so the cost grows linearly with the number of cells.
+        # The cell blocks are factored without pivoting in the minimum degree order of _block_elimination,
+        # vectorized over cells. If a pivot is small relative to its cell block (PIVOT_TOLERANCE) the elimination
+        # would be unstable, and A is factored by scipy's sparse LU (with partial pivoting) instead.
+        N, L, R = self.n_cells, self.n_local, self.n_shared
+        n = N * L
+        A = A.tocoo()
+        row, col, value = A.row, A.col, A.data
+        local_row, local_col = row < n, col < n
+        position = np.argsort(self._order)
+        m = local_row & local_col
+        LU = np.bincount(position[row[m] % L] * L * N + position[col[m] % L] * N + row[m] // L, value[m], L * L * N).reshape(L, L, N)
+        m = local_row & ~local_col
+        B = np.bincount(row[m] * R + col[m] - n, value[m], N * L * R).reshape(N, L, R)
+        m = ~local_row & local_col
+        C = np.bincount((col[m] // L) * R * L + (row[m] - n) * L + col[m] % L, value[m], N * R * L).reshape(N, R, L)
+        m = ~local_row & ~local_col
+        D = np.bincount((row[m] - n) * R + col[m] - n, value[m], R * R).reshape(R, R)
+        threshold = PIVOT_TOLERANCE * np.abs(LU).max(axis = (0, 1))
+        for k, (rows, cols) in enumerate(zip(self._pivot_rows, self._pivot_cols)):
+            if not np.all(np.abs(LU[k, k]) > threshold):
+                return self._general_lu(A)
+            LU[rows, k] /= LU[k, k]
+            LU[rows[:, np.newaxis], cols] -= LU[rows, k][:, np.newaxis] * LU[k, cols][np.newaxis]
+        if not np.all(np.isfinite(LU)):
+            return self._general_lu(A)
+        inverse_B = self._block_solve(LU, B)
+        schur = D - np.einsum('kri,kis->rs', C, inverse_B)
+        return LU, inverse_B, C, np.linalg.inv(schur)
+
+    def _general_lu(self, A):
+        # Fallback of _bordered_lu: sparse LU of the whole Newton matrix
+        from scipy.sparse.linalg import splu
+
+        return splu(A.tocsc())
+
+    def _bordered_solve(self, factors, b):
+        if not isinstance(factors, tuple):
+            return factors.solve(b)
+        LU, inverse_B, C, schur_inverse = factors
+        N, L = self.n_cells, self.n_local
+        y = self._block_solve(LU, b[:N * L].reshape(N, L, 1))[:, :, 0]
+        e = schur_inverse @ (b[N * L:] - np.einsum('kri,ki->r', C, y))
+        return np.concatenate([(y - inverse_B @ e).ravel(), e])
+
+    def solver(self):
+        '''A function that returns a BDF solver class for solve_ivp that factors its Newton matrices
+        by blocks (see _bordered_lu) instead of with a general sparse LU'''
+        from scipy.integrate import BDF
+
+        population = self
+
+        # BDF factors and solves its Newton systems through the lu and solve_lu attributes it sets in __init__.
+        # They are private to scipy (checked against scipy 1.17), so this override relies on their signatures.
+        class PopulationBDF(BDF):
+            def __init__(self, *args, **kwargs):
+                super().__init__(*args, **kwargs)
+
+                def lu(A):
+                    self.nlu += 1
+                    return population._bordered_lu(A)
+
+                self.lu = lu
+                self.solve_lu = population._bordered_solve
+
+        return PopulationBDF
+
+    def initial_state(self):
+        '''Initial state vector in the order of rhs'''
+        return np.concatenate([self.x0.ravel(), self.e0])
+
+    def simulate(self, timepoints, species = None, reservoir_species = None, method = 'BDF', rtol = 1e-6, atol = 1e-9):
+        '''A function that integrates the population over timepoints and returns cells, reservoir.
+        species, reservoir_species are lists of cell and reservoir species names or ids to return
+        (default all, in the order of the species and reservoir_species attributes)
+        cells is of shape (len(timepoints), n_cells, len(species))
+        reservoir is of shape (len(timepoints), len(reservoir_species))
+        method 'BDF' uses the block solver of the population (see solver), 'Radau' is given the sparse
+        Jacobian and 'LSODA', which only takes dense Jacobians, the dense form of it'''
+        from scipy.integrate import solve_ivp
+
+        N, L = self.n_cells, self.n_local
+        columns = self._columns(species, self.species, self.names)
+        reservoir_columns = self._columns(reservoir_species, self.reservoir_species, self.reservoir_names)
+        timepoints = np.asarray(timepoints, dtype = float)
+        if method in ('BDF', 'Radau'):
+            jac = self.jacobian
+        elif method == 'LSODA':
+            jac = lambda t, y: self.jacobian(t, y).toarray()
+        else:
+            jac = None
+        sol = solve_ivp(self.rhs, (timepoints[0], timepoints[-1]), self.initial_state(), method = self.solver() if method == 'BDF' else method, t_eval = timepoints,
+                        jac = jac, rtol = rtol, atol = atol)
+        if not sol.success:
+            raise RuntimeError('Simulation failed: ' + sol.message)
+        cells = sol.y[:N * L].T.reshape(len(sol.t), N, L)[:, :, columns]
+        return cells, sol.y[N * L:].T[:, reservoir_columns]
+
+    @staticmethod
+    def _columns(selection, ids, names):
+        if selection is None:
+            return np.arange(len(ids))
+        index = {**{s: i for i, s in enumerate(ids)}, **{n: i for i, n in enumerate(names)}}
+        missing = [s for s in selection if s not in index]
+        if missing:
+            raise RuntimeError('Unknown species: ' + ", ".join(map(str, missing)))
+        return np.array([index[s] for s in selection], dtype = int)
@@ -1,110 +1,186 @@
-from sympy import Symbol,sympify
-from libsbml import *
-import sys
+from sympy import Symbol,sympify,Matrix,cse
+from sbml_crn import sbml_to_crn, _numpy_printer
 import numpy as np
 
-def sbml_to_ode2(filename):
+def sbml_to_ode2(filename, cache_dir = None):
     '''A function that takes in an SBML file and returns x,f,P,params_values.
     x is a list of species written as Sympy objects
     f is a list of functions written as Sympy objects
     P is a list of parameters written as Sympy objects
     params_values is a list of parameter values, in the same order as P
-    x_init is a list of initial conditions, in the same order as x'''
-
-    # Get the sbml file, check for errors, and perform conversions
-    doc = readSBMLFromFile(filename)
-    if doc.getNumErrors(LIBSBML_SEV_FATAL):
-        print('Encountered serious errors while reading file')
-        print(doc.getErrorLog().toString())
-        sys.exit(1)
-    
-    doc.getErrorLog().clearLog()
-    
-    # Convert local params to global params
-    props = ConversionProperties()
-    props.addOption("promoteLocalParameters", True)
-  
-    if doc.convert(props) != LIBSBML_OPERATION_SUCCESS: 
-        print('The document could not be converted')
-        print(doc.getErrorLog().toString())
-    
-    # Expand initial assignments
-    props = ConversionProperties()
-    props.addOption("expandInitialAssignments", True)
-  
-    if doc.convert(props) != LIBSBML_OPERATION_SUCCESS: 
-        print('The document could not be converted')
-        print(doc.getErrorLog().toString())
-    
-    # Expand functions definitions
-    props = ConversionProperties()
-    props.addOption("expandFunctionDefinitions", True)
-  
-    if doc.convert(props) != LIBSBML_OPERATION_SUCCESS: 
-        print('The document could not be converted')
-        print(doc.getErrorLog().toString())
-    
-    # Get model and define importnat lists, dictionaries
-    mod = doc.getModel()
-    x = []
-    x_init = []
-    P = []
-    params_values = []
-    reactions = {}
- 
-    # Append species symbol to 'x' and append initial amount/concentration to x_init
-    # x[i] corresponds to x_init[i]
-    for i in range(mod.getNumSpecies()): 
-        species = mod.getSpecies(i)
-        x.append(Symbol(species.getId()))
-        if species.isSetInitialConcentration():
-            x_init.append(species.getInitialConcentration())
-        elif species.isSetInitialAmount():
-            x_init.append(species.getInitialAmount())
-        else:
-            x_init.append(0)
-
-    # Append parameter symbol to 'P' and parameter values to 'params_values'
-    for i in range(mod.getNumParameters()): 
-        params = mod.getParameter(i)
-        params_values.append(params.getValue())
-        P.append(Symbol(params.getId()))
-
-    
-    
-    
-    # Get kinetic formula for each reaction, store in dictionary 'reactions'
-    for i in range(mod.getNumReactions()): 
-        reaction = mod.getReaction(i)
-        kinetics = reaction.getKineticLaw()
-        reactions[reaction.getId()] = sympify(kinetics.getFormula())
-
-    # Define f
-    f = [0] * len(x)
-    
-    # Loop to define functions in 'f'
-    for i in range(mod.getNumReactions()): 
-        reaction = mod.getReaction(i)
-        # subtract reactant kinetic formula
-        for j in range(reaction.getNumReactants()):
-            ref = reaction.getReactant(j)
-            species = sympify(mod.getSpecies(ref.getSpecies()).getId())
-            curr_index = x.index(species)
-            # Check stoichiometry
-            if ref.getStoichiometry() == 1.0:  
-                f[curr_index] += -reactions[reaction.getId()]
-            else:
-                f[curr_index] += -reactions[reaction.getId()] * ref.getStoichiometry()
-        # add product kinetic formula
-        for j in range(reaction.getNumProducts()):
-            ref = reaction.getProduct(j)
-            species = sympify(mod.getSpecies(ref.getSpecies()).getId())
-            curr_index = x.index(species)
-            # Check stoichiometry
-            if ref.getStoichiometry() == 1.0: 
-                f[curr_index] += +reactions[reaction.getId()]
-            else:
-                f[curr_index] += +reactions[reaction.getId()] * ref.getStoichiometry()
-
-
-    return x,f,P,params_values,x_init
\ No newline at end of file
+    x_init is a list of initial conditions, in the same order as x
+    Raises sbml_crn.SBMLImportError (a RuntimeError) if the file cannot be read.
+    The file is read by sbml_to_crn, see sbml_crn.py for the numeric form of the network
+    that does not need SymPy. Compiled models are cached in cache_dir if one is given (see sbml_to_crn).'''
+    return sbml_to_crn(filename, cache_dir = cache_dir).symbolic()
+
+
+def _compile_values(x, P, exprs, name, out):
+    '''Generates and compiles a NumPy function name(t, x, p) that evaluates exprs.
+    Species and parameter symbols are renamed to x[i] and p[j] lookups and common
+    subexpressions are evaluated once. out is the source of the array the values are
+    written into, it may refer to x, p and shape.'''
+    t = Symbol('t')
+    names = {t: Symbol('t')}
+    prelude = []
+    for i, s in enumerate(x):
+        names[s] = Symbol('_x%d' % i)
+    for j, s in enumerate(P):
+        names[s] = Symbol('_p%d' % j)
+
+    exprs = [sympify(e).xreplace(names) for e in exprs]
+    replacements, reduced = cse(exprs, symbols = (Symbol('_c%d' % i) for i in range(10**9)))
+
+    used = set()
+    for e in [r for _, r in replacements] + reduced:
+        used |= {s.name for s in e.free_symbols}
+    for i in range(len(x)):
+        if '_x%d' % i in used:
+            prelude.append('    _x%d = x[%d]' % (i, i))
+    for j in range(len(P)):
+        if '_p%d' % j in used:
+            prelude.append('    _p%d = p[%d]' % (j, j))
+
+    printer = _numpy_printer()
+    lines = ['def %s(t, x, p):' % name]
+    lines += prelude
+    for sym, e in replacements:
+        lines.append('    %s = %s' % (sym, printer.doprint(e)))
+    lines.append('    shape = np.shape(x)[1:]')
+    lines.append('    out = %s' % out)
+    for i, e in enumerate(reduced):
+        if e != 0:
+            lines.append('    out[%d] = %s' % (i, printer.doprint(e)))
+    lines.append('    return out')
+
+    namespace = {'np': np, 'numpy': np}
+    exec('\n'.join(lines), namespace)
+    return namespace[name]
+
+
+def ode_functions(x, f, P):
+    '''A function that takes the x, f, P output of sbml_to_ode2 and returns fun, jac, jac_sparse, sparsity.
+    fun(t, x, p) is the right hand side of the ODE as a NumPy array. It also accepts x of
+    shape (n, m) to evaluate m states at once (solve_ivp vectorized = True)
+    jac(t, x, p) is the Jacobian df/dx, derived symbolically, as a dense n x n array
+    jac_sparse(t, x, p) is the same Jacobian as a scipy.sparse csc_matrix
+    sparsity is the structural nonzero pattern of the Jacobian as a csc_matrix of ones
+    p is the list of parameter values, in the same order as P (params_values from sbml_to_ode2)
+    All functions can be passed straight to the stiff solvers, e.g.
+    solve_ivp(fun, (t0, t1), x_init, method = 'BDF', jac = jac_sparse, args = (params_values,))'''
+    from scipy.sparse import csc_matrix
+
+    n = len(x)
+    fun = _compile_values(x, P, f, 'fun', 'np.zeros((%d,) + shape)' % n)
+    rows, cols, nonzeros = _sparse_derivative(x, P, f, x, 'jac_nonzeros')
+    sparsity = csc_matrix((np.ones(len(rows)), (rows, cols)), shape = (n, n))
+
+    def jac(t, x, p):
+        out = np.zeros((n, n))
+        out[rows, cols] = nonzeros(t, x, p)
+        return out
+
+    def jac_sparse(t, x, p):
+        return csc_matrix((nonzeros(t, x, p), (rows, cols)), shape = (n, n))
+
+    return fun, jac, jac_sparse, sparsity
+
+
+def parameter_jacobian(x, f, P):
+    '''A function that takes the x, f, P output of sbml_to_ode2 and returns dfdp, dfdp_sparse.
+    dfdp(t, x, p) is the derivative of the ODE right hand side with respect to the
+    parameters, derived symbolically, as a dense n x len(P) array
+    dfdp_sparse(t, x, p) is the same matrix as a scipy.sparse csc_matrix'''
+    from scipy.sparse import csc_matrix
+
+    n = len(x)
+    rows, cols, nonzeros = _sparse_derivative(x, P, f, P, 'dfdp_nonzeros')
+
+    def dfdp(t, x, p):
+        out = np.zeros((n, len(P)))
+        out[rows, cols] = nonzeros(t, x, p)
+        return out
+
+    def dfdp_sparse(t, x, p):
+        return csc_matrix((nonzeros(t, x, p), (rows, cols)), shape = (n, len(P)))
+
+    return dfdp, dfdp_sparse
+
+
+def _sparse_derivative(x, P, f, wrt, name):
+    '''Symbolic derivative of f with respect to the symbols in wrt, returned as the row
+    and column indices of its structural nonzeros and a compiled function name(t, x, p)
+    that evaluates them'''
+    D = Matrix(f).jacobian(Matrix(wrt))
+    rows, cols, entries = [], [], []
+    for (i, j), e in sorted(D.todok().items()):
+        if e != 0:
+            rows.append(i)
+            cols.append(j)
+            entries.append(e)
+    nonzeros = _compile_values(x, P, entries, name, 'np.zeros(%d)' % len(entries))
+    return np.array(rows, dtype = int), np.array(cols, dtype = int), nonzeros
+
+
+def conservation_laws(x, f):
+    '''A function that takes the x, f output of sbml_to_ode2 and returns laws, dependent.
+    laws is a list of linear invariants of the ODE, each a dictionary of species symbol -> rational coefficient
+    such that sum(c * x) is constant along every trajectory (e.g. total switch DNA, RNAP, RNAseH).
+    They are found exactly as the left null space of the matrix of coefficients of every rate term in f.
+    dependent is a list of one species per law: it has coefficient 1 in its own law and 0 in every other law.'''
+    from sympy import expand
+
+    terms = {}
+    rows = []
+    for fi in f:
+        row = {}
+        for term, coef in expand(sympify(fi)).as_coefficients_dict().items():
+            j = terms.setdefault(term, len(terms))
+            row[j] = row.get(j, 0) + coef
+        rows.append(row)
+
+    # Rows of the null space of M^T, M being the (species x rate terms) coefficient matrix
+    M = Matrix(len(terms), len(x), lambda j, i: rows[i].get(j, 0))
+    null = M.nullspace()
+    if not null:
+        return [], []
+    B = Matrix.hstack(*null).T.rref()[0]
+
+    laws = []
+    dependent = []
+    for r in range(B.rows):
+        law = {x[i]: B[r, i] for i in range(len(x)) if B[r, i] != 0}
+        laws.append(law)
+        dependent.append(next(iter(law)))
+    return laws, dependent
+
+
+def conservation_reduction(x, f, P, params_values, x_init):
+    '''A function that takes the output of sbml_to_ode2 and returns the same outputs for the
+    ODE with one dependent species per conservation law eliminated, plus full_state.
+    Each dependent species is replaced in f by its conserved total minus the rest of its law.
+    The totals are appended to P as parameters named total_<species> (so sensitivities with
+    respect to them can be computed) with their values set by x_init.
+    full_state(solutions, p) maps solutions of the reduced ODE, of shape (len(timepoints), len(x_reduced)),
+    back to solutions for every species of x, p defaulting to the reduced params_values.'''
+    laws, dependent = conservation_laws(x, f)
+    values = dict(zip(x, x_init))
+    totals = [Symbol('total_' + s.name) for s in dependent]
+
+    substitution = {}
+    for law, s, total in zip(laws, dependent, totals):
+        substitution[s] = total - sum(c * y for y, c in law.items() if y != s)
+
+    x_reduced = [s for s in x if s not in substitution]
+    f_reduced = [sympify(fi).xreplace(substitution) for s, fi in zip(x, f) if s not in substitution]
+    P_reduced = list(P) + totals
+    params_reduced = list(params_values) + [float(sum(c * values[y] for y, c in law.items())) for law in laws]
+    x_init_reduced = [v for s, v in zip(x, x_init) if s not in substitution]
+
+    state = _compile_values(x_reduced, P_reduced, [substitution.get(s, s) for s in x], 'full_state_values',
+                            'np.zeros((%d,) + shape)' % len(x))
+
+    def full_state(solutions, p = params_reduced):
+        return state(0, np.asarray(solutions, dtype = float).T, p).T
+
+    return x_reduced, f_reduced, P_reduced, params_reduced, x_init_reduced, full_state
@@ -0,0 +1,60 @@
+from sbml_to_ode2 import ode_functions, parameter_jacobian
+import numpy as np
+
+
+def forward_sensitivity(x, f, P, params_values, x_init, timepoints, normalize = False, method = 'BDF', rtol = 1e-6, atol = 1e-9):
+    '''A function that takes the x, f, P output of sbml_to_ode2 and returns solutions, SSM.
+    The state x and the sensitivities S_j = dx/dp_j for every parameter are integrated
+    together as one augmented ODE, dS_j/dt = J S_j + df/dp_j with S_j(0) = 0, using the
+    symbolic Jacobians of f. This replaces compute_J, compute_Zj and the per timepoint,
+    per parameter re-integration of compute_SSM with a single solve.
+    solutions is of shape (len(timepoints), n)
+    SSM is the sensitivity matrix of size len(timepoints) x len(P) x n
+    If normalize is true, the coefficients are normalized by the nominal value of each
+    parameter and the corresponding state (see normalize_SSM).'''
+    from scipy.integrate import solve_ivp
+    from scipy.sparse import identity, kron
+
+    n = len(x)
+    m = len(P)
+    p = np.asarray(params_values, dtype = float)
+    fun, jac, jac_sparse, sparsity = ode_functions(x, f, P)
+    dfdp, dfdp_sparse = parameter_jacobian(x, f, P)
+
+    # Augmented state: x followed by S_1, ..., S_m, each a contiguous block of n entries
+
+    def augmented(t, y):
+        xs = y[:n]
+        S = y[n:].reshape(m, n).T
+        dS = jac_sparse(t, xs, p) @ S + dfdp(t, xs, p)
+        return np.concatenate([fun(t, xs, p), dS.T.ravel()])
+
+    # Newton iterations only need an approximate Jacobian: keep the J blocks on the diagonal
+    # and drop the second-order coupling of S_j to x
+
+    def augmented_jac(t, y):
+        return kron(identity(m + 1), jac_sparse(t, y[:n], p), format = 'csc')
+
+    y0 = np.concatenate([np.asarray(x_init, dtype = float), np.zeros(n * m)])
+    timepoints = np.asarray(timepoints, dtype = float)
+    sol = solve_ivp(augmented, (timepoints[0], timepoints[-1]), y0, method = method, t_eval = timepoints,
+                    jac = augmented_jac if method in ('BDF', 'Radau') else None, rtol = rtol, atol = atol)
+    if not sol.success:
+        raise RuntimeError('Sensitivity integration failed: ' + sol.message)
+
+    solutions = sol.y[:n].T
+    SSM = sol.y[n:].T.reshape(len(timepoints), m, n)
+    if normalize:
+        SSM = normalize_SSM(SSM, solutions, params_values)
+    return solutions, SSM
+
+
+def normalize_SSM(SSM, solutions, params_values):
+    '''
+    Returns normalized sensitivity coefficients.
+    Multiplies each sensitivity coefficient with the corresponding parameter p_j
+    Divides the result by the corresponding state to obtain the normalized coefficient that is returned.
+    '''
+    p = np.asarray(params_values, dtype = float)
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        return SSM * p[np.newaxis, :, np.newaxis] / solutions[:, np.newaxis, :]
@@ -0,0 +1,528 @@
+import warnings
+import numpy as np
+from scipy.sparse import csc_matrix, csr_matrix
+from genelet_profile import record_solution, solver_method, stage
+
+
+# Number of species from which CRNModel.simulate integrates with BDF and a sparse Jacobian by default. Dense LSODA and
+# sparse BDF take about as long on the NOR gate arrays of genelet_benchmark.py at 30 to 50 switches (300 to 500 species);
+# at 100 switches sparse BDF is 9 times faster, at 300 switches 50 times
+
+SPARSE_SPECIES = 400
+
+
+class CRNTopology:
+    """
+    Reaction topology of a mass-action CRN compiled into index arrays.
+    Built once and shared by every CRNModel bound to it, so changing rate constants
+    or initial conditions never touches the species or reaction lists again.
+    Arguments: species (list of species names)
+               reactions (list of (reactants, products) pairs, each a dict of species name -> stoichiometric coefficient)
+    Supports reactions of up to second order (all Genelet and Source reactions are at most bimolecular).
+    A reaction given as (reactants, products, substrate) has the Michaelis-Menten rate law used by QSSA Genelets,
+    with the enzyme and the substrate as its two reactants (the enzyme also listed as a product) and K its Michaelis
+    constant. Substrates of the same enzyme compete for it: with D = 1 + sum_j substrate_j / K_j over every
+    Michaelis-Menten reaction of the enzyme, the propensity is k * (enzyme / D) * substrate / K, which is
+    k * enzyme * substrate / (K + substrate) when the enzyme has a single substrate.
+    """
+    def __init__(self, species, reactions):
+
+        self.species = list(species)
+        self.species_index = {s: i for i, s in enumerate(self.species)}
+        self.n_species = len(self.species)
+        self.n_reactions = len(reactions)
+
+        # Reactant slots point at a constant 1 appended to the state when a reaction has fewer than two reactants
+
+        one = self.n_species
+        reactant_1 = np.full(self.n_reactions, one, dtype = int)
+        reactant_2 = np.full(self.n_reactions, one, dtype = int)
+        rows, cols, values = [], [], []
+        saturated, saturating = [], []
+
+        for j, reaction in enumerate(reactions):
+            reactants, products = reaction[:2]
+            if len(reaction) > 2:
+                saturated.append(j)
+                saturating.append(self.species_index[reaction[2]])
+            slots = []
+            for s, coef in reactants.items():
+                slots += [self.species_index[s]] * int(coef)
+            if len(slots) > 2:
+                raise ValueError('Reaction ' + str(j) + ' has more than two reactants')
+            if len(slots) > 0:
+                reactant_1[j] = slots[0]
+            if len(slots) > 1:
+                reactant_2[j] = slots[1]
+
+            net = {}
+            for s, coef in reactants.items():
+                net[s] = net.get(s, 0) - coef
+            for s, coef in products.items():
+                net[s] = net.get(s, 0) + coef
+            for s, coef in net.items():
+                if coef != 0:
+                    rows.append(self.species_index[s])
+                    cols.append(j)
+                    values.append(coef)
+
+        self.reactions = reactions
+        self.reactant_1 = reactant_1
+        self.reactant_2 = reactant_2
+        self.stoich_rows = np.array(rows, dtype = int)
+        self.stoich_cols = np.array(cols, dtype = int)
+        self.stoich_values = np.array(values, dtype = float)
+        self.stoich_matrix = csr_matrix((self.stoich_values, (self.stoich_rows, self.stoich_cols)),
+                                        shape = (self.n_species, self.n_reactions))
+
+        # Jacobian entries: every stoichiometry entry (i, j) contributes S_ij * k_j * x_other to dx_i/dx_reactant
+        # for each reactant slot of reaction j, other being the species in the remaining slot
+
+        jac_rows, jac_cols, jac_reactions, jac_other, jac_values = [], [], [], [], []
+        for first, second in ((reactant_1, reactant_2), (reactant_2, reactant_1)):
+            mask = first[self.stoich_cols] != one
+            jac_rows.append(self.stoich_rows[mask])
+            jac_cols.append(first[self.stoich_cols][mask])
+            jac_reactions.append(self.stoich_cols[mask])
+            jac_other.append(second[self.stoich_cols][mask])
+            jac_values.append(self.stoich_values[mask])
+        self.jac_rows = np.concatenate(jac_rows)
+        self.jac_cols = np.concatenate(jac_cols)
+        self.jac_reactions = np.concatenate(jac_reactions)
+        self.jac_other = np.concatenate(jac_other)
+        self.jac_values = np.concatenate(jac_values)
+
+        # Michaelis-Menten reactions, grouped by enzyme. The mass-action entries above are scaled by 1 / (K D).
+        # Competition for the enzyme adds -S_ij * v_j / (D K_l) to dx_i/dx_substrate_l for every pair of
+        # Michaelis-Menten reactions j, l of the same enzyme: a rank one term per enzyme, u_g w_g^T, kept in that
+        # form (see michaelis_coupling) since its entries grow with the square of the number of substrates
+
+        self.saturated = np.array(saturated, dtype = int)
+        self.saturating = np.array(saturating, dtype = int)
+        enzyme = np.where(reactant_1[self.saturated] == self.saturating, reactant_2[self.saturated], reactant_1[self.saturated])
+        enzymes, self.michaelis_group = np.unique(enzyme, return_inverse = True)
+        self.n_michaelis_groups = len(enzymes)
+        self.michaelis_members = np.zeros((len(saturated), len(enzymes)))
+        self.michaelis_members[np.arange(len(saturated)), self.michaelis_group] = 1
+
+        position = -np.ones(self.n_reactions, dtype = int)
+        position[self.saturated] = np.arange(len(saturated))
+        self.jac_saturated = np.nonzero(position[self.jac_reactions] >= 0)[0]
+        self.jac_michaelis = position[self.jac_reactions[self.jac_saturated]]
+        entries = np.nonzero(position[self.stoich_cols] >= 0)[0]
+        self._coupling_entries = entries
+        self._coupling_reactions = position[self.stoich_cols[entries]]
+        self._jac_flat = self.jac_rows * self.n_species + self.jac_cols
+        self._sparse_pattern = None
+        self._conservation = None
+
+    def propensities(self, x, k, K = None):
+        """
+        Propensities of all reactions for state x, rate constants k and Michaelis constants K
+        (one per saturated reaction, only needed when the CRN has Michaelis-Menten reactions).
+        x may also be an (N, n_species) array of states, giving an (N, n_reactions) array.
+        """
+        xe = _append_one(x)
+        rates = k * xe[..., self.reactant_1] * xe[..., self.reactant_2]
+        if len(self.saturated):
+            rates[..., self.saturated] /= K * self._michaelis_denominator(xe, K)
+        return rates
+
+    def _michaelis_denominator(self, xe, K):
+        # D = 1 + sum of substrate / K over the Michaelis-Menten reactions of each one's enzyme
+        return ((xe[..., self.saturating] / K) @ self.michaelis_members + 1)[..., self.michaelis_group]
+
+    def rhs(self, x, k, K = None):
+        """Time derivative of the state x for rate constants k and Michaelis constants K"""
+        return self.stoich_matrix @ self.propensities(x, k, K)
+
+    def jacobian_values(self, x, k, K = None):
+        """
+        Values of the Jacobian entries at (jac_rows, jac_cols) for state x, rate constants k and Michaelis constants K.
+        Entries with repeated coordinates add up. x may also be an (N, n_species) array of states.
+        For CRNs with Michaelis-Menten reactions the enzyme competition term (see michaelis_coupling) is not included.
+        """
+        xe = _append_one(x)
+        values = self.jac_values * k[self.jac_reactions] * xe[..., self.jac_other]
+        if len(self.saturated):
+            K = np.asarray(K, dtype = float)
+            values[..., self.jac_saturated] /= (K * self._michaelis_denominator(xe, K))[..., self.jac_michaelis]
+        return values
+
+    def michaelis_coupling(self, x, k, K):
+        """
+        Enzyme competition part of the Jacobian of a CRN with Michaelis-Menten reactions, as the rank one factors
+        of each enzyme: the term is -U.T @ W with U and W (n_enzymes x n_species) arrays.
+        U[g] is the stoichiometry-weighted sum of v_j / D over the reactions j of enzyme g, W[g] the sum of 1 / K_l
+        over the substrates l of enzyme g.
+        """
+        xe = _append_one(x)
+        K = np.asarray(K, dtype = float)
+        D = self._michaelis_denominator(xe, K)
+        scaled = k[self.saturated] * xe[self.reactant_1[self.saturated]] * xe[self.reactant_2[self.saturated]] / (K * D * D)
+        group = self.michaelis_group[self._coupling_reactions]
+        U = np.bincount(group * self.n_species + self.stoich_rows[self._coupling_entries],
+                        weights = self.stoich_values[self._coupling_entries] * scaled[self._coupling_reactions],
+                        minlength = self.n_michaelis_groups * self.n_species)
+        W = np.bincount(self.michaelis_group * self.n_species + self.saturating, weights = 1 / K,
+                        minlength = self.n_michaelis_groups * self.n_species)
+        return U.reshape(self.n_michaelis_groups, self.n_species), W.reshape(self.n_michaelis_groups, self.n_species)
+
+    def jacobian(self, x, k, K = None):
+        """Dense analytic Jacobian d(rhs)/dx for state x, rate constants k and Michaelis constants K"""
+        J = np.bincount(self._jac_flat, weights = self.jacobian_values(x, k, K), minlength = self.n_species ** 2)
+        J = J.reshape(self.n_species, self.n_species)
+        if len(self.saturated):
+            U, W = self.michaelis_coupling(x, k, K)
+            J -= U.T @ W
+        return J
+
+    def _sparse(self):
+        # Compressed sparse column pattern of the Jacobian, built on first use: the mass-action entries and, per enzyme,
+        # the block of the competition term (species of its reactions x its substrates). Every entry adds into one
+        # slot of the data array, so a sparse Jacobian costs one bincount over the nonzeros
+        if self._sparse_pattern is None:
+            n = self.n_species
+            coupling_rows, coupling_cols, coupling_groups = [], [], []
+            entry_groups = self.michaelis_group[self._coupling_reactions]
+            for g in range(self.n_michaelis_groups):
+                rows = np.unique(self.stoich_rows[self._coupling_entries[entry_groups == g]])
+                substrates = np.unique(self.saturating[self.michaelis_group == g])
+                coupling_rows.append(np.repeat(rows, len(substrates)))
+                coupling_cols.append(np.tile(substrates, len(rows)))
+                coupling_groups.append(np.full(len(rows) * len(substrates), g, dtype = int))
+            coupling_rows = np.concatenate(coupling_rows + [np.zeros(0, dtype = int)])
+            coupling_cols = np.concatenate(coupling_cols + [np.zeros(0, dtype = int)])
+            coupling_groups = np.concatenate(coupling_groups + [np.zeros(0, dtype = int)])
+
+            keys = np.concatenate([self.jac_cols, coupling_cols]) * n + np.concatenate([self.jac_rows, coupling_rows])
+            entries, slots = np.unique(keys, return_inverse = True)
+            indptr = np.searchsorted(entries // n, np.arange(n + 1))
+            self._sparse_pattern = {"slots": slots[:len(self.jac_rows)], "coupling_slots": slots[len(self.jac_rows):],
+                                    "coupling_rows": coupling_rows, "coupling_cols": coupling_cols,
+                                    "coupling_groups": coupling_groups, "indices": entries % n, "indptr": indptr}
+        return self._sparse_pattern
+
+    def jacobian_sparsity(self):
+        """Sparsity pattern of the Jacobian, as a (n_species x n_species) CSC matrix of ones"""
+        pattern = self._sparse()
+        return csc_matrix((np.ones(len(pattern["indices"])), pattern["indices"], pattern["indptr"]),
+                          shape = (self.n_species, self.n_species))
+
+    def sparse_jacobian(self, x, k, K = None):
+        """
+        Sparse analytic Jacobian d(rhs)/dx for state x, rate constants k and Michaelis constants K, as a CSC matrix.
+        Its cost grows with the number of nonzeros (a few per reaction) rather than with n_species ** 2; the
+        enzyme competition of Michaelis-Menten reactions adds a block per enzyme of its species times its substrates.
+        """
+        pattern = self._sparse()
+        nnz = len(pattern["indices"])
+        data = np.bincount(pattern["slots"], weights = self.jacobian_values(x, k, K), minlength = nnz)
+        if len(self.saturated):
+            data -= self._coupling_data(x, k, K)
+        return csc_matrix((data, pattern["indices"], pattern["indptr"]), shape = (self.n_species, self.n_species))
+
+    def _coupling_data(self, x, k, K):
+        # Enzyme competition term of the Jacobian at state x, in the slots of the sparse pattern
+        pattern = self._sparse()
+        U, W = self.michaelis_coupling(x, k, K)
+        groups = pattern["coupling_groups"]
+        return np.bincount(pattern["coupling_slots"], minlength = len(pattern["indices"]),
+                           weights = U[groups, pattern["coupling_rows"]] * W[groups, pattern["coupling_cols"]])
+
+    def stoichiometry(self):
+        """Dense (n_species x n_reactions) net stoichiometry matrix"""
+        S = np.zeros((self.n_species, self.n_reactions))
+        np.add.at(S, (self.stoich_rows, self.stoich_cols), self.stoich_values)
+        return S
+
+    def conservation_laws(self):
+        """
+        Linear invariants of the CRN (e.g. total switch, activator, RNAP and RNAseH across their complexes).
+        The rows of L span the left null space of the stoichiometry matrix, so L x stays constant along every
+        trajectory. L is in reduced row echelon form on its pivot species: law i has coefficient 1 on species
+        pivots[i] and 0 on every other pivot, which makes the pivots a set of dependent species.
+        Output: (L, pivots), L an (n_laws x n_species) array and pivots an array of species indices
+        """
+        if self._conservation is None:
+            laws = _left_null_space(self.stoich_rows, self.stoich_cols, self.stoich_values, self.n_species, self.n_reactions)
+            L = np.zeros((len(laws), self.n_species))
+            pivots = np.zeros(len(laws), dtype = int)
+            for i, (pivot, law) in enumerate(laws):
+                pivots[i] = pivot
+                for j, coef in law.items():
+                    L[i, j] = coef
+            self._conservation = (L, pivots)
+        return self._conservation
+
+    def initial_state(self, ic = None):
+        """
+        Initial state vector from a dictionary of species name -> concentration.
+        Species that are not set start at 0. Names that are not in the CRN are ignored with a warning.
+        """
+        x0 = np.zeros(self.n_species)
+        if ic is None:
+            return x0
+
+        missing = []
+        for s, value in ic.items():
+            i = self.species_index.get(str(s))
+            if i is None:
+                missing.append(str(s))
+            else:
+                x0[i] = value
+        if missing:
+            warnings.warn('Species not in CRN ignored in initial condition: ' + ", ".join(missing))
+        return x0
+
+
+def _left_null_space(rows, cols, values, n_species, n_reactions):
+    # Exact left null space of a sparse integer stoichiometry matrix, by Gauss-Jordan elimination (free of round-off)
+    # of its transpose over the rationals. Returns a list of (free species, {species: coefficient}),
+    # one per law, each with coefficient 1 on its own free species and 0 on every other free species.
+    from fractions import Fraction
+
+    reactions = [{} for j in range(n_reactions)]
+    for i, j, v in zip(rows, cols, values):
+        reactions[j][int(i)] = reactions[j].get(int(i), 0) + Fraction(v).limit_denominator()
+
+    # Pivot on the least connected species first so hubs such as RNAP and RNAseH stay free and their laws read as totals
+
+    degree = np.bincount(np.asarray(rows, dtype = int), minlength = n_species)
+    pivot_rows = {}
+    for row in reactions:
+        row = {i: v for i, v in row.items() if v != 0}
+        for p in [p for p in row if p in pivot_rows]:
+            if p in row:
+                factor = row[p]
+                for i, v in pivot_rows[p].items():
+                    row[i] = row.get(i, 0) - factor * v
+                row = {i: v for i, v in row.items() if v != 0}
+        if not row:
+            continue
+        p = min(row, key = lambda i: (degree[i], i))
+        scale = row[p]
+        row = {i: v / scale for i, v in row.items()}
+        for q, other in pivot_rows.items():
+            if p in other:
+                factor = other[p]
+                for i, v in row.items():
+                    other[i] = other.get(i, 0) - factor * v
+                pivot_rows[q] = {i: v for i, v in other.items() if v != 0}
+        pivot_rows[p] = row
+
+    laws = []
+    for f in range(n_species):
+        if f in pivot_rows:
+            continue
+        law = {f: 1.0}
+        for p, row in pivot_rows.items():
+            if f in row:
+                law[p] = float(-row[f])
+        laws.append((f, law))
+    return laws
+
+
+def _append_one(x):
+    # Append the constant 1 that fewer-than-two-reactant reactions point at to the last axis of x
+    x = np.asarray(x, dtype = float)
+    return np.concatenate([x, np.ones(x.shape[:-1] + (1,))], axis = -1)
+
+
+class CRNModel:
+    """
+    Simulation-ready mass-action model: a shared CRNTopology bound to rate constants and an initial state.
+    Arguments: topology (CRNTopology), k (rate constant for every reaction), x0 (initial state vector)
+    Optional arguments: parameters (dictionary of named parameters k was derived from, kept for reference)
+                        K (Michaelis constant of every saturated reaction of the topology)
+    """
+    def __init__(self, topology, k, x0, parameters = None, K = None):
+
+        self.topology = topology
+        self.species = topology.species
+        self.k = np.asarray(k, dtype = float)
+        self.K = None if K is None else np.asarray(K, dtype = float)
+        self.x0 = np.asarray(x0, dtype = float)
+        self.parameters = parameters
+
+    def rhs(self, t, x):
+        return self.topology.rhs(x, self.k, self.K)
+
+    def jacobian(self, t, x):
+        return self.topology.jacobian(x, self.k, self.K)
+
+    def sparse_jacobian(self, t, x):
+        return self.topology.sparse_jacobian(x, self.k, self.K)
+
+    def solver_options(self, method = None, sparse = None, keywords = None):
+        """
+        Integration method of simulate for the method and sparse arguments (see simulate), setting the analytic
+        Jacobian it takes in the dictionary of solve_ivp keywords unless one is given.
+        Output: Name of the solve_ivp method
+        """
+        large = self.topology.n_species >= SPARSE_SPECIES
+        if method is None:
+            method = "BDF" if large else "LSODA"
+        if sparse is None:
+            sparse = large and method in ("BDF", "Radau")
+        if sparse and method not in ("BDF", "Radau"):
+            raise RuntimeError('Only the BDF and Radau methods take a sparse Jacobian, not ' + str(method))
+        if keywords is not None:
+            if sparse:
+                keywords.setdefault("jac", self.sparse_jacobian)
+            elif method in ("LSODA", "BDF", "Radau"):
+                keywords.setdefault("jac", self.jacobian)
+        return method
+
+    def simulate(self, timepoints, method = None, rtol = 1e-6, atol = 1e-9, sparse = None, **keywords):
+        """
+        Integrate the model over timepoints with scipy's solve_ivp, using the analytic Jacobian for implicit methods.
+        BDF and Radau can take the Jacobian in sparse form, and then solve their Newton systems by sparse LU, so the
+        cost of a step grows with the number of nonzeros instead of n_species ** 2: much faster for circuits of tens of
+        switches and more, whose every switch only couples to its own strands, RNAP and RNase H.
+        Optional arguments: method of solve_ivp, defaults to LSODA, or to BDF with a sparse Jacobian for CRNs of at least
+                            SPARSE_SPECIES species
+                            sparse, whether BDF and Radau use the sparse Jacobian (defaults to CRNs of at least SPARSE_SPECIES
+                            species); LSODA only takes a dense Jacobian
+                            Other keywords go to solve_ivp
+        Output: Pandas DataFrame with one column per species and a "time" column, like simulate_with_bioscrape
+        """
+        from scipy.integrate import solve_ivp
+        import pandas as pd
+
+        method = self.solver_options(method, sparse, keywords)
+        timepoints = np.asarray(timepoints, dtype = float)
+        with stage("simulate"):
+            sol = solve_ivp(self.rhs, (timepoints[0], timepoints[-1]), self.x0, method = solver_method(method),
+                            t_eval = timepoints, rtol = rtol, atol = atol, **keywords)
+        record_solution(sol)
+        if not sol.success:
+            raise RuntimeError('Simulation failed: ' + sol.message)
+
+        R = pd.DataFrame(sol.y.T, columns = self.species)
+        R["time"] = sol.t
+        return R
+
+    def simulate_ensemble(self, ics, timepoints, method = "BDF", rtol = 1e-6, atol = 1e-9, **keywords):
+        """
+        Integrate many initial conditions of the model together as one stacked system.
+        The N copies share rate constants and step sizes; the stacked Jacobian is block diagonal and handed to
+        the solver in sparse form, so one solve replaces N calls and N solver setups.
+        Arguments: ics, list of initial condition dictionaries or an (N, n_species) array of initial states
+                   timepoints to report
+        Output: Array of shape (N, len(timepoints), n_species), species in the order of CRNModel.species
+        """
+        from scipy.integrate import solve_ivp
+
+        topology = self.topology
+        n = topology.n_species
+        if isinstance(ics, np.ndarray):
+            X0 = np.asarray(ics, dtype = float).reshape(-1, n)
+        else:
+            X0 = np.array([topology.initial_state(ic) for ic in ics])
+        N = X0.shape[0]
+
+        def rhs(t, y):
+            rates = topology.propensities(y.reshape(N, n), self.k, self.K)
+            return (topology.stoich_matrix @ rates.T).T.ravel()
+
+        # One copy of the sparse Jacobian pattern of the topology (see CRNTopology.sparse_jacobian) per block
+
+        pattern = topology._sparse()
+        nnz = len(pattern["indices"])
+        blocks = np.arange(N)[:, np.newaxis]
+        slots = (blocks * nnz + pattern["slots"]).ravel()
+        indices = (blocks * n + pattern["indices"]).ravel()
+        indptr = np.append((blocks * nnz + pattern["indptr"][:-1]).ravel(), N * nnz)
+
+        def jac(t, y):
+            X = y.reshape(N, n)
+            data = np.bincount(slots, weights = topology.jacobian_values(X, self.k, self.K).ravel(), minlength = N * nnz)
+            if len(topology.saturated):
+                data = data.reshape(N, nnz)
+                for b in range(N):
+                    data[b] -= topology._coupling_data(X[b], self.k, self.K)
+            return csc_matrix((data.ravel(), indices, indptr), shape = (N * n, N * n))
+
+        if method in ("BDF", "Radau"):
+            keywords.setdefault("jac", jac)
+        timepoints = np.asarray(timepoints, dtype = float)
+        with stage("simulate"):
+            sol = solve_ivp(rhs, (timepoints[0], timepoints[-1]), X0.ravel(), method = solver_method(method),
+                            t_eval = timepoints, rtol = rtol, atol = atol, **keywords)
+        record_solution(sol)
+        if not sol.success:
+            raise RuntimeError('Simulation failed: ' + sol.message)
+
+        return sol.y.T.reshape(len(sol.t), N, n).transpose(1, 0, 2)
+
+    def reduce(self):
+        """Conservation-law reduced version of the model (see ReducedCRNModel)"""
+        return ReducedCRNModel(self)
+
+
+class ReducedCRNModel:
+    """
+    CRNModel with its dependent species eliminated through the conservation laws of the topology.
+    Each law i fixes species dependent[i] = totals[i] - sum_j L[i, j] x_j over the independent species j,
+    totals being set by the initial state, so only the independent species are integrated. The smaller system
+    drops the exactly singular directions of the full Jacobian (one per conserved total) and
+    full_state maps reduced states back to every species of the CRN.
+    Arguments: CRNModel
+    Optional argument: x0, initial state that sets the conserved totals (defaults to model.x0)
+    """
+    def __init__(self, model, x0 = None):
+
+        topology = model.topology
+        L, pivots = topology.conservation_laws()
+        self.model = model
+        self.dependent = np.array(pivots, dtype = int)
+        self.independent = np.setdiff1d(np.arange(topology.n_species), self.dependent)
+        self.species = [topology.species[i] for i in self.independent]
+        self.dependent_species = [topology.species[i] for i in self.dependent]
+        self.laws = L[:, self.independent]
+
+        x0 = np.asarray(model.x0 if x0 is None else x0, dtype = float)
+        self.totals = L @ x0
+        self.y0 = x0[self.independent]
+
+    def full_state(self, y):
+        """
+        Full state in the order of CRNModel.species from a reduced state y.
+        y may also be an array of reduced states along its last axis (e.g. a trajectory).
+        """
+        y = np.asarray(y, dtype = float)
+        x = np.empty(y.shape[:-1] + (self.model.topology.n_species,))
+        x[..., self.independent] = y
+        x[..., self.dependent] = self.totals - y @ self.laws.T
+        return x
+
+    def rhs(self, t, y):
+        return self.model.rhs(t, self.full_state(y))[self.independent]
+
+    def jacobian(self, t, y):
+        # Chain rule through the dependent species: dx_dependent/dy = -laws
+        J = self.model.jacobian(t, self.full_state(y))
+        return J[np.ix_(self.independent, self.independent)] - J[np.ix_(self.independent, self.dependent)] @ self.laws
+
+    def simulate(self, timepoints, method = "LSODA", rtol = 1e-6, atol = 1e-9, **keywords):
+        """
+        Integrate the reduced model over timepoints with scipy's solve_ivp, using the reduced analytic Jacobian.
+        Output: Pandas DataFrame with one column per species of the full CRN and a "time" column, like CRNModel.simulate
+        """
+        from scipy.integrate import solve_ivp
+        import pandas as pd
+
+        if method in ("LSODA", "BDF", "Radau"):
+            keywords.setdefault("jac", self.jacobian)
+        timepoints = np.asarray(timepoints, dtype = float)
+        with stage("simulate"):
+            sol = solve_ivp(self.rhs, (timepoints[0], timepoints[-1]), self.y0, method = solver_method(method),
+                            t_eval = timepoints, rtol = rtol, atol = atol, **keywords)
+        record_solution(sol)
+        if not sol.success:
+            raise RuntimeError('Simulation failed: ' + sol.message)
+
+        R = pd.DataFrame(self.full_state(sol.y.T), columns = self.model.species)
+        R["time"] = sol.t
+        return R
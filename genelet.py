@@ -1,4 +1,71 @@
 from biocrnpyler import *
+from crn_model import CRNTopology, CRNModel
+from genelet_profile import parameter_lookup, profiled
+import hashlib
+import json
+import numpy as np
+
+# Catalytic rate of each enzymatic step of a Genelet, the binding rate of tx/leak/deg is derived from it via kM
+
+GENELET_CATALYTIC_RATES = {"tx": "ktx", "leak": "kleak", "deg": "kdeg", "rnase": "kcat"}
+
+def genelet_rate_constants(parameters):
+    """
+    Function to compute the rate constants used by Genelet and Source reactions from their named parameters.
+    Arguments: Dictionary of named parameters (as returned by Genelet.rate_parameters() and Source.rate_parameters())
+    Output: Dictionary of all rate constant names to values, with kb_tx, kb_leak and kb_deg derived as (ku + kcat) / kM
+            and the Michaelis constants kM_rnase and kM_source, used by QSSA Genelets and Sources, as (ku + kcat) / kb
+    """
+    rates = dict(parameters)
+    for step in ["tx", "leak", "deg"]:
+        if "kM_" + step in parameters:
+            rates["kb_" + step] = (parameters["ku_" + step] + parameters[GENELET_CATALYTIC_RATES[step]]) / parameters["kM_" + step]
+    if "kb_rnase" in parameters:
+        rates["kM_rnase"] = (parameters["ku_rnase"] + parameters["kcat"]) / parameters["kb_rnase"]
+    if "kb_source" in parameters:
+        rates["kM_source"] = (parameters["ku_source"] + parameters["ktx_source"]) / parameters["kb_source"]
+    return rates
+
+def _label_enzymatic(reactions, enzyme, kb, ku, kcat):
+    # Michaelis-Menten reactions come as a reversible binding step and a catalytic step that releases the enzyme
+    labelled = []
+    for rxn in reactions:
+        if str(enzyme) in [str(s) for s in rxn.outputs]:
+            labelled.append((rxn, (kcat, None)))
+        else:
+            labelled.append((rxn, (kb, ku)))
+    return labelled
+
+class MichaelisMentenQSSA(Mechanism):
+    """
+    Reduced-order enzymatic step with the enzyme complex eliminated by the quasi-steady-state approximation:
+    
+    Sub --> Sub + Prod   (copy = True, e.g. transcription, rate = kcat * Enzyme * Sub / (kM + Sub))
+    Sub --> Prod         (copy = False, e.g. degradation, Prod may be None)
+    
+    Replaces MichalisMentenCopy / MichalisMenten in QSSA Genelets and Sources, so no Enzyme:Sub complexes
+    and none of the fast binding timescales they bring are created.
+    The biocrnpyler reaction carries the single-substrate rate law. GeneletTemplate additionally lets the substrates
+    of one enzyme (e.g. every switch transcribed by RNAP) compete for it, see CRNTopology.
+    """
+    def __init__(self, name = "michaelis_menten_qssa", mechanism_type = "catalysis", copy = True):
+        
+        self.copy = copy
+        Mechanism.__init__(self, name = name, mechanism_type = mechanism_type)
+    
+    def update_species(self, Enzyme, Sub, Prod = None, **keywords):
+        
+        return [s for s in [Enzyme, Sub, Prod] if s is not None]
+    
+    def update_reactions(self, Enzyme, Sub, Prod, kcat, kM, **keywords):
+        
+        outputs = [Sub] if self.copy else []
+        if Prod is not None:
+            outputs.append(Prod)
+        
+        return [Reaction(inputs = [Sub], outputs = outputs, propensity_type = "proportionalhillpositive",
+                         propensity_params = {"k": kcat, "s1": Sub, "d": Enzyme, "K": kM, "n": 1})]
+
 
 class TranscriptionSwitch(Mechanism):
     """
@@ -14,7 +81,8 @@ class TranscriptionSwitch(Mechanism):
     Sw_ON_2 + I2 -> Sw_OFF + AI_2
     A2 + I2 -> AI_2
     
-    Allows upto 2 sets of activators and inhibitors per genelet
+    and so on for every further set of activators and inhibitors, passed as the lists switch_ons, activators,
+    inhibitors and A_I_complexes (one entry per set). A genelet may have any number of sets.
     """
     
     # Set the name and mechanism_type
@@ -22,20 +90,30 @@ class TranscriptionSwitch(Mechanism):
         
             Mechanism.__init__(self, name=name, mechanism_type=mechanism_type)
     
-    def update_species(self, switch_off, switch_on, transcript, activator, inhibitor, rnap, rnaseH, A_I_complex, switch_on2 = None, A_I_complex2 = None, activator2 = None,
-                       inhibitor2 = None, **keywords):
-        
+    def _sets(self, switch_on, activator, inhibitor, A_I_complex, switch_on2, A_I_complex2, activator2, inhibitor2,
+              switch_ons, activators, inhibitors, A_I_complexes):
+        # Lists of switch_on, activator, inhibitor and A_I_complex, one entry per set, from either calling convention
+        if switch_ons is not None:
+            return switch_ons, activators, inhibitors, A_I_complexes
+        if activator2 != None and inhibitor2 != None:
+            return [switch_on, switch_on2], [activator, activator2], [inhibitor, inhibitor2], [A_I_complex, A_I_complex2]
+        return [switch_on], [activator], [inhibitor], [A_I_complex]
+    
+    def update_species(self, switch_off, transcript, rnap, rnaseH, switch_on = None, activator = None, inhibitor = None, A_I_complex = None,
+                       switch_on2 = None, A_I_complex2 = None, activator2 = None, inhibitor2 = None, switch_ons = None, activators = None,
+                       inhibitors = None, A_I_complexes = None, **keywords):
         
-        # Return appropriate species depending on whether or not 2nd set of activators and inhibitors are present 
+        switch_ons, activators, inhibitors, A_I_complexes = self._sets(switch_on, activator, inhibitor, A_I_complex, switch_on2, A_I_complex2,
+                                                                       activator2, inhibitor2, switch_ons, activators, inhibitors, A_I_complexes)
         
-        if activator2 != None and inhibitor2 != None:
-            return [switch_off, switch_on, switch_on2, transcript, activator, inhibitor, rnap, rnaseH, activator2, inhibitor2, A_I_complex, A_I_complex2] 
-        else:
-            return [switch_off, switch_on, transcript, activator, inhibitor, rnap, rnaseH, A_I_complex] 
-            
+        species = [switch_off] + list(switch_ons) + [transcript, activators[0], inhibitors[0], rnap, rnaseH]
+        for activator, inhibitor in zip(activators[1:], inhibitors[1:]):
+            species += [activator, inhibitor]
+        return species + list(A_I_complexes)
     
-    def update_reactions(self, switch_off, switch_on, transcript, activator, inhibitor, rnap, rnaseH, A_I_complex, part_id, component = None, switch_on2 = None,
-                         A_I_complex2 = None, activator2 = None, inhibitor2 = None, **keywords):
+    def update_reactions(self, switch_off, transcript, rnap, rnaseH, part_id, component = None, switch_on = None, activator = None, inhibitor = None,
+                         A_I_complex = None, switch_on2 = None, A_I_complex2 = None, activator2 = None, inhibitor2 = None, switch_ons = None,
+                         activators = None, inhibitors = None, A_I_complexes = None, **keywords):
         
         # Initialise reaction parameters
         
@@ -43,27 +121,17 @@ class TranscriptionSwitch(Mechanism):
         koff = component.get_parameter("koff", part_id = part_id, mechanism = self)
         ka = component.get_parameter("ka", part_id = part_id, mechanism = self)
         
-        # Create reactions
-        
-        reaction_activation_1 = Reaction(inputs = [switch_off, activator], outputs = [switch_on], 
-                            k = kon )
-        reaction_deactivation_1 = Reaction(inputs = [switch_on, inhibitor], outputs = [switch_off, A_I_complex], 
-                            k = koff )
-        reaction_complex_1 = Reaction(inputs = [activator, inhibitor], outputs = [A_I_complex], k = ka)
+        switch_ons, activators, inhibitors, A_I_complexes = self._sets(switch_on, activator, inhibitor, A_I_complex, switch_on2, A_I_complex2,
+                                                                       activator2, inhibitor2, switch_ons, activators, inhibitors, A_I_complexes)
         
-        # Reactions if second set of activators and inhibitors are present
+        # Create activation, deactivation and annihilation reactions for every set of activator and inhibitor
         
-        if activator2 != None and inhibitor2 != None:
-            
-            reaction_activation_2 = Reaction(inputs = [switch_off, activator2], outputs = [switch_on2], 
-                            k = kon )
-            reaction_deactivation_2 = Reaction(inputs = [switch_on2, inhibitor2], outputs = [switch_off, A_I_complex2], 
-                            k = koff )
-            reaction_complex_2 = Reaction(inputs = [activator2, inhibitor2], outputs = [A_I_complex2], k = ka)
-            
-            return [reaction_activation_1, reaction_deactivation_1, reaction_complex_1, reaction_activation_2, reaction_deactivation_2, reaction_complex_2]
-            
-        return [reaction_activation_1, reaction_deactivation_1, reaction_complex_1]
+        reactions = []
+        for switch_on, activator, inhibitor, A_I_complex in zip(switch_ons, activators, inhibitors, A_I_complexes):
+            reactions.append(Reaction(inputs = [switch_off, activator], outputs = [switch_on], k = kon))
+            reactions.append(Reaction(inputs = [switch_on, inhibitor], outputs = [switch_off, A_I_complex], k = koff))
+            reactions.append(Reaction(inputs = [activator, inhibitor], outputs = [A_I_complex], k = ka))
+        return reactions
   
 
 
@@ -71,56 +139,71 @@ class Genelet(Promoter):
     """
     Genelet switch component using TranscriptionSwitch() mechanism
     Arguments: name, transcript, activator, inhibitor
-    Optional Arguments: activator2, inhibitor2, rnap, rnaseH, rnase
+               activator and inhibitor may also be equal length lists, one entry per set of activator and inhibitor
+               (the switch is ON while any set is active)
+    Optional Arguments: activator2, inhibitor2 (appended as a further set), rnap, rnaseH, rnase
+                        qssa, use Michaelis-Menten rate laws (MichaelisMentenQSSA) for transcription, leak and degradation
+                        instead of explicit enzyme binding steps
+    Species names: name_ON and name_AI for one set, name_ON_i for set i and name_AI, name_AI_2, ... for several
     """
-    def __init__(self, name, transcript, activator, inhibitor, rnap="RNAP", rnaseH="RNAseH", rnase="RNAse", activator2 = None, inhibitor2 = None,  **keywords):
+    def __init__(self, name, transcript, activator, inhibitor, rnap="RNAP", rnaseH="RNAseH", rnase="RNAse", activator2 = None, inhibitor2 = None,
+                 qssa = False, **keywords):
         
         # Set the Regulator
         # Component.set_species(species, material_type = None, attributes = None)
         # is a helper function that allows the input to be a Species, string, or Component.
         
-        self.activator = self.set_species(activator, material_type = "dna") 
-        self.inhibitor = self.set_species(inhibitor, material_type = "rna")
+        activators = list(activator) if isinstance(activator, (list, tuple)) else [activator]
+        inhibitors = list(inhibitor) if isinstance(inhibitor, (list, tuple)) else [inhibitor]
+        if activator2 != None and inhibitor2 != None:
+            activators.append(activator2)
+            inhibitors.append(inhibitor2)
+        if len(activators) != len(inhibitors) or len(activators) == 0:
+            raise RuntimeError('Genelet ' + str(name) + ' needs one inhibitor for every activator')
+        
+        self.activators = [self.set_species(a, material_type = "dna") for a in activators]
+        self.inhibitors = [self.set_species(i, material_type = "rna") for i in inhibitors]
         self.transcript = self.set_species(transcript, material_type = "rna")
         self.switch_off = self.set_species(str(name)+"_OFF")
         self.rnap = self.set_species(rnap, material_type = "protein")
         self.rnaseH = self.set_species(rnaseH, material_type = "protein")
         self.rnase = self.set_species(rnase, material_type = "protein")
         
-        if activator2 != None and inhibitor2 != None:
-            self.activator2 = self.set_species(activator2, material_type = "dna") 
-            self.inhibitor2 = self.set_species(inhibitor2, material_type = "rna")
-            
-            A_I_complex2 = ComplexSpecies([self.inhibitor2, self.activator2],name = str(name) + "_AI_2")
-            switch_on = ComplexSpecies([self.switch_off, self.activator], name = str(name) + "_ON_1")
-            switch_on2 = ComplexSpecies([self.switch_off, self.activator2], name = str(name) + "_ON_2")
-            
-            self.switch_on2 = switch_on2
-            self.A_I_complex2 = A_I_complex2
-        else:     
-            switch_on = ComplexSpecies([self.switch_off, self.activator], name = str(name) + "_ON")
-        
-        A_I_complex = ComplexSpecies([self.inhibitor, self.activator], name = str(name) +"_AI")
-        
-        self.switch_on = switch_on
-        self.A_I_complex = A_I_complex
-        
+        # One ON state and one activator-inhibitor complex per set
         
-        
-        # Set second activator and inhibitors depending on whether they are present in the input
-        
-        if activator2 != None and inhibitor2 != None:
-            
-            self.activator2 = self.set_species(activator2, material_type = "dna") 
-            self.inhibitor2 = self.set_species(inhibitor2, material_type = "rna")
+        if len(self.activators) == 1:
+            self.switch_ons = [ComplexSpecies([self.switch_off, self.activators[0]], name = str(name) + "_ON")]
+        else:
+            self.switch_ons = [ComplexSpecies([self.switch_off, a], name = str(name) + "_ON_" + str(i + 1)) for i, a in enumerate(self.activators)]
+        self.A_I_complexes = [ComplexSpecies([self.inhibitors[i], self.activators[i]], name = str(name) + ("_AI" if i == 0 else "_AI_" + str(i + 1)))
+                              for i in range(len(self.activators))]
+        
+        self.activator = self.activators[0]
+        self.inhibitor = self.inhibitors[0]
+        self.switch_on = self.switch_ons[0]
+        self.A_I_complex = self.A_I_complexes[0]
+        
+        # Second set kept under its own names for code written for at most two sets
+        
+        if len(self.activators) > 1:
+            self.activator2 = self.activators[1]
+            self.inhibitor2 = self.inhibitors[1]
+            self.switch_on2 = self.switch_ons[1]
+            self.A_I_complex2 = self.A_I_complexes[1]
         else:
             self.activator2 = None
             self.inhibitor2 = None
         
-        custom_mechanisms = {"transcription": TranscriptionSwitch(), "catalysis": MichalisMentenCopy(), "degradation": MichalisMenten()} 
+        self.qssa = qssa
+        if qssa:
+            custom_mechanisms = {"transcription": TranscriptionSwitch(), "catalysis": MichaelisMentenQSSA(copy = True),
+                                 "degradation": MichaelisMentenQSSA(name = "michaelis_menten_qssa_degradation", mechanism_type = "degradation", copy = False)}
+        else:
+            custom_mechanisms = {"transcription": TranscriptionSwitch(), "catalysis": MichalisMentenCopy(), "degradation": MichalisMenten()} 
         
         Promoter.__init__(self, name = name, transcript = transcript, mechanisms = custom_mechanisms, **keywords)
 
+    @profiled("update_species", output = "species")
     def update_species(self, **keywords):
         
         mech_tx = self.mechanisms["transcription"]
@@ -129,21 +212,16 @@ class Genelet(Promoter):
 
         
         species = [] 
+        species += mech_tx.update_species(switch_off = self.switch_off, transcript = self.transcript, rnap = self.rnap, rnaseH = self.rnaseH,
+                                          switch_ons = self.switch_ons, activators = self.activators, inhibitors = self.inhibitors,
+                                          A_I_complexes = self.A_I_complexes)
         
-        # Call update_species with correct arguments depending on whether the second set of activator and inhibitor are present
+        # Enzymatic steps of every further set, then of the first set and the leak of the OFF state
         
-        if self.activator2 != None and self.inhibitor2 != None:
-            species += mech_tx.update_species(switch_off = self.switch_off, transcript = self.transcript, activator = self.activator, inhibitor = self.inhibitor, 
-                                              rnap = self.rnap, rnaseH = self.rnaseH, rnase = self.rnase, activator2 = self.activator2, inhibitor2 = self.inhibitor2,
-                                              switch_on = self.switch_on, A_I_complex = self.A_I_complex, switch_on2 = self.switch_on2, A_I_complex2 = self.A_I_complex2)
-            
-            species += mech_cat.update_species(Enzyme = self.rnap, Sub = self.switch_on2, Prod = self.transcript)
-            species += mech_deg.update_species(Enzyme = self.rnaseH, Sub = self.A_I_complex2, Prod = self.activator2)
-            species += mech_deg.update_species(Enzyme = self.rnase, Sub = self.inhibitor2, Prod = None)
-            
-        else:
-            species += mech_tx.update_species(switch_off = self.switch_off, transcript = self.transcript, activator = self.activator, inhibitor = self.inhibitor, 
-                                          rnap = self.rnap, rnaseH = self.rnaseH, switch_on = self.switch_on, A_I_complex = self.A_I_complex)
+        for switch_on, activator, inhibitor, A_I_complex in list(zip(self.switch_ons, self.activators, self.inhibitors, self.A_I_complexes))[1:]:
+            species += mech_cat.update_species(Enzyme = self.rnap, Sub = switch_on, Prod = self.transcript)
+            species += mech_deg.update_species(Enzyme = self.rnaseH, Sub = A_I_complex, Prod = activator)
+            species += mech_deg.update_species(Enzyme = self.rnase, Sub = inhibitor, Prod = None)
             
         species += mech_cat.update_species(Enzyme = self.rnap, Sub = self.switch_on, Prod = self.transcript)
         species += mech_cat.update_species(Enzyme = self.rnap, Sub = self.switch_off, Prod = self.transcript)
@@ -152,63 +230,80 @@ class Genelet(Promoter):
         
         return species
 
-    def update_reactions(self, **keywords):
-        
+    def get_parameter(self, param_name, part_id = None, mechanism = None):
+        return parameter_lookup(Promoter.get_parameter, self, param_name, part_id = part_id, mechanism = mechanism)
+
+    def rate_parameters(self):
+        """
+        Dictionary of the named parameters behind every Genelet reaction rate, looked up in the parameter file
+        """
         mech_tx = self.mechanisms["transcription"]
-        mech_cat = self.mechanisms["catalysis"]
         mech_deg = self.mechanisms["degradation"]
         part_id = "Genelet"
         
-        ktx = self.get_parameter("ktx", part_id = part_id)
-        kleak = self.get_parameter("kleak", part_id = part_id)
-        kdeg = self.get_parameter("kdeg", part_id = part_id)
-        
-        ku_tx = self.get_parameter("ku_tx", part_id = part_id)
-        ku_leak = self.get_parameter("ku_leak", part_id = part_id)
-        ku_deg = self.get_parameter("ku_deg", part_id = part_id)
+        parameters = {}
+        for name in ["kon", "koff", "ka"]:
+            parameters[name] = self.get_parameter(name, part_id = part_id, mechanism = mech_tx)
+        for name in ["ktx", "kleak", "kdeg", "ku_tx", "ku_leak", "ku_deg", "kM_tx", "kM_leak", "kM_deg"]:
+            parameters[name] = self.get_parameter(name, part_id = part_id)
         
-        kM_tx = self.get_parameter("kM_tx", part_id = part_id)
-        kM_leak = self.get_parameter("kM_leak", part_id = part_id)
-        kM_deg = self.get_parameter("kM_deg", part_id = part_id)
-        
-        kcat = self.get_parameter("kcat", part_id = "RNase")
-                    
-        kb_tx = (ku_tx + ktx) / kM_tx
-        kb_leak = (ku_leak + kleak) / kM_leak
-        kb_deg = (ku_deg + kdeg) / kM_deg
+        parameters["kcat"] = self.get_parameter("kcat", part_id = "RNase")
+        parameters["kb_rnase"] = self.get_parameter("kb", part_id = self.name, mechanism = mech_deg)
+        parameters["ku_rnase"] = self.get_parameter("ku", part_id = self.name, mechanism = mech_deg)
         
+        return parameters
+
+    def update_reactions(self, **keywords):
         
-        reactions = []
+        return [reaction for reaction, rate_names in self.labelled_reactions(**keywords)]
+    
+    @profiled("labelled_reactions", output = "reactions")
+    def labelled_reactions(self, **keywords):
+        """
+        Reactions of the Genelet paired with the names of their rate constants (see genelet_rate_constants)
+        Output: List of (reaction, (forward rate name, reverse rate name or None)) tuples. For the Michaelis-Menten
+                reactions of a QSSA Genelet the second name is that of the Michaelis constant.
+        """
+        mech_tx = self.mechanisms["transcription"]
+        mech_cat = self.mechanisms["catalysis"]
+        mech_deg = self.mechanisms["degradation"]
+        part_id = "Genelet"
         
-        # Call update_reactions with correct arguments depending on whether the second set of activator and inhibitor are present
+        k = genelet_rate_constants(self.rate_parameters())
         
-        if self.activator2 != None and self.inhibitor2 != None:
-            reactions += mech_tx.update_reactions(switch_off = self.switch_off, transcript = self.transcript, activator = self.activator, inhibitor = self.inhibitor, 
-                                                  rnap = self.rnap, rnaseH = self.rnaseH, activator2 = self.activator2, inhibitor2 = self.inhibitor2,
-                                                  switch_on = self.switch_on, A_I_complex = self.A_I_complex, switch_on2 = self.switch_on2, A_I_complex2 = self.A_I_complex2,
-                                                  component = self, part_id = part_id, **keywords)
-            reactions += mech_cat.update_reactions(Enzyme = self.rnap, Sub = self.switch_on2, Prod = self.transcript, kb = kb_tx, ku = ku_tx, kcat = ktx)
-            reactions += mech_deg.update_reactions(Enzyme = self.rnaseH, Sub = self.A_I_complex2, Prod = self.activator2, kb = kb_deg, ku = ku_deg, kcat = kdeg)
-            reactions += mech_deg.update_reactions(Enzyme = self.rnase, Sub = self.inhibitor2, Prod = None, kcat = kcat, component = self)
+        def enzymatic(mech, enzyme, sub, prod, step):
+            if self.qssa:
+                rxns = mech.update_reactions(Enzyme = enzyme, Sub = sub, Prod = prod, kcat = k[GENELET_CATALYTIC_RATES[step]], kM = k["kM_" + step])
+                return [(rxn, (GENELET_CATALYTIC_RATES[step], "kM_" + step)) for rxn in rxns]
+            rxns = mech.update_reactions(Enzyme = enzyme, Sub = sub, Prod = prod, kb = k["kb_" + step], ku = k["ku_" + step], 
+                                         kcat = k[GENELET_CATALYTIC_RATES[step]])
+            return _label_enzymatic(rxns, enzyme, "kb_" + step, "ku_" + step, GENELET_CATALYTIC_RATES[step])
         
-        else:
-            reactions += mech_tx.update_reactions(switch_off = self.switch_off, transcript = self.transcript, activator = self.activator, inhibitor = self.inhibitor, 
-                                                  rnap = self.rnap, rnaseH = self.rnaseH, switch_on = self.switch_on, A_I_complex = self.A_I_complex,
-                                                  component = self, part_id = part_id, **keywords)
+        reactions = []
+        rxns = mech_tx.update_reactions(switch_off = self.switch_off, transcript = self.transcript, rnap = self.rnap, rnaseH = self.rnaseH,
+                                        switch_ons = self.switch_ons, activators = self.activators, inhibitors = self.inhibitors,
+                                        A_I_complexes = self.A_I_complexes, component = self, part_id = part_id, **keywords)
+        reactions += list(zip(rxns, [("kon", None), ("koff", None), ("ka", None)] * len(self.activators)))
+        
+        for switch_on, activator, inhibitor, A_I_complex in list(zip(self.switch_ons, self.activators, self.inhibitors, self.A_I_complexes))[1:]:
+            reactions += enzymatic(mech_cat, self.rnap, switch_on, self.transcript, "tx")
+            reactions += enzymatic(mech_deg, self.rnaseH, A_I_complex, activator, "deg")
+            reactions += enzymatic(mech_deg, self.rnase, inhibitor, None, "rnase")
             
-        reactions += mech_cat.update_reactions(Enzyme = self.rnap, Sub = self.switch_on, Prod = self.transcript, kb = kb_tx, ku = ku_tx, kcat = ktx)
-        reactions += mech_cat.update_reactions(Enzyme = self.rnap, Sub = self.switch_off, Prod = self.transcript, kb = kb_leak, ku = ku_leak, kcat = kleak)
-        reactions += mech_deg.update_reactions(Enzyme = self.rnaseH, Sub = self.A_I_complex, Prod = self.activator, kb = kb_deg, ku = ku_deg, kcat = kdeg)
-        reactions += mech_deg.update_reactions(Enzyme = self.rnase, Sub = self.inhibitor, Prod = None, kcat = kcat, component = self)
+        reactions += enzymatic(mech_cat, self.rnap, self.switch_on, self.transcript, "tx")
+        reactions += enzymatic(mech_cat, self.rnap, self.switch_off, self.transcript, "leak")
+        reactions += enzymatic(mech_deg, self.rnaseH, self.A_I_complex, self.activator, "deg")
+        reactions += enzymatic(mech_deg, self.rnase, self.inhibitor, None, "rnase")
         return reactions
     
 class Source(Promoter):
     """
     Genelet source component using Transcription_MM() mechanism
     Arguments: name, transcript
-    Optional argument: rnap
+    Optional arguments: rnap
+                        qssa, use a Michaelis-Menten rate law (MichaelisMentenQSSA) instead of explicit RNAP binding
     """
-    def __init__(self, name, transcript, rnap="RNAP", **keywords):
+    def __init__(self, name, transcript, rnap="RNAP", qssa = False, **keywords):
         
         # Set the inouts
         # Component.set_species(species, material_type = None, attributes = None)
@@ -216,27 +311,63 @@ class Source(Promoter):
         
         self.dna = self.set_species(name)
         self.rnap = self.set_species(rnap, material_type = "protein")
+        self.qssa = qssa
         
-        custom_mechanisms = {"transcription": Transcription_MM()}
+        if qssa:
+            custom_mechanisms = {"transcription": MichaelisMentenQSSA(name = "transcription_mm", mechanism_type = "transcription", copy = True)}
+        else:
+            custom_mechanisms = {"transcription": Transcription_MM()}
         
         Promoter.__init__(self, name = name, transcript = transcript, mechanisms = custom_mechanisms, **keywords)
 
+    @profiled("update_species", output = "species")
     def update_species(self, **keywords):
         
         mech_tx = self.mechanisms["transcription"]
         
         species = [] 
-        species += mech_tx.update_species(dna = self.dna, transcript = self.transcript, rnap = self.rnap)
+        if self.qssa:
+            species += mech_tx.update_species(Enzyme = self.rnap, Sub = self.dna, Prod = self.transcript)
+        else:
+            species += mech_tx.update_species(dna = self.dna, transcript = self.transcript, rnap = self.rnap)
         
         return species
 
+    def get_parameter(self, param_name, part_id = None, mechanism = None):
+        return parameter_lookup(Promoter.get_parameter, self, param_name, part_id = part_id, mechanism = mechanism)
+
+    def rate_parameters(self):
+        """
+        Dictionary of the named parameters behind the Source transcription rates, looked up in the parameter file
+        """
+        mech_tx = self.mechanisms["transcription"]
+        
+        parameters = {}
+        for name in ["ktx", "kb", "ku"]:
+            parameters[name + "_source"] = self.get_parameter(name, part_id = "Source", mechanism = mech_tx)
+        return parameters
+
     def update_reactions(self, **keywords):
+        
+        return [reaction for reaction, rate_names in self.labelled_reactions(**keywords)]
+    
+    @profiled("labelled_reactions", output = "reactions")
+    def labelled_reactions(self, **keywords):
+        """
+        Reactions of the Source paired with the names of their rate constants (see genelet_rate_constants)
+        Output: List of (reaction, (forward rate name, reverse rate name or None)) tuples
+        """
         mech_tx = self.mechanisms["transcription"]
         
+        if self.qssa:
+            k = genelet_rate_constants(self.rate_parameters())
+            rxns = mech_tx.update_reactions(Enzyme = self.rnap, Sub = self.dna, Prod = self.transcript, kcat = k["ktx_source"], kM = k["kM_source"])
+            return [(rxn, ("ktx_source", "kM_source")) for rxn in rxns]
+        
         reactions = [] 
         reactions += mech_tx.update_reactions(dna = self.dna, transcript = self.transcript, 
                                               rnap = self.rnap, component = self, part_id = "Source", **keywords)
-        return reactions    
+        return _label_enzymatic(reactions, mech_tx.rnap, "kb_source", "ku_source", "ktx_source")
     
     
 def GeneletGate(name, out, on_1 = None, on_2 = None, off_1 = None, off_2 = None, typ = "AND"):
@@ -292,4 +423,156 @@ def GeneletGate(name, out, on_1 = None, on_2 = None, off_1 = None, off_2 = None,
           "rna_"+name+"_out_A": 0, "rna_"+name+"_out_I": 0, str(So1_on):source, "protein_RNAP":100}
     
     return [S1,S2,S3,So1],ic
-    
\ No newline at end of file
+    
+
+def _stoichiometry(species, coefs):
+    # Collapse a reaction side into a dictionary of species name -> coefficient
+    counts = {}
+    for s, coef in zip(species, coefs):
+        counts[str(s)] = counts.get(str(s), 0) + coef
+    return counts
+
+class GeneletTemplate:
+    """
+    Genelet circuit whose reaction topology is compiled once and re-bound to new rate constants and initial conditions.
+    bind() returns a simulation-ready CRNModel without rebuilding any Reaction, ComplexSpecies or CRN, 
+    so sweeps over kon, koff, ka, ktx, kleak, kdeg, ... only pay for the simulation itself.
+    Arguments: List of Genelet and Source components (e.g. the first output of GeneletGate)
+    Optional arguments: parameter_file to read the default parameters from, or a ParameterStore (see genelet_parameters.py)
+                        ic, default initial conditions (e.g. the second output of GeneletGate)
+                        temperature_model, dictionary of parameter name -> temperature model (see genelet_temperature.py).
+                        The template then has a "temperature" parameter, in degrees Celsius, from which those
+                        parameters are rescaled at every bind(); the parameter file values hold at reference_temperature
+                        reference_temperature, defaults to 37 C
+                        reactions, list of extra mass-action reactions (reactants, products, rate name, rate value), with
+                        reactants and products dictionaries of species name -> coefficient, e.g. the waste reactions
+                        ({"rna_I1": 1, "rna_R1": 1}, {"complex_W1": 1}, "kw", 9.96e-2) of the bistable switch;
+                        their rate names become template parameters
+    """
+    @profiled("GeneletTemplate")
+    def __init__(self, components, parameter_file = "default_parameters.txt", ic = None, name = "genelet_template",
+                 temperature_model = None, reference_temperature = 37.0, reactions = None):
+        
+        if hasattr(parameter_file, "parameter_dictionary"):
+            mixture = Mixture(name = name, components = components, parameters = parameter_file.parameter_dictionary())
+        else:
+            mixture = Mixture(name = name, components = components, parameter_file = parameter_file)
+        
+        extra_reactions = reactions or []
+        species = []
+        reactions = []
+        rate_names = []
+        michaelis_names = []
+        self.parameters = {}
+        
+        for component in mixture.components:
+            if not hasattr(component, "labelled_reactions"):
+                raise RuntimeError('GeneletTemplate components must be Genelets or Sources, got ' + repr(component))
+            
+            species += [str(s) for s in component.update_species()]
+            for rxn, (forward, reverse) in component.labelled_reactions():
+                reactants = _stoichiometry(rxn.inputs, rxn.input_coefs)
+                products = _stoichiometry(rxn.outputs, rxn.output_coefs)
+                species += list(reactants) + list(products)
+                
+                # QSSA steps keep the enzyme as a catalyst on both sides, saturating in the substrate
+                
+                if rxn.propensity_type == "proportionalhillpositive":
+                    enzyme = str(rxn.propensity_params["d"])
+                    substrate = str(rxn.propensity_params["s1"])
+                    reactants[enzyme] = reactants.get(enzyme, 0) + 1
+                    products[enzyme] = products.get(enzyme, 0) + 1
+                    species.append(enzyme)
+                    reactions.append((reactants, products, substrate))
+                    rate_names.append(forward)
+                    michaelis_names.append(reverse)
+                    continue
+                
+                # Reversible binding steps are split into two irreversible reactions
+                
+                reactions.append((reactants, products))
+                rate_names.append(forward)
+                if reverse is not None:
+                    reactions.append((products, reactants))
+                    rate_names.append(reverse)
+            
+            self.parameters.update(component.rate_parameters())
+        
+        for reactants, products, rate_name, value in extra_reactions:
+            species += list(reactants) + list(products)
+            reactions.append((dict(reactants), dict(products)))
+            rate_names.append(rate_name)
+            self.parameters[rate_name] = value
+        
+        self.topology = CRNTopology(list(dict.fromkeys(species)), reactions)
+        self.species = self.topology.species
+        self.rate_names = rate_names
+        self.michaelis_names = michaelis_names
+        self.ic = ic
+        
+        self.temperature_model = temperature_model
+        self.reference_temperature = reference_temperature
+        if temperature_model is not None:
+            unknown = [name for name in temperature_model if name not in self.parameters]
+            if unknown:
+                raise RuntimeError('Temperature models for unknown Genelet parameters: ' + ", ".join(unknown))
+            self.parameters["temperature"] = reference_temperature
+        
+        # Every reaction reads its rate constant from a short table of distinct rate names
+        
+        self._rate_keys = sorted(set(rate_names))
+        key_index = {key: i for i, key in enumerate(self._rate_keys)}
+        self._rate_index = np.array([key_index[name] for name in rate_names], dtype = int)
+    
+    def rate_constants(self, parameters = None):
+        """
+        Rate constant of every reaction in the template.
+        Optional argument: Dictionary of parameter overrides, names as in GeneletTemplate.parameters
+        Output: (parameter dictionary used, array of rate constants)
+        """
+        params, k, K = self._rates(parameters)
+        return params, k
+    
+    def _rates(self, parameters, dtype = float):
+        # Rate constants of every reaction and Michaelis constants of the QSSA reactions (complex dtype for complex-step derivatives)
+        params = dict(self.parameters)
+        if parameters is not None:
+            unknown = [name for name in parameters if name not in self.parameters]
+            if unknown:
+                raise RuntimeError('Unknown Genelet parameters: ' + ", ".join(unknown))
+            params.update(parameters)
+        
+        rates = params
+        if self.temperature_model is not None:
+            from genelet_temperature import temperature_scaled
+            rates = temperature_scaled(params, self.temperature_model, params["temperature"], self.reference_temperature)
+        rates = genelet_rate_constants(rates)
+        k = np.array([rates[key] for key in self._rate_keys], dtype = dtype)[self._rate_index]
+        K = np.array([rates[name] for name in self.michaelis_names], dtype = dtype)
+        return params, k, K
+    
+    def bind(self, parameters = None, ic = None):
+        """
+        Function to create a simulation-ready model from the compiled template.
+        Optional arguments: Dictionary of parameter overrides, names as in GeneletTemplate.parameters (including
+                            "temperature" for templates with a temperature_model)
+                            Dictionary of initial conditions, defaults to the ic the template was created with
+        Output: CRNModel sharing the template topology
+        """
+        params, k, K = self._rates(parameters)
+        x0 = self.topology.initial_state(self.ic if ic is None else ic)
+        return CRNModel(self.topology, k, x0, parameters = params, K = K)
+    
+    def fingerprint(self, parameters = None, extra = None):
+        """
+        Content hash of the compiled CRN and the parameters it would be bound to, for keying on-disk caches.
+        Optional arguments: Dictionary of parameter overrides, as for bind()
+                            extra, any JSON serialisable settings to include in the hash
+        Output: Hex digest string
+        """
+        params, k = self.rate_constants(parameters)
+        content = [self.species, [[sorted(r[0].items()), sorted(r[1].items())] + list(r[2:]) for r in self.topology.reactions],
+                   self.rate_names, self.michaelis_names, sorted(params.items()), extra]
+        if self.temperature_model is not None:
+            content.append([sorted((name, repr(model)) for name, model in self.temperature_model.items()), self.reference_temperature])
+        return hashlib.sha256(json.dumps(content, default = str).encode()).hexdigest()
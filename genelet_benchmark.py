@@ -0,0 +1,476 @@
+import itertools
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+from biocrnpyler import Mixture, Reaction, Species
+from genelet import Genelet, GeneletGate, GeneletTemplate
+from genelet_circuit import GeneletCircuit, GATE_TYPES
+
+
+def nor_gate(qssa = False, prefix = ""):
+    """
+    NOR gate of NOR Gate Development.ipynb: switches 1 and 2 transcribe the inhibitor of switch 3.
+    Optional arguments: qssa, build the Genelets with the QSSA mechanism
+                        prefix of every switch and strand name, for several copies of the gate in one circuit
+    Output: List of Genelet components, dictionary of initial conditions, dictionary of input name -> activator species
+    """
+    p = prefix
+    S1 = Genelet(p + "Sw1", transcript = p + "I3", activator = p + "A1", inhibitor = p + "I1", qssa = qssa)
+    S2 = Genelet(p + "Sw2", transcript = p + "I3", activator = p + "A2", inhibitor = p + "I2", qssa = qssa)
+    S3 = Genelet(p + "Sw3", transcript = p + "I4", activator = p + "A3", inhibitor = p + "I3", qssa = qssa)
+    ic = {p + "Sw1_OFF": 2000, "dna_" + p + "A1": 2000, "rna_" + p + "I1": 0, p + "Sw2_OFF": 2000, "dna_" + p + "A2": 2000,
+          "rna_" + p + "I2": 0, p + "Sw3_OFF": 2000, "dna_" + p + "A3": 2000, "rna_" + p + "I3": 0, "protein_RNAseH": 10,
+          "protein_RNAP": 500}
+    return [S1, S2, S3], ic, {p + "A1": "dna_" + p + "A1", p + "A2": "dna_" + p + "A2"}
+
+
+def nand_gate(qssa = False, prefix = ""):
+    """
+    NAND gate of Logic Gate Testing.ipynb: switch 3 has two activator/inhibitor pairs, one inhibitor from each input switch.
+    Optional arguments: qssa, build the Genelets with the QSSA mechanism
+                        prefix of every switch and strand name, for several copies of the gate in one circuit
+    Output: List of Genelet components, dictionary of initial conditions, dictionary of input name -> activator species
+    """
+    p = prefix
+    S1 = Genelet(p + "Sw1", transcript = p + "I31", activator = p + "A1", inhibitor = p + "I1", qssa = qssa)
+    S2 = Genelet(p + "Sw2", transcript = p + "I32", activator = p + "A2", inhibitor = p + "I2", qssa = qssa)
+    S3 = Genelet(p + "Sw3", transcript = p + "I4", activator = p + "A31", inhibitor = p + "I31", activator2 = p + "A32",
+                 inhibitor2 = p + "I32", qssa = qssa)
+    ic = {p + "Sw1_OFF": 2000, "dna_" + p + "A1": 2000, "rna_" + p + "I1": 0, p + "Sw2_OFF": 2000, "dna_" + p + "A2": 2000,
+          "rna_" + p + "I2": 0, p + "Sw3_OFF": 2000, "dna_" + p + "A31": 2000, "dna_" + p + "A32": 2000,
+          "protein_RNAseH": 20, "protein_RNAP": 150}
+    return [S1, S2, S3], ic, {p + "A1": "dna_" + p + "A1", p + "A2": "dna_" + p + "A2"}
+
+
+BENCHMARK_CIRCUITS = {"NOR": nor_gate, "NAND": nand_gate}
+
+
+def _lumped_species(full, reduced):
+    # Species of the full template that the QSSA template folds into each of its species: the species itself and
+    # every enzyme complex formed by binding it (the binding step is the reaction whose only product is the complex)
+    enzymes = set(reduced.species[i] for i in np.unique(np.concatenate([reduced.topology.reactant_1[reduced.topology.saturated],
+                                                                       reduced.topology.reactant_2[reduced.topology.saturated]])))
+    lumped = {s: [s] for s in reduced.species}
+    for reactants, products in full.topology.reactions:
+        if len(products) == 1 and list(products.values()) == [1] and len(reactants) == 2:
+            complex_species = list(products)[0]
+            if complex_species in reduced.topology.species_index:
+                continue
+            for s in reactants:
+                if s not in enzymes and s in lumped:
+                    lumped[s].append(complex_species)
+    return lumped
+
+
+def qssa_benchmark(circuits = None, timepoints = None, repeats = 3, method = "LSODA"):
+    """
+    Function to compare the QSSA Genelet mechanism with the full enzyme-binding mechanism.
+    Every input combination of every circuit (activator of each input present or absent) is simulated with both
+    mechanisms. Full-mechanism concentrations are summed over the enzyme complexes of each species before comparing.
+    Optional arguments: circuits, dictionary of name -> function(qssa) returning (components, ic, inputs), defaults to BENCHMARK_CIRCUITS
+                        timepoints to simulate (defaults to 0 - 5000 s)
+                        repeats, number of timed simulations per case (the fastest is reported)
+                        method, solve_ivp method
+    Output: List of dictionaries, one per circuit and input combination, with the simulation time of each mechanism,
+            the speedup and the largest error relative to the largest full-mechanism concentration
+    """
+    circuits = BENCHMARK_CIRCUITS if circuits is None else circuits
+    timepoints = np.linspace(0, 5000, 200) if timepoints is None else np.asarray(timepoints, dtype = float)
+
+    def timed(model):
+        times = []
+        for r in range(repeats):
+            start = time.perf_counter()
+            R = model.simulate(timepoints, method = method)
+            times.append(time.perf_counter() - start)
+        return R, min(times)
+
+    rows = []
+    for name, circuit in circuits.items():
+        components, ic, inputs = circuit(False)
+        full = GeneletTemplate(components, ic = ic)
+        components, ic, inputs = circuit(True)
+        reduced = GeneletTemplate(components, ic = ic)
+        lumped = _lumped_species(full, reduced)
+
+        for bits in itertools.product([0, 1], repeat = len(inputs)):
+            case_ic = dict(ic)
+            for bit, species in zip(bits, inputs.values()):
+                case_ic[species] = ic[species] * bit
+            R_full, t_full = timed(full.bind(ic = case_ic))
+            R_qssa, t_qssa = timed(reduced.bind(ic = case_ic))
+
+            error = max(np.max(np.abs(R_full[lumped[s]].values.sum(axis = 1) - R_qssa[s].values)) for s in reduced.species)
+            scale = np.max(np.abs(R_full[full.species].values))
+            rows.append({"circuit": name, "inputs": dict(zip(inputs, bits)), "full_species": len(full.species),
+                         "qssa_species": len(reduced.species), "full_time": t_full, "qssa_time": t_qssa,
+                         "speedup": t_full / t_qssa, "relative_error": error / scale})
+    return rows
+
+
+def random_netlist(n_gates, n_inputs = 8, window = 40, seed = None):
+    """
+    Function to create a random cascaded netlist for GeneletCircuit.
+    Gates cycle through GATE_TYPES and read one (NOT) or two (NOR, NAND) signals among the last window signals defined,
+    so the circuit is a DAG of depth growing with n_gates.
+    Arguments: Number of gates
+    Optional arguments: n_inputs, number of primary inputs
+                        window, number of most recent signals each gate can read
+                        seed for the random number generator
+    Output: Netlist dictionary, list of primary input names
+    """
+    rng = np.random.default_rng(seed)
+    inputs = ["x" + str(i) for i in range(n_inputs)]
+    signals = list(inputs)
+    netlist = {}
+    for i in range(n_gates):
+        typ = GATE_TYPES[i % len(GATE_TYPES)]
+        sources = rng.choice(signals[-window:], 1 if typ == "NOT" else 2, replace = False)
+        netlist["g" + str(i)] = (typ, [str(s) for s in sources])
+        signals.append("g" + str(i))
+    return netlist, inputs
+
+
+def circuit_build_benchmark(sizes = (50, 100, 200, 500), qssa = False, seed = 0):
+    """
+    Function to measure the time and peak memory of compiling random netlists (see random_netlist) into a
+    simulation-ready CRNModel: GeneletCircuit, then GeneletTemplate, then bind.
+    Optional arguments: sizes, numbers of gates to build
+                        qssa, build QSSA Genelets
+                        seed for the random netlists
+    Output: List of dictionaries, one per size, with the number of switches, species and reactions, the time of each
+            stage and the peak memory in MB
+    """
+    rows = []
+    for n in sizes:
+        netlist, inputs = random_netlist(n, seed = seed)
+        tracemalloc.start()
+        start = time.perf_counter()
+        components, ic, input_levels, outputs = GeneletCircuit("c", netlist, inputs, qssa = qssa)
+        compiled = time.perf_counter()
+        template = GeneletTemplate(components, ic = ic)
+        built = time.perf_counter()
+        template.bind()
+        bound = time.perf_counter()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        rows.append({"gates": n, "switches": len(components), "species": len(template.species),
+                     "reactions": template.topology.n_reactions, "netlist_time": compiled - start,
+                     "template_time": built - compiled, "bind_time": bound - built, "peak_memory": peak / 1e6})
+    return rows
+
+
+# Benchmark suite: every workload is timed on circuits made of copies of one gate, over a range of circuit sizes
+
+def _logic_gate(typ):
+    def gate(qssa = False, prefix = ""):
+        components, ic = GeneletGate(prefix + typ, prefix + "out", typ = typ)
+        return components, ic, {}
+    return gate
+
+
+def _bistable(qssa = False, prefix = ""):
+    from genelet_bifurcation import bistable_switch_components
+
+    components, waste, ic = bistable_switch_components(qssa = qssa, prefix = prefix)
+    return components, ic, waste
+
+
+SUITE_CIRCUITS = {"NOR": nor_gate, "NAND": nand_gate, "AND": _logic_gate("AND"), "OR": _logic_gate("OR"),
+                  "bistable": _bistable}
+
+
+def _copies(circuit, switches):
+    # Number of copies of the gate needed for the given number of switches
+    per_gate = sum(isinstance(c, Genelet) for c in SUITE_CIRCUITS[circuit]()[0])
+    return max(-(-switches // per_gate), 1)
+
+
+def gate_array(circuit, switches, qssa = False):
+    """
+    Function to build a circuit of independent copies of one gate, sharing RNAP and RNase H, with at least the given
+    number of switches.
+    Arguments: Name of a SUITE_CIRCUITS gate, number of switches
+    Optional argument: qssa, build QSSA Genelets (the AND and OR gates of GeneletGate are always full)
+    Output: List of components, dictionary of initial conditions, list of extra reactions for GeneletTemplate
+    """
+    components, ic, reactions = [], {}, []
+    for copy in range(_copies(circuit, switches)):
+        gate_components, gate_ic, extra = SUITE_CIRCUITS[circuit](qssa = qssa, prefix = "c" + str(copy) + "_")
+        components += gate_components
+        ic.update(gate_ic)
+        reactions += extra if isinstance(extra, list) else []
+    return components, ic, reactions
+
+
+def _parametric_analysis():
+    # The SBML readers live next to the notebooks of Parametric Analysis
+    directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Parametric Analysis")
+    if directory not in sys.path:
+        sys.path.append(directory)
+
+
+# Every benchmark prepares its workload outside the timed region and returns the function to time
+
+def _construction(circuit, switches, qssa, settings):
+    return lambda: gate_array(circuit, switches, qssa = qssa)
+
+
+def _compile(circuit, components, reactions, settings):
+    # BioCRNpyler CRN of the components plus the extra mass-action reactions of gate_array (e.g. the waste reactions
+    # of the bistable switch), whose new species are named material_name like the strands (e.g. complex_W1)
+    crn = Mixture(name = circuit, components = components, parameter_file = settings["parameter_file"]).compile_crn()
+    species = {str(s): s for s in crn.species}
+    names = [name for reactants, products, rate_name, value in reactions for name in list(reactants) + list(products)]
+    new = [Species(name.split("_", 1)[1], material_type = name.split("_", 1)[0])
+           for name in dict.fromkeys(names) if name not in species]
+    crn.add_species(new)
+    species.update((str(s), s) for s in new)
+    crn.add_reactions([Reaction([species[s] for s in reactants], [species[s] for s in products], k = value,
+                                input_coefs = list(reactants.values()), output_coefs = list(products.values()))
+                       for reactants, products, rate_name, value in reactions])
+    return crn
+
+
+def _compile_crn(circuit, switches, qssa, settings):
+    components, ic, reactions = gate_array(circuit, switches, qssa = qssa)
+    return lambda: _compile(circuit, components, reactions, settings)
+
+
+def _template(circuit, switches, qssa, settings):
+    components, ic, reactions = gate_array(circuit, switches, qssa = qssa)
+    return lambda: GeneletTemplate(components, parameter_file = settings["parameter_file"], ic = ic, reactions = reactions)
+
+
+def _sbml_file(circuit, switches, qssa, settings):
+    components, ic, reactions = gate_array(circuit, switches, qssa = qssa)
+    crn = _compile(circuit, components, reactions, settings)
+    filename = os.path.join(settings["directory"], circuit + "_" + str(switches) + ".xml")
+    crn.write_sbml_file(filename)
+    return crn, filename
+
+
+def _sbml_write(circuit, switches, qssa, settings):
+    crn, filename = _sbml_file(circuit, switches, qssa, settings)
+    return lambda: crn.write_sbml_file(filename)
+
+
+def _sbml_read(circuit, switches, qssa, settings):
+    _parametric_analysis()
+    from sbml_crn import sbml_to_crn
+
+    crn, filename = _sbml_file(circuit, switches, qssa, settings)
+    return lambda: sbml_to_crn(filename, cache_dir = None)
+
+
+def _sbml_to_ode2(circuit, switches, qssa, settings):
+    _parametric_analysis()
+    from sbml_to_ode2 import sbml_to_ode2
+
+    crn, filename = _sbml_file(circuit, switches, qssa, settings)
+    return lambda: sbml_to_ode2(filename, cache_dir = None)
+
+
+def _bound(circuit, switches, qssa, settings):
+    components, ic, reactions = gate_array(circuit, switches, qssa = qssa)
+    template = GeneletTemplate(components, parameter_file = settings["parameter_file"], ic = ic, reactions = reactions)
+    return template, template.bind()
+
+
+def _simulate(circuit, switches, qssa, settings):
+    template, model = _bound(circuit, switches, qssa, settings)
+    return lambda: model.simulate(settings["timepoints"])
+
+
+def _stochastic(circuit, switches, qssa, settings):
+    from genelet_stochastic import StochasticSimulator
+
+    # Always QSSA Genelets at liposome copy numbers: the enzyme binding steps of the full mechanism make exact
+    # stochastic simulation of even one gate take minutes (see StochasticSimulator)
+
+    template, model = _bound(circuit, switches, True, settings)
+    simulator = StochasticSimulator(model, volume = 0.01)
+    return lambda: simulator.simulate(settings["timepoints"], method = "tau", seed = 0)
+
+
+def _sensitivity(circuit, switches, qssa, settings):
+    from genelet_fit import forward_sensitivities
+
+    template, model = _bound(circuit, switches, qssa, settings)
+    return lambda: forward_sensitivities(template, ["kon", "koff", "ktx"], settings["timepoints"])
+
+
+SUITE_BENCHMARKS = {"construction": _construction, "compile_crn": _compile_crn, "template": _template,
+                    "sbml_write": _sbml_write, "sbml_read": _sbml_read, "sbml_to_ode2": _sbml_to_ode2,
+                    "simulate": _simulate, "stochastic": _stochastic, "sensitivity": _sensitivity}
+
+
+def _environment():
+    import scipy
+    from importlib import metadata
+
+    try:
+        import subprocess
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output = True, text = True,
+                                cwd = os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {"python": platform.python_version(), "numpy": np.__version__, "scipy": scipy.__version__,
+            "biocrnpyler": metadata.version("biocrnpyler"), "platform": platform.platform(),
+            "processor": platform.processor() or platform.machine(), "commit": commit}
+
+
+def run_suite(benchmarks = None, circuits = None, sizes = (1, 10, 100, 500), repeats = 3, qssa = False, timepoints = None,
+              sample_time = 0.05, time_limit = None, parameter_file = "default_parameters.txt", filename = None,
+              verbose = False):
+    """
+    Function to run the benchmark suite: every benchmark on every circuit at every size.
+    Each case is prepared once (building the circuit, writing its SBML file, ...) and its workload is run once to warm
+    up imports and caches, then timed repeats times, each time in a loop of as many runs as fit in sample_time.
+    Arguments: none required
+    Optional arguments: benchmarks, list of SUITE_BENCHMARKS names (defaults to all)
+                        circuits, list of SUITE_CIRCUITS names (defaults to all)
+                        sizes, numbers of switches (circuits are built from whole gates, see gate_array)
+                        repeats, number of timed runs per case
+                        qssa, build QSSA Genelets
+                        timepoints of the simulation benchmarks (defaults to 0 - 1000 s)
+                        sample_time, minimum duration of one timing in seconds
+                        time_limit, seconds: once the median of a case exceeds it, the larger sizes of that benchmark
+                        and circuit are skipped
+                        parameter_file to build the circuits with
+                        filename to write the results to as JSON
+                        verbose, print every case as it finishes
+    Output: Dictionary with "environment" (versions, platform and git commit), "settings" and "results" (list of
+            dictionaries with benchmark, circuit, size, switches, loops per timing, times, median and min in seconds
+            per run)
+    """
+    benchmarks = list(SUITE_BENCHMARKS) if benchmarks is None else benchmarks
+    circuits = list(SUITE_CIRCUITS) if circuits is None else circuits
+    unknown = [b for b in benchmarks if b not in SUITE_BENCHMARKS] + [c for c in circuits if c not in SUITE_CIRCUITS]
+    if unknown:
+        raise RuntimeError('Unknown benchmarks or circuits: ' + ", ".join(unknown))
+    timepoints = np.linspace(0, 1000, 51) if timepoints is None else np.asarray(timepoints, dtype = float)
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        settings = {"timepoints": timepoints, "parameter_file": parameter_file, "directory": directory}
+        for benchmark in benchmarks:
+            for circuit in circuits:
+                per_gate = sum(isinstance(c, Genelet) for c in SUITE_CIRCUITS[circuit]()[0])
+                for size in sorted(sizes):
+                    run = SUITE_BENCHMARKS[benchmark](circuit, size, qssa, settings)
+
+                    # Fast workloads are run in loops of at least sample_time per timing, as timeit does
+
+                    start = time.perf_counter()
+                    run()
+                    loops = max(1, int(sample_time / max(time.perf_counter() - start, 1e-9)))
+                    times = []
+                    for r in range(repeats):
+                        start = time.perf_counter()
+                        for loop in range(loops):
+                            run()
+                        times.append((time.perf_counter() - start) / loops)
+                    row = {"benchmark": benchmark, "circuit": circuit, "size": size,
+                           "switches": _copies(circuit, size) * per_gate, "loops": loops, "times": times,
+                           "median": float(np.median(times)), "min": float(np.min(times))}
+                    results.append(row)
+                    if verbose:
+                        print("%-13s %-9s %4d switches   median %10.4f s   min %10.4f s" %
+                              (benchmark, circuit, row["switches"], row["median"], row["min"]), flush = True)
+                    if time_limit is not None and row["median"] > time_limit:
+                        break
+
+    suite = {"environment": _environment(),
+             "settings": {"repeats": repeats, "qssa": qssa, "sample_time": sample_time,
+                          "timepoints": [float(timepoints[0]), float(timepoints[-1]), len(timepoints)]},
+             "results": results}
+    if filename is not None:
+        with open(filename, "w") as f:
+            json.dump(suite, f, indent = 1)
+    return suite
+
+
+def compare_suite(results, baseline, tolerance = 0.25):
+    """
+    Function to compare suite results with a stored baseline, case by case (benchmark, circuit and size).
+    Arguments: Results of run_suite, or the name of their JSON file
+               Baseline results, or the name of their JSON file
+    Optional argument: tolerance, relative change of the time counted as noise
+    The fastest of the repeated timings is compared, as the least disturbed by other work on the machine.
+    Output: List of dictionaries, one per case, with the baseline and current times, their ratio and a status:
+            "slower" (ratio above 1 + tolerance), "faster" (below 1 / (1 + tolerance)), "same", "new" (no baseline
+            case) or "missing" (not run this time)
+    """
+    def load(suite):
+        if isinstance(suite, str):
+            with open(suite) as f:
+                suite = json.load(f)
+        return {(row["benchmark"], row["circuit"], row["size"]): row for row in suite["results"]}
+
+    current, reference = load(results), load(baseline)
+    rows = []
+    for key in list(current) + [key for key in reference if key not in current]:
+        now, before = current.get(key), reference.get(key)
+        row = {"benchmark": key[0], "circuit": key[1], "size": key[2],
+               "baseline": before["min"] if before else None, "time": now["min"] if now else None}
+        if now is None or before is None:
+            row.update(ratio = None, status = "missing" if now is None else "new")
+        else:
+            row["ratio"] = now["min"] / before["min"] if before["min"] > 0 else np.inf
+            row["status"] = "slower" if row["ratio"] > 1 + tolerance else "faster" if row["ratio"] < 1 / (1 + tolerance) else "same"
+        rows.append(row)
+    return rows
+
+
+if __name__ == "__main__":
+
+    # python genelet_benchmark.py runs the QSSA and circuit build benchmarks; python genelet_benchmark.py suite runs
+    # the benchmark suite, e.g. suite --sizes 1 10 100 --save results.json --baseline baseline.json, and exits with
+    # status 1 when a case is slower than the baseline
+
+    import argparse
+
+    parser = argparse.ArgumentParser(description = "Genelet benchmarks")
+    parser.add_argument("command", nargs = "?", default = "report", choices = ["report", "suite"])
+    parser.add_argument("--benchmarks", nargs = "+", default = None, choices = list(SUITE_BENCHMARKS))
+    parser.add_argument("--circuits", nargs = "+", default = None, choices = list(SUITE_CIRCUITS))
+    parser.add_argument("--sizes", nargs = "+", type = int, default = [1, 10, 100, 500])
+    parser.add_argument("--repeats", type = int, default = 3)
+    parser.add_argument("--qssa", action = "store_true")
+    parser.add_argument("--time-limit", type = float, default = None)
+    parser.add_argument("--save", default = None, help = "JSON file to write the results to")
+    parser.add_argument("--baseline", default = None, help = "JSON file of earlier results to compare with")
+    parser.add_argument("--tolerance", type = float, default = 0.25)
+    arguments = parser.parse_args()
+
+    if arguments.command == "suite":
+        suite = run_suite(arguments.benchmarks, arguments.circuits, arguments.sizes, repeats = arguments.repeats,
+                          qssa = arguments.qssa, time_limit = arguments.time_limit, filename = arguments.save,
+                          verbose = True)
+        if arguments.baseline is not None:
+            rows = compare_suite(suite, arguments.baseline, tolerance = arguments.tolerance)
+            for row in [row for row in rows if row["status"] != "missing"]:
+                print("%-13s %-9s %4d   baseline %10s   now %10s   %6s   %s" %
+                      (row["benchmark"], row["circuit"], row["size"],
+                       "-" if row["baseline"] is None else "%.4f s" % row["baseline"],
+                       "-" if row["time"] is None else "%.4f s" % row["time"],
+                       "" if row["ratio"] is None else "x%.2f" % row["ratio"], row["status"]))
+            print(sum(row["status"] == "missing" for row in rows), "baseline cases not run")
+            sys.exit(1 if any(row["status"] == "slower" for row in rows) else 0)
+        sys.exit(0)
+
+    for row in qssa_benchmark():
+        print("%-5s %-16s species %3d -> %3d   full %8.4f s   qssa %8.4f s   speedup %6.1f   error %.2e" %
+              (row["circuit"], row["inputs"], row["full_species"], row["qssa_species"], row["full_time"],
+               row["qssa_time"], row["speedup"], row["relative_error"]))
+
+    for row in circuit_build_benchmark():
+        print("%4d gates %5d switches %6d species %6d reactions   netlist %6.3f s   template %6.3f s   bind %6.4f s   peak %7.1f MB" %
+              (row["gates"], row["switches"], row["species"], row["reactions"], row["netlist_time"], row["template_time"],
+               row["bind_time"], row["peak_memory"]))
@@ -0,0 +1,242 @@
+import numpy as np
+from crn_model import CRNModel
+from genelet import Genelet, GeneletTemplate
+from genelet_steady_state import _positive_update, _reduced_system, steady_state
+
+
+def bistable_switch_components(qssa = False, kw = 9.96e-2, prefix = "", rnase = None, krnase = 1.0):
+    """
+    Components of the bistable switch of Bistable Switch Development.ipynb (see bistable_switch).
+    Optional arguments: qssa, build the Genelets with the QSSA mechanism
+                        kw, rate constant of the waste reactions
+                        prefix of every switch and strand name, for several copies of the switch in one circuit
+                        rnase, concentration of RNase (protein_RNAse) degrading the transcripts: R1 and R2 through the
+                        RNase step of the Genelets, I1 and I2 through mass-action reactions; None for the notebook circuit
+                        krnase, rate constant of the degradation of I1 and I2 by RNase
+    Output: List of Genelet components, list of extra reactions (see the reactions of GeneletTemplate), dictionary of
+            initial conditions
+    """
+    p = prefix
+    Induce_1N = Genelet(p + "Induce1N", transcript = p + "I1", activator = p + "A2u", inhibitor = p + "I2u", qssa = qssa)
+    Induce_2N = Genelet(p + "Induce2N", transcript = p + "I2", activator = p + "A1u", inhibitor = p + "I1u", qssa = qssa)
+    Core_1N = Genelet(p + "Core1N", transcript = p + "R1", activator = p + "A1", inhibitor = p + "R2", qssa = qssa)
+    Core_2N = Genelet(p + "Core2N", transcript = p + "R2", activator = p + "A2", inhibitor = p + "R1", qssa = qssa)
+    reactions = [({"rna_" + p + "I1": 1, "rna_" + p + "R1": 1}, {"complex_" + p + "W1": 1}, "kw", kw),
+                 ({"rna_" + p + "I2": 1, "rna_" + p + "R2": 1}, {"complex_" + p + "W2": 1}, "kw", kw)]
+    ic = {p + "Core1N_OFF": 2000, "dna_" + p + "A1": 2000, "rna_" + p + "R2": 0, p + "Core2N_OFF": 2000,
+          "dna_" + p + "A2": 2000, "rna_" + p + "R1": 0, p + "Induce1N_OFF": 2000, "dna_" + p + "A2u": 2000,
+          "rna_" + p + "I2u": 0, p + "Induce2N_OFF": 2000, "dna_" + p + "A1u": 0, "rna_" + p + "I1u": 0,
+          "protein_RNAseH": 10, "protein_RNAP": 150}
+    if rnase is not None:
+        reactions += [({"rna_" + p + "I1": 1, "protein_RNAse": 1}, {"protein_RNAse": 1}, "krnase", krnase),
+                      ({"rna_" + p + "I2": 1, "protein_RNAse": 1}, {"protein_RNAse": 1}, "krnase", krnase)]
+        ic["protein_RNAse"] = rnase
+    return [Core_1N, Core_2N, Induce_1N, Induce_2N], reactions, ic
+
+
+def bistable_switch(qssa = False, kw = 9.96e-2, rnase = 0.01, krnase = 1.0):
+    """
+    Bistable switch of Bistable Switch Development.ipynb: Core_1N and Core_2N repress each other through their
+    transcripts R1 and R2, Induce_1N and Induce_2N make I1 and I2, which remove R1 and R2 as the waste complexes W1 and W2.
+    RNase degrades the four transcripts, so the switch has steady states: in the notebook circuit (rnase = None) the
+    transcripts only leave through the waste reactions and accumulate, and continuation raises RuntimeError.
+    The inputs dna_A2u and dna_A1u drive the switch to R2 and to R1. With dna_A1u = 1500, continuation over dna_A2u
+    from the R1 state finds folds at dna_A2u ~ 660 and ~ 1740, bounding a hysteresis window:
+        template = bistable_switch()
+        model = template.bind(ic = dict(template.ic, dna_A1u = 1500, dna_A2u = 0, rna_R1 = 1000))
+        branch = continuation(model, "dna_A2u", (0, 4000))
+    Optional arguments: qssa, build the Genelets with the QSSA mechanism
+                        kw, rate constant of the waste reactions
+                        rnase, krnase, RNase concentration and rate constant of I1 and I2 degradation (see
+                        bistable_switch_components), rnase = None for the notebook circuit
+    Output: GeneletTemplate of the switch, whose ic are the notebook initial conditions
+    """
+    components, reactions, ic = bistable_switch_components(qssa = qssa, kw = kw, rnase = rnase, krnase = krnase)
+    return GeneletTemplate(components, ic = ic, reactions = reactions, name = "bistable_switch")
+
+
+def _stable(J, basis):
+    # Stability within the conservation laws: eigenvalues of the Jacobian restricted to their null space, with a
+    # tolerance near rounding, as the slow modes of a switch are many orders of magnitude below its fastest rates
+    if basis.shape[1] == 0:
+        return True
+    eigenvalues = np.linalg.eigvals(basis.T @ J @ basis)
+    return bool(np.all(eigenvalues.real < 1e-12 * max(1.0, np.max(np.abs(eigenvalues)))))
+
+
+def continuation(model, parameter, bounds, template = None, x0 = None, step = 0.02, min_step = 1e-5, max_step = 0.1,
+                 max_points = 2000, tol = 1e-8, max_iter = 10, stability = True):
+    """
+    Function to trace a branch of steady states of a Genelet CRN as one parameter varies, by pseudo-arclength
+    continuation. Each point is predicted along the tangent of the branch from the previous one and corrected with
+    Newton's method on the analytic Jacobian, with the conservation laws of the initial state (see steady_state), so
+    the branch is followed around folds where the steady state stops depending smoothly on the parameter.
+    Folds are located where the parameter turns back along the branch, and every pair of successive folds bounds a
+    hysteresis window: inside it the circuit has two stable states and which one it settles to depends on its history.
+    Arguments: CRNModel (e.g. from GeneletTemplate.bind)
+               Name of the parameter: a species, whose initial amount (and so the total of its conservation laws, e.g.
+               protein_RNAseH or dna_A1u) is varied, or a parameter of template (e.g. kon)
+               (start, end) values of the parameter; the branch starts at the steady state at start
+    Optional arguments: template the model was bound from, needed for rate parameters
+                        x0, initial state setting the conserved totals and the Newton start (defaults to model.x0)
+                        step, min_step, max_step, arclength steps relative to the scale of the state and to |end - start|
+                        max_points, maximum number of points on the branch
+                        tol, max_iter, Newton tolerance (relative to the largest concentration) and iterations per point
+                        stability, compute the stability of every point
+    Output: Dictionary with "parameter" (array of parameter values), "states" (points x species array of steady
+            states), "stable" (boolean array, None without stability), "folds" (list of dictionaries with the
+            "parameter", "state" and "index" of the branch point before each fold), "hysteresis" (list of
+            (low, high) parameter windows between successive folds) and "complete" (whether the branch reached end)
+    """
+    from scipy.linalg import null_space
+
+    topology = model.topology
+    start_value, end_value = float(bounds[0]), float(bounds[1])
+    direction = 1.0 if end_value >= start_value else -1.0
+    x = np.array(model.x0 if x0 is None else x0, dtype = float)
+    active, position, L, pivots = _reduced_system(topology)
+    basis = null_space(L) if len(L) else np.eye(len(active))
+
+    # Parameter dependence: a species sets the totals of its conservation laws, a rate parameter the rate constants
+
+    if parameter in topology.species_index:
+        i = topology.species_index[parameter]
+        if position[i] < 0 or not np.any(L[:, position[i]]):
+            raise RuntimeError('Species ' + parameter + ' is not in any conservation law, its initial amount has no effect')
+        column = L[:, position[i]]
+        base_totals = L @ x[active] - column * x[i]
+
+        def totals(value):
+            return base_totals + column * value
+
+        def rates(value):
+            return model.k, model.K
+    elif template is not None and parameter in template.parameters:
+        base_parameters = dict(model.parameters or {})
+
+        def totals(value):
+            return L @ x[active]
+
+        def rates(value):
+            params, k, K = template._rates(dict(base_parameters, **{parameter: value}))
+            return k, K
+    else:
+        raise RuntimeError('Unknown continuation parameter ' + parameter + ', pass the template for rate parameters')
+
+    # Scaled unknowns u = (active species / x_scale, parameter / p_scale)
+
+    x_scale = max(1.0, np.max(np.abs(x)))
+    p_scale = abs(end_value - start_value) or max(1.0, abs(start_value))
+    n = len(active)
+
+    def residual(xa, value):
+        x[active] = xa
+        k, K = rates(value)
+        F = topology.rhs(x, k, K)[active]
+        F[pivots] = L @ xa - totals(value)
+        return F
+
+    def jacobian(xa, value):
+        x[active] = xa
+        k, K = rates(value)
+        J = np.empty((n, n + 1))
+        J[:, :n] = topology.jacobian(x, k, K)[np.ix_(active, active)]
+        J[pivots, :n] = L
+        h = 1e-6 * max(abs(value), 1e-12)
+        J[:, n] = (residual(xa, value + h) - residual(xa, value - h)) / (2 * h)
+        x[active] = xa
+        J[:, :n] *= x_scale
+        J[:, n] *= p_scale
+        return J
+
+    x_start = x.copy()
+    if parameter in topology.species_index:
+        x_start[topology.species_index[parameter]] = start_value
+    k, K = rates(start_value)
+    x_start, info = steady_state(CRNModel(topology, k, x_start, parameters = model.parameters, K = K), tol = tol)
+    if not info["converged"]:
+        raise RuntimeError('No steady state found at ' + parameter + ' = ' + str(start_value))
+    x_rest = x_start.copy()
+
+    u = np.append(x_start[active] / x_scale, start_value / p_scale)
+    tangent = np.zeros(n + 1)
+    tangent[n] = direction
+    J = jacobian(u[:n] * x_scale, u[n] * p_scale)
+
+    def tangent_at(J, previous):
+        t = np.linalg.solve(np.vstack([J, previous]), np.append(np.zeros(n), 1.0))
+        return t / np.linalg.norm(t)
+
+    tangent = tangent_at(J, tangent)
+    points, tangents = [u.copy()], [tangent.copy()]
+    stable = [_stable(J[:, :n] / x_scale, basis)] if stability else None
+    ds = step
+    complete = False
+
+    while len(points) < max_points:
+        predicted = u + ds * tangent
+        v = predicted.copy()
+        converged = False
+        for iteration in range(max_iter):
+            F = np.append(residual(v[:n] * x_scale, v[n] * p_scale), tangent @ (v - predicted))
+            if np.max(np.abs(F[:n])) < tol * x_scale:
+                converged = True
+                break
+            J = jacobian(v[:n] * x_scale, v[n] * p_scale)
+            try:
+                v = v + np.linalg.solve(np.vstack([J, tangent]), -F)
+            except np.linalg.LinAlgError:
+                break
+
+        # A branch that crosses zero concentrations is unphysical beyond the crossing: the physical branch continues
+        # along the boundary, found by Newton at the same parameter value with updates kept non-negative
+
+        if converged and np.any(v[:n] < -1e-9):
+            xa = np.maximum(v[:n], 0.0) * x_scale
+            converged = False
+            for iteration in range(max_iter):
+                F = residual(xa, v[n] * p_scale)
+                if np.max(np.abs(F)) < tol * x_scale:
+                    converged = True
+                    v = np.append(xa / x_scale, v[n])
+                    break
+                try:
+                    xa = _positive_update(xa, np.linalg.solve(jacobian(xa, v[n] * p_scale)[:, :n] / x_scale, -F))
+                except np.linalg.LinAlgError:
+                    break
+        if not converged:
+            if ds <= min_step:
+                break
+            ds = max(ds / 2, min_step)
+            continue
+
+        J = jacobian(v[:n] * x_scale, v[n] * p_scale)
+        tangent = tangent_at(J, tangent)
+        u = v
+        points.append(u.copy())
+        tangents.append(tangent.copy())
+        if stability:
+            stable.append(_stable(J[:, :n] / x_scale, basis))
+        ds = min(ds * 1.5, max_step) if iteration <= 3 else ds
+        if direction * (u[n] * p_scale - end_value) >= 0:
+            complete = True
+            break
+        if direction * (u[n] * p_scale - start_value) < 0:
+            break
+
+    points = np.array(points)
+    tangents = np.array(tangents)
+    values = points[:, n] * p_scale
+    states = np.tile(x_rest, (len(points), 1))
+    states[:, active] = points[:, :n] * x_scale
+
+    # Folds: the parameter component of the tangent changes sign, located by linear interpolation of the tangent
+
+    folds = []
+    for i in np.nonzero(np.sign(tangents[:-1, n]) * np.sign(tangents[1:, n]) < 0)[0]:
+        w = tangents[i, n] / (tangents[i, n] - tangents[i + 1, n])
+        folds.append({"parameter": float(values[i] + w * (values[i + 1] - values[i])),
+                      "state": states[i] + w * (states[i + 1] - states[i]), "index": int(i)})
+    hysteresis = [tuple(sorted((a["parameter"], b["parameter"]))) for a, b in zip(folds[:-1], folds[1:])]
+    return {"parameter": values, "states": states, "stable": None if stable is None else np.array(stable),
+            "folds": folds, "hysteresis": hysteresis, "complete": complete}
@@ -0,0 +1,98 @@
+from genelet import Genelet
+
+GATE_TYPES = ["NOT", "NOR", "NAND"]
+
+
+def _check_netlist(netlist, inputs):
+    # Every gate has a known type and the right number of inputs, and every signal it reads exists
+    signals = set(inputs)
+    for gate in netlist:
+        if gate in signals:
+            raise RuntimeError('Circuit signal ' + str(gate) + ' is defined twice')
+        signals.add(gate)
+    for gate, (typ, sources) in netlist.items():
+        if typ not in GATE_TYPES:
+            raise RuntimeError('Gate ' + str(gate) + ' has unknown type ' + str(typ) + ', must be one of ' + ", ".join(GATE_TYPES))
+        if len(sources) == 0 or (typ == "NOT" and len(sources) != 1):
+            raise RuntimeError('Gate ' + str(gate) + ' of type ' + typ + ' has ' + str(len(sources)) + ' inputs')
+        unknown = [s for s in sources if s not in signals]
+        if unknown:
+            raise RuntimeError('Gate ' + str(gate) + ' reads undefined signals: ' + ", ".join(map(str, unknown)))
+
+
+def GeneletCircuit(name, netlist, inputs, outputs = None, switch = 2000, activator = 2000, rnap = 500, rnaseH = 10, rnase = 0, qssa = False):
+    """
+    Function to compile a netlist of Genelet logic gates into Genelet components that can be added to a mixture
+    or compiled with GeneletTemplate.
+    A signal is high while its switch is ON. Every wire is a copy of the driving switch (same activators and
+    inhibitors, its own switch DNA) that transcribes an inhibitor of the driven gate, so a gate switches OFF
+    when its inputs are high: a NOR/NOT gate has one activator/inhibitor set that all its inputs inhibit,
+    a NAND gate has one set per input and stays ON while any input is low.
+    Primary inputs are switches that are ON when their activator is added (logic 1) and OFF without it (logic 0).
+    Arguments: Name of circuit (acts as a prefix for all species names involved in the circuit)
+               Netlist: dictionary of gate name -> (gate type, list of input signal names), gate type one of GATE_TYPES
+                        and signal names either gate names or primary input names (feedback loops are allowed)
+               List of primary input names
+    Optional arguments: outputs, gates to report with an extra switch copy transcribing <name>_<gate>_out (defaults to
+                                 every gate that drives no other gate)
+                        switch, activator, DNA concentration of every switch copy and of the activator it needs
+                        rnap, rnaseH, rnase, enzyme concentrations
+                        qssa, build QSSA Genelets (see Genelet)
+    Output: List of Genelet components
+            Dictionary of initial conditions, with every primary input at logic 0
+            Dictionary of primary input name -> {0: initial conditions, 1: initial conditions} (see genelet_logic.truth_table)
+            Dictionary of output gate name -> list of the ON species of its reporting switch
+    """
+    if type(name) != str:
+        raise RuntimeError('Circuit name must be a string')
+    _check_netlist(netlist, inputs)
+    if outputs is None:
+        driving = set(s for typ, sources in netlist.values() for s in sources)
+        outputs = [gate for gate in netlist if gate not in driving]
+
+    def prefixed(*parts):
+        return "_".join([name] + [str(p) for p in parts])
+
+    # Activator and inhibitor sets of every switch: one for inputs, NOT and NOR gates, one per input for NAND gates
+
+    sets = {}
+    for node in list(inputs) + list(netlist):
+        n = len(netlist[node][1]) if node in netlist and netlist[node][0] == "NAND" else 1
+        sets[node] = ([prefixed(node, "A" + str(k + 1)) for k in range(n)], [prefixed(node, "I" + str(k + 1)) for k in range(n)])
+
+    # One switch copy per wire, transcribing the inhibitor of the set it drives, plus one reporter copy per output
+
+    wires = {node: [] for node in sets}
+    for gate, (typ, sources) in netlist.items():
+        for k, source in enumerate(sources):
+            inhibitor = sets[gate][1][k if typ == "NAND" else 0]
+            wires[source].append((prefixed(source, "to", gate, k + 1), inhibitor))
+    for gate in outputs:
+        wires[gate].append((prefixed(gate, "out"), prefixed(gate, "out")))
+
+    components = []
+    ic = {"protein_RNAP": rnap, "protein_RNAseH": rnaseH, "protein_RNAse": rnase}
+    input_levels = {}
+    output_species = {}
+    for node, copies in wires.items():
+        activators, inhibitors = sets[node]
+        if not copies:
+            continue
+        for switch_name, transcript in copies:
+            genelet = Genelet(switch_name, transcript = transcript, activator = activators, inhibitor = inhibitors, qssa = qssa)
+            components.append(genelet)
+            ic[switch_name + "_OFF"] = switch
+            if node in outputs and transcript == prefixed(node, "out"):
+                on = [str(s) for s in genelet.switch_ons]
+                output_species[node] = list(dict.fromkeys(str(s) for s in genelet.update_species() if any(o in str(s) for o in on)))
+
+        # Each copy binds its own activator strands
+
+        levels = {"dna_" + a: activator * len(copies) for a in activators}
+        if node in netlist:
+            ic.update(levels)
+        else:
+            input_levels[node] = {0: {species: 0 for species in levels}, 1: levels}
+            ic.update(input_levels[node][0])
+
+    return components, ic, input_levels, output_species
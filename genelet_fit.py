@@ -0,0 +1,263 @@
+import numpy as np
+from genelet_parameters import PARAMETER_FILE_ENTRIES, ParameterStore
+from genelet_profile import record_solution, solver_method, stage
+from genelet_sweep import latin_hypercube
+
+COMPLEX_STEP = 1e-20
+
+
+def load_timecourse(source):
+    """
+    Function to read a measured time-course.
+    Arguments: CSV or Parquet file name, or a pandas DataFrame, with a "time" column and one column per measured
+               species (or observable, see FitProblem); missing measurements are left empty (NaN)
+    Output: Pandas DataFrame sorted by time
+    """
+    import pandas as pd
+
+    if isinstance(source, pd.DataFrame):
+        data = source
+    elif str(source).endswith((".parquet", ".pq")):
+        data = pd.read_parquet(source)
+    else:
+        data = pd.read_csv(source)
+    if "time" not in data.columns:
+        raise RuntimeError('Time-course data needs a "time" column')
+    return data.sort_values("time").reset_index(drop = True)
+
+
+def forward_sensitivities(template, names, timepoints, parameters = None, ic = None, method = "BDF", rtol = 1e-6, atol = 1e-9):
+    """
+    Function to simulate a Genelet circuit together with the derivatives of every species with respect to named parameters.
+    The sensitivities S_j = dx/dp_j are integrated with the state as one augmented ODE, dS_j/dt = J S_j + df/dp_j,
+    with J the analytic Jacobian of the CRN. df/dp_j goes through the rate constants that derive from p_j (see
+    genelet_rate_constants), differentiated by complex step, so the gradients are exact up to the integrator tolerance.
+    Arguments: GeneletTemplate
+               List of parameter names, as in GeneletTemplate.parameters
+               Timepoints to simulate
+    Optional arguments: parameters, dictionary of parameter overrides; ic, initial conditions (defaults to the template ic)
+                        method, rtol, atol, solve_ivp settings
+    Output: (solutions of shape (len(timepoints), n_species), sensitivities of shape (len(timepoints), len(names), n_species))
+    """
+    from scipy.integrate import solve_ivp
+    from scipy.sparse import csr_matrix, hstack, identity, kron
+
+    topology = template.topology
+    params, k, K = template._rates(parameters)
+    directions = []
+    for name in names:
+        shifted = dict(params)
+        shifted[name] = params[name] + 1j * COMPLEX_STEP
+        directions.append(template._rates(shifted, dtype = complex)[1:])
+    stoichiometry = csr_matrix((topology.stoich_values, (topology.stoich_rows, topology.stoich_cols)),
+                               shape = (topology.n_species, topology.n_reactions))
+    n, m = topology.n_species, len(names)
+
+    def rhs(t, y):
+        x = y[:n]
+        S = y[n:].reshape(m, n).T
+        dv = np.stack([topology.propensities(x, kc, Kc).imag / COMPLEX_STEP for kc, Kc in directions], axis = 1)
+        dS = topology.jacobian(x, k, K) @ S + stoichiometry @ dv
+        return np.concatenate([topology.rhs(x, k, K), dS.T.ravel()])
+
+    # Block lower-triangular Jacobian: J on the diagonal, and the dependence of every dS_j/dt on x (second
+    # derivatives of the rates) in the first block column, by forward differences, which keeps Newton converging fast
+
+    def jac(t, y):
+        J = csr_matrix(topology.jacobian(y[:n], k, K))
+        base = rhs(t, y)[n:]
+        coupling = np.empty((n * m, n))
+        for i in range(n):
+            h = 1e-7 * max(abs(y[i]), 1.0)
+            shifted = y.copy()
+            shifted[i] += h
+            coupling[:, i] = (rhs(t, shifted)[n:] - base) / h
+        column = csr_matrix(np.vstack([np.zeros((n, n)), coupling]))
+        blocks = kron(identity(m + 1), J, format = "csr")
+        return (blocks + hstack([column, csr_matrix((n * (m + 1), n * m))])).tocsc()
+
+    x0 = topology.initial_state(template.ic if ic is None else ic)
+    timepoints = np.asarray(timepoints, dtype = float)
+    with stage("simulate"):
+        sol = solve_ivp(rhs, (timepoints[0], timepoints[-1]), np.concatenate([x0, np.zeros(n * m)]),
+                        method = solver_method(method), t_eval = timepoints,
+                        jac = jac if method in ("BDF", "Radau", "LSODA") else None, rtol = rtol, atol = atol)
+    record_solution(sol)
+    if not sol.success:
+        raise RuntimeError('Sensitivity integration failed: ' + sol.message)
+    return sol.y[:n].T, sol.y[n:].T.reshape(len(timepoints), m, n)
+
+
+class FitProblem:
+    """
+    Weighted least-squares fit of named Genelet parameters to measured time-courses.
+    Parameters are fitted in log space, so they stay positive and rates spanning decades are treated alike.
+    Arguments: GeneletTemplate
+               List of experiments, each a dictionary with "data" (see load_timecourse) and optionally "ic" (initial
+               conditions of the experiment, defaulting to the template ic) and "parameters" (fixed overrides, e.g. the
+               temperature of the experiment)
+               List of parameter names to fit
+    Optional arguments: observables, dictionary of data column -> list of species summed to predict it (e.g. the total
+                        ON state of a switch with two activator sets); other columns are matched to species by name
+                        sigma, dictionary of data column -> measurement standard deviation, defaulting to the largest
+                        absolute value of the column over all experiments so every column weighs alike
+                        method, rtol, atol, solve_ivp settings
+    """
+    def __init__(self, template, experiments, names, observables = None, sigma = None, method = "BDF", rtol = 1e-6, atol = 1e-9):
+
+        unknown = [name for name in names if name not in template.parameters]
+        if unknown:
+            raise RuntimeError('Unknown Genelet parameters: ' + ", ".join(unknown))
+        self.template = template
+        self.names = list(names)
+        self.settings = {"method": method, "rtol": rtol, "atol": atol}
+        observables = observables or {}
+        sigma = sigma or {}
+
+        data = [load_timecourse(experiment["data"]) for experiment in experiments]
+        largest = {}
+        for d in data:
+            for c in d.columns:
+                if c != "time":
+                    largest[c] = max(largest.get(c, 0.0), np.nanmax(np.abs(d[c].to_numpy(dtype = float)), initial = 0.0))
+
+        self.experiments = []
+        self.n_residuals = 0
+        for experiment, d in zip(experiments, data):
+            columns = [c for c in d.columns if c != "time"]
+            rows = []
+            for c in columns:
+                members = observables.get(c, [c])
+                missing = [s for s in members if s not in template.topology.species_index]
+                if missing:
+                    raise RuntimeError('Data column ' + c + ' is not a species or observable of the circuit')
+                rows.append([template.topology.species_index[s] for s in members])
+            values = d[columns].to_numpy(dtype = float)
+            scale = np.array([sigma.get(c, largest[c] or 1.0) for c in columns])
+            observed = ~np.isnan(values)
+            time = d["time"].to_numpy(dtype = float)
+            self.experiments.append({"time": np.concatenate([[0.0], time]) if time[0] > 0 else time, "offset": int(time[0] > 0),
+                                     "rows": rows, "values": values, "scale": scale, "observed": observed,
+                                     "ic": experiment.get("ic"), "parameters": experiment.get("parameters", {})})
+            self.n_residuals += int(observed.sum())
+        self._cache = (None, None, None)
+
+    def _evaluate(self, theta):
+        # Residuals and their Jacobian with respect to log parameters, cached for the last theta
+        if self._cache[0] is not None and np.array_equal(self._cache[0], theta):
+            return self._cache[1], self._cache[2]
+        p = np.exp(theta)
+        residuals, jacobian = [], []
+        for e in self.experiments:
+            parameters = dict(e["parameters"], **dict(zip(self.names, p)))
+            x, S = forward_sensitivities(self.template, self.names, e["time"], parameters = parameters, ic = e["ic"],
+                                         **self.settings)
+            x, S = x[e["offset"]:], S[e["offset"]:]
+            predicted = np.stack([x[:, rows].sum(axis = 1) for rows in e["rows"]], axis = 1)
+            dpredicted = np.stack([S[:, :, rows].sum(axis = 2) for rows in e["rows"]], axis = 2)
+            r = (predicted - e["values"]) / e["scale"]
+            dr = dpredicted * p[np.newaxis, :, np.newaxis] / e["scale"]
+            residuals.append(r[e["observed"]])
+            jacobian.append(dr.transpose(0, 2, 1)[e["observed"]])
+        self._cache = (theta.copy(), np.concatenate(residuals), np.concatenate(jacobian))
+        return self._cache[1], self._cache[2]
+
+    def residuals(self, theta):
+        """Weighted residuals (prediction - data) / sigma of every measurement, at log parameters theta"""
+        return self._evaluate(theta)[0]
+
+    def jacobian(self, theta):
+        """Derivatives of the residuals with respect to the log parameters theta, from forward sensitivities"""
+        return self._evaluate(theta)[1]
+
+    def fit(self, start, bounds, loss = "linear", max_nfev = None):
+        """
+        Function to run one least-squares fit.
+        Arguments: Dictionary of starting parameter values
+                   Dictionary of parameter name -> (low, high)
+        Optional arguments: loss, scipy.optimize.least_squares loss: "linear" is the maximum likelihood estimate for
+                            Gaussian measurement errors of standard deviation sigma, "soft_l1", "huber" or "cauchy"
+                            are robust to outliers
+                            max_nfev, maximum number of residual evaluations
+        Output: Dictionary with the fitted "parameters", "cost" (half the sum of squared residuals), "log_std"
+                (standard errors of the log parameters from the Gauss-Newton covariance), "success", "nfev", "message"
+                and the "start" values
+        """
+        from scipy.optimize import least_squares
+
+        low = np.log([bounds[name][0] for name in self.names])
+        high = np.log([bounds[name][1] for name in self.names])
+        theta0 = np.clip(np.log([start[name] for name in self.names]), low, high)
+        result = least_squares(self.residuals, theta0, jac = self.jacobian, bounds = (low, high), loss = loss,
+                               x_scale = "jac", max_nfev = max_nfev)
+        dof = max(self.n_residuals - len(self.names), 1)
+        try:
+            covariance = np.linalg.inv(result.jac.T @ result.jac) * 2 * result.cost / dof
+            log_std = np.sqrt(np.maximum(np.diag(covariance), 0.0))
+        except np.linalg.LinAlgError:
+            log_std = np.full(len(self.names), np.inf)
+        return {"parameters": dict(zip(self.names, np.exp(result.x).tolist())), "cost": float(result.cost),
+                "log_std": dict(zip(self.names, log_std.tolist())), "success": bool(result.success),
+                "nfev": int(result.nfev), "message": result.message, "start": dict(start)}
+
+
+# Worker process state, set once per process so the fit problem is only pickled once per worker
+
+_worker = {}
+
+def _init_worker(problem, bounds, loss, max_nfev):
+    _worker.update(problem = problem, bounds = bounds, loss = loss, max_nfev = max_nfev)
+
+def _fit_start(start):
+    try:
+        return _worker["problem"].fit(start, _worker["bounds"], loss = _worker["loss"], max_nfev = _worker["max_nfev"])
+    except RuntimeError as error:
+        return {"parameters": dict(start), "cost": np.inf, "log_std": {}, "success": False, "nfev": 0,
+                "message": str(error), "start": dict(start)}
+
+
+def fit_parameters(problem, bounds = None, n_starts = 8, loss = "linear", max_nfev = None, processes = None, seed = None):
+    """
+    Function to fit a FitProblem from several starting points in parallel.
+    The first start is the current template parameters, the others a log-uniform Latin hypercube within the bounds.
+    Arguments: FitProblem
+    Optional arguments: bounds, dictionary of parameter name -> (low, high), defaults to 1/100 to 100 times the
+                        template values
+                        n_starts, number of starting points
+                        loss, max_nfev, see FitProblem.fit
+                        processes, number of worker processes (defaults to all cores, 1 runs in this process)
+                        seed for the starting points
+    Output: List of FitProblem.fit results, best (lowest cost) first; starts whose simulation failed have infinite cost
+    """
+    from multiprocessing import Pool
+
+    defaults = problem.template.parameters
+    bounds = {name: (defaults[name] / 100, defaults[name] * 100) for name in problem.names} if bounds is None else bounds
+    starts = [{name: defaults[name] for name in problem.names}]
+    if n_starts > 1:
+        starts += latin_hypercube(n_starts - 1, {name: bounds[name] for name in problem.names}, log = True, seed = seed)
+
+    if processes == 1:
+        _init_worker(problem, bounds, loss, max_nfev)
+        results = [_fit_start(start) for start in starts]
+    else:
+        with Pool(processes, initializer = _init_worker, initargs = (problem, bounds, loss, max_nfev)) as pool:
+            results = pool.map(_fit_start, starts)
+    return sorted(results, key = lambda result: result["cost"])
+
+
+def write_parameter_file(parameters, filename, parameter_file = "default_parameters.txt"):
+    """
+    Function to write fitted parameters in the parameter file format (tab separated mechanism_id, part_id, param_name,
+    param_val, comments). Every line of parameter_file is copied, with the values of the fitted parameters replaced.
+    Arguments: Dictionary of parameter name -> value (e.g. the "parameters" of a fit result), names as in
+               GeneletTemplate.parameters and listed in PARAMETER_FILE_ENTRIES
+               Name of the file to write
+    Optional argument: parameter_file to copy
+    """
+    unknown = [name for name in parameters if name not in PARAMETER_FILE_ENTRIES]
+    if unknown:
+        raise RuntimeError('Parameters without a line of their own in the parameter file: ' + ", ".join(unknown))
+    store = ParameterStore(parameter_file)
+    store.update({PARAMETER_FILE_ENTRIES[name]: value for name, value in parameters.items()})
+    store.write(filename)
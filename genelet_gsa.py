@@ -0,0 +1,223 @@
+import numpy as np
+from genelet import GeneletTemplate
+from genelet_sweep import run_sweep
+
+# Genelet parameter block of default_parameters.txt
+
+GENELET_GSA_PARAMETERS = ["ktx", "kleak", "kdeg", "kM_tx", "kM_leak", "kM_deg", "ku_tx", "ku_leak", "ku_deg", "kon", "koff",
+                          "ka", "kcat"]
+
+
+def parameter_bounds(template, names = None, factor = 10.0):
+    """
+    Function to create sampling bounds around the default parameters of a template.
+    Arguments: GeneletTemplate
+    Optional arguments: names, list of parameter names (defaults to the Genelet block GENELET_GSA_PARAMETERS)
+                        factor, every parameter is sampled between default / factor and default * factor
+    Output: Dictionary of parameter name -> (low, high)
+    """
+    names = GENELET_GSA_PARAMETERS if names is None else names
+    unknown = [name for name in names if name not in template.parameters]
+    if unknown:
+        raise RuntimeError('Unknown Genelet parameters: ' + ", ".join(unknown))
+    return {name: (template.parameters[name] / factor, template.parameters[name] * factor) for name in names}
+
+
+def _scale(u, bounds, log):
+    # Map unit-cube coordinates (points x parameters) to parameter values
+    low = np.array([bounds[name][0] for name in bounds], dtype = float)
+    high = np.array([bounds[name][1] for name in bounds], dtype = float)
+    if log:
+        if np.any(low <= 0):
+            raise RuntimeError('Log-scale sampling needs positive bounds')
+        return np.exp(np.log(low) + u * (np.log(high) - np.log(low)))
+    return low + u * (high - low)
+
+
+def _as_points(values, names):
+    return [{name: float(v) for name, v in zip(names, row)} for row in values]
+
+
+def sobol_points(n, bounds, log = True, seed = None):
+    """
+    Function to create the quasi-random sample of a Sobol analysis (Saltelli scheme).
+    Two independent matrices A and B of n points are taken from one scrambled Sobol sequence of twice the dimension,
+    and for every parameter i a matrix AB_i equal to A with column i taken from B.
+    Arguments: Number of base points n (a power of 2 keeps the Sobol sequence balanced)
+               Dictionary of parameter name -> (low, high)
+    Optional arguments: log, sample uniformly in log space (for rate constants spanning decades)
+                        seed for the scrambling
+    Output: List of n * (len(bounds) + 2) sweep points: A, then B, then AB_1, ..., AB_d
+    """
+    from scipy.stats import qmc
+
+    names = list(bounds)
+    d = len(names)
+    u = qmc.Sobol(2 * d, scramble = True, seed = seed).random(n)
+    A, B = u[:, :d], u[:, d:]
+    blocks = [A, B]
+    for i in range(d):
+        AB = A.copy()
+        AB[:, i] = B[:, i]
+        blocks.append(AB)
+    return _as_points(_scale(np.vstack(blocks), bounds, log), names)
+
+
+def morris_points(r, bounds, levels = 4, log = True, seed = None):
+    """
+    Function to create the trajectories of a Morris elementary effects screening.
+    Every trajectory starts at a random point of a grid with the given number of levels and moves one parameter at
+    a time, in random order, by delta = levels / (2 * (levels - 1)) of its range, up or down.
+    Arguments: Number of trajectories r
+               Dictionary of parameter name -> (low, high)
+    Optional arguments: levels, number of grid levels (even)
+                        log, sample uniformly in log space
+                        seed for the random number generator
+    Output: (list of r * (len(bounds) + 1) sweep points, unit-cube design of shape (r, len(bounds) + 1, len(bounds)))
+    """
+    rng = np.random.default_rng(seed)
+    names = list(bounds)
+    d = len(names)
+    delta = levels / (2.0 * (levels - 1))
+    design = np.empty((r, d + 1, d))
+    for t in range(r):
+        x = rng.integers(0, levels, d) / (levels - 1.0)
+        sign = np.where(x + delta <= 1.0, 1.0, -1.0)
+        design[t, 0] = x
+        for s, i in enumerate(rng.permutation(d)):
+            x = x.copy()
+            x[i] += sign[i] * delta
+            design[t, s + 1] = x
+    return _as_points(_scale(design.reshape(-1, d), bounds, log), names), design
+
+
+def _percentile_interval(samples, confidence):
+    tail = 50 * (1 - confidence)
+    return np.percentile(samples, tail, axis = 0), np.percentile(samples, 100 - tail, axis = 0)
+
+
+def sobol_indices(Y, d, n_bootstrap = 1000, confidence = 0.95, seed = None):
+    """
+    Function to compute first-order and total Sobol indices from the outputs of a sobol_points sample.
+    First-order indices use the estimator of Saltelli et al. 2010, total indices that of Jansen 1999. Confidence
+    intervals come from bootstrap resampling of the n base points.
+    Arguments: Array of the n * (d + 2) outputs, in the order of sobol_points
+               Number of parameters d
+    Optional arguments: n_bootstrap, number of bootstrap resamples
+                        confidence level of the intervals
+                        seed for the bootstrap
+    Output: Dictionary with "S1" and "ST" (arrays of d indices) and "S1_interval" and "ST_interval" ((low, high) arrays)
+    """
+    Y = np.asarray(Y, dtype = float).reshape(d + 2, -1)
+    n = Y.shape[1]
+
+    def estimate(rows):
+        A, B, AB = Y[0, rows], Y[1, rows], Y[2:, rows]
+        variance = np.var(np.concatenate([A, B]))
+        if variance == 0:
+            raise RuntimeError('The output does not vary over the sample, Sobol indices are undefined')
+        return np.mean(B * (AB - A), axis = 1) / variance, 0.5 * np.mean((A - AB) ** 2, axis = 1) / variance
+
+    S1, ST = estimate(np.arange(n))
+    rng = np.random.default_rng(seed)
+    samples = [estimate(rng.integers(0, n, n)) for b in range(n_bootstrap)]
+    return {"S1": S1, "ST": ST, "S1_interval": _percentile_interval(np.array([s[0] for s in samples]), confidence),
+            "ST_interval": _percentile_interval(np.array([s[1] for s in samples]), confidence)}
+
+
+def morris_indices(Y, design, n_bootstrap = 1000, confidence = 0.95, seed = None):
+    """
+    Function to compute Morris screening measures from the outputs of a morris_points sample.
+    Arguments: Array of the r * (d + 1) outputs, in the order of morris_points
+               Unit-cube design returned by morris_points
+    Optional arguments: n_bootstrap, number of bootstrap resamples of the trajectories
+                        confidence level of the interval of mu_star
+                        seed for the bootstrap
+    Output: Dictionary with "mu" (mean elementary effect), "mu_star" (mean absolute elementary effect), "sigma"
+            (standard deviation of the elementary effects) and "mu_star_interval" ((low, high) arrays), one value per parameter
+    """
+    r, steps, d = design.shape
+    Y = np.asarray(Y, dtype = float).reshape(r, steps)
+
+    # The one parameter that changes between successive points of a trajectory, and by how much
+
+    change = np.diff(design, axis = 1)
+    parameter = np.argmax(np.abs(change), axis = 2)
+    step = np.take_along_axis(change, parameter[:, :, np.newaxis], axis = 2)[:, :, 0]
+    effects = np.empty((r, d))
+    effects[np.arange(r)[:, np.newaxis], parameter] = np.diff(Y, axis = 1) / step
+
+    rng = np.random.default_rng(seed)
+    samples = [np.mean(np.abs(effects[rng.integers(0, r, r)]), axis = 0) for b in range(n_bootstrap)]
+    return {"mu": effects.mean(axis = 0), "mu_star": np.abs(effects).mean(axis = 0),
+            "sigma": effects.std(axis = 0, ddof = 1) if r > 1 else np.zeros(d),
+            "mu_star_interval": _percentile_interval(np.array(samples), confidence)}
+
+
+def _outputs(store, output, species):
+    # Scalar output of every run: final value of a species, reduced while the runs streamed, or output(time, columns)
+    # for a callable
+    if callable(output):
+        columns = store.load(species)
+        return np.asarray(output(columns["time"], columns), dtype = float)
+    return store.load(["final(" + output + ")"])["final(" + output + ")"]
+
+
+def _analysis(circuit, points, timepoints, output, store, species, ic, processes, parameter_file, simulate_keywords):
+    if isinstance(circuit, GeneletTemplate):
+        template = circuit
+    else:
+        template = GeneletTemplate(circuit, parameter_file = parameter_file, ic = ic)
+    if callable(output):
+        store = run_sweep(template, points, timepoints, store, species = species, ic = ic, processes = processes,
+                          **simulate_keywords)
+        return _outputs(store, output, species if species is not None else template.species)
+    store = run_sweep(template, points, timepoints, store, species = species or [], ic = ic, processes = processes,
+                      reductions = {"final(" + output + ")": ("final", output)}, **simulate_keywords)
+    return _outputs(store, output, species)
+
+
+def sobol_analysis(circuit, bounds, n, timepoints, output, store, log = True, seed = 0, n_bootstrap = 1000,
+                   confidence = 0.95, species = None, ic = None, processes = None, parameter_file = "default_parameters.txt",
+                   **simulate_keywords):
+    """
+    Function to run a variance-based (Sobol) global sensitivity analysis of a Genelet circuit.
+    The n * (d + 2) circuits of the sample (see sobol_points) are simulated over a process pool by run_sweep, which
+    checkpoints every chunk of runs in the store: calling sobol_analysis again with the same arguments after an
+    interruption only simulates the missing runs.
+    Arguments: GeneletTemplate, or list of Genelet/Source components
+               Dictionary of parameter name -> (low, high) (see parameter_bounds)
+               Number of base points n
+               Timepoints to simulate
+               output, name of the species whose final value is analysed, or function(time, columns) returning one value
+               per run from the dictionary of species name -> (runs x timepoints) array
+               SweepStore or directory to store the simulations in
+    Optional arguments: log, sample uniformly in log space
+                        seed for the Sobol scrambling and the bootstrap (fixed by default so a resumed run draws the same sample)
+                        n_bootstrap, confidence, see sobol_indices
+                        species, species to record for a callable output (defaults to all)
+                        ic, initial conditions; processes, number of worker processes; other keywords go to CRNModel.simulate
+    Output: Dictionary of sobol_indices, plus "names" (parameter names) and "Y" (output of every run)
+    """
+    points = sobol_points(n, bounds, log = log, seed = seed)
+    Y = _analysis(circuit, points, timepoints, output, store, species, ic, processes, parameter_file, simulate_keywords)
+    result = sobol_indices(Y, len(bounds), n_bootstrap = n_bootstrap, confidence = confidence, seed = seed)
+    result.update(names = list(bounds), Y = Y)
+    return result
+
+
+def morris_analysis(circuit, bounds, r, timepoints, output, store, levels = 4, log = True, seed = 0, n_bootstrap = 1000,
+                    confidence = 0.95, species = None, ic = None, processes = None, parameter_file = "default_parameters.txt",
+                    **simulate_keywords):
+    """
+    Function to run a Morris elementary effects screening of a Genelet circuit, as sobol_analysis with
+    the r * (d + 1) circuits of morris_points. Screening needs far fewer runs than Sobol indices, so it can pick the
+    parameters worth a Sobol analysis.
+    Arguments and optional arguments: as for sobol_analysis, with r trajectories of levels grid levels in place of n
+    Output: Dictionary of morris_indices, plus "names" (parameter names) and "Y" (output of every run)
+    """
+    points, design = morris_points(r, bounds, levels = levels, log = log, seed = seed)
+    Y = _analysis(circuit, points, timepoints, output, store, species, ic, processes, parameter_file, simulate_keywords)
+    result = morris_indices(Y, design, n_bootstrap = n_bootstrap, confidence = confidence, seed = seed)
+    result.update(names = list(bounds), Y = Y)
+    return result
@@ -0,0 +1,155 @@
+import itertools
+import json
+import os
+import numpy as np
+
+LOGIC_FUNCTIONS = {
+    "AND": all,
+    "OR": any,
+    "NAND": lambda bits: not all(bits),
+    "NOR": lambda bits: not any(bits),
+}
+
+
+def gate_inputs(name, on_1 = None, on_2 = None, off_1 = None, off_2 = None, activator = 700, inhibitor = 700):
+    """
+    Function to create the input levels of a GeneletGate, using the same default names as GeneletGate.
+    Logic 1 adds the activator strand of the input switch, logic 0 adds its inhibitor strand instead.
+    Arguments: Name of gate
+    Optional arguments: Activator and Inhibitor names for input genelet switches
+                        activator, inhibitor: concentrations added for logic 1 and logic 0 respectively
+    Output: Dictionary of input name -> {0: initial conditions, 1: initial conditions}
+    """
+    inputs = {}
+    for i, (on, off) in enumerate([(on_1, off_1), (on_2, off_2)]):
+        on = name + "_A" + str(i + 1) if on is None else on
+        off = name + "_I" + str(i + 1) if off is None else off
+        inputs[name + "_INP" + str(i + 1)] = {0: {"dna_" + on: 0, "rna_" + off: inhibitor},
+                                             1: {"dna_" + on: activator, "rna_" + off: 0}}
+    return inputs
+
+
+def gate_output(template, name):
+    """List of the species of a GeneletGate's output switch that are ON (free or RNAP bound)"""
+    return [s for s in template.species if name + "_OUT_ON" in s]
+
+
+def _settling_time(time, trace, tolerance):
+    # First time after which the trace stays within a band of tolerance x (trace range) around its final value
+    outside = np.nonzero(np.abs(trace - trace[-1]) > tolerance * (trace.max() - trace.min()))[0]
+    if len(outside) == 0:
+        return float(time[0])
+    if outside[-1] + 1 >= len(time):
+        return float("nan")
+    return float(time[outside[-1] + 1])
+
+
+def truth_table(template, inputs, output, timepoints, logic = None, ic = None, parameters = None, threshold = None,
+                tolerance = 0.05, cache_dir = ".genelet_cache", **simulate_keywords):
+    """
+    Function to evaluate the truth table and logic margins of a Genelet gate.
+    All input combinations are simulated together in one batched integration (CRNModel.simulate_ensemble).
+    Results are cached on disk keyed by a hash of the CRN, parameters, initial conditions and settings,
+    so evaluating an unchanged gate again only reads the cache.
+    Arguments: GeneletTemplate of the gate
+               Dictionary of input name -> {0: initial conditions, 1: initial conditions} (see gate_inputs)
+               Output species name, or list of species names that are summed (see gate_output)
+               Timepoints to simulate, the output level is the value at the last timepoint
+    Optional arguments: logic, expected function: "AND", "OR", "NAND", "NOR" or a function of the list of input bits
+                        ic, base initial conditions (defaults to the template's)
+                        parameters, Genelet parameter overrides
+                        threshold separating logic 0 and 1 outputs (defaults to the midpoint of the low and high levels)
+                        tolerance, band around the final value, as a fraction of the output's range, used for the settling time
+                        cache_dir, directory of the result cache (None disables caching)
+    Output: Dictionary with one row per input combination (input bits, expected bit, output level, settling time)
+            and, when logic is given, the low/high output levels, ON/OFF ratio, threshold, noise margins and whether
+            every row is on the correct side of the threshold
+    """
+    names = list(inputs)
+    outputs = [output] if isinstance(output, str) else list(output)
+    base_ic = dict((template.ic if ic is None else ic) or {})
+    timepoints = np.asarray(timepoints, dtype = float)
+    if isinstance(logic, str):
+        logic = LOGIC_FUNCTIONS[logic.upper()]
+
+    combinations = list(itertools.product([0, 1], repeat = len(names)))
+    ics = []
+    for bits in combinations:
+        combination_ic = dict(base_ic)
+        for name, bit in zip(names, bits):
+            combination_ic.update(inputs[name][bit])
+        ics.append(combination_ic)
+
+    key = None
+    if cache_dir is not None:
+        settings = [ics, outputs, timepoints.tolist(), tolerance, sorted(simulate_keywords.items())]
+        key = template.fingerprint(parameters, extra = settings)
+        cached = os.path.join(cache_dir, key + ".json")
+        if os.path.exists(cached):
+            with open(cached) as f:
+                rows = json.load(f)
+            return _logic_margins(names, rows, logic, threshold)
+
+    model = template.bind(parameters)
+    trajectories = model.simulate_ensemble(ics, timepoints, **simulate_keywords)
+    columns = [template.topology.species_index[s] for s in outputs]
+
+    rows = []
+    for bits, trajectory in zip(combinations, trajectories):
+        trace = trajectory[:, columns].sum(axis = 1)
+        rows.append({"inputs": list(bits), "output": float(trace[-1]),
+                     "settling_time": _settling_time(timepoints, trace, tolerance)})
+
+    if key is not None:
+        os.makedirs(cache_dir, exist_ok = True)
+        tmp = cached + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(rows, f)
+        os.replace(tmp, cached)
+
+    return _logic_margins(names, rows, logic, threshold)
+
+
+def _logic_margins(names, rows, logic, threshold):
+    result = {"inputs": names, "rows": rows}
+    if logic is None:
+        return result
+
+    for row in rows:
+        row["expected"] = int(bool(logic(row["inputs"])))
+    high = [row["output"] for row in rows if row["expected"] == 1]
+    low = [row["output"] for row in rows if row["expected"] == 0]
+    if not high or not low:
+        return result
+
+    high_level = min(high)
+    low_level = max(low)
+    if threshold is None:
+        threshold = (high_level + low_level) / 2
+
+    result["high_level"] = high_level
+    result["low_level"] = low_level
+    result["on_off_ratio"] = high_level / low_level if low_level > 0 else float("inf")
+    result["threshold"] = threshold
+    result["noise_margin_high"] = high_level - threshold
+    result["noise_margin_low"] = threshold - low_level
+    result["correct"] = high_level > threshold > low_level
+    result["settling_time"] = max(row["settling_time"] for row in rows)
+    return result
+
+
+def _evaluate_gate(job):
+    return truth_table(**job)
+
+
+def evaluate_gates(jobs, processes = None):
+    """
+    Function to evaluate the truth tables of a library of gates in parallel over a process pool.
+    Arguments: List of dictionaries of truth_table arguments, one per gate
+    Optional argument: processes, number of worker processes (defaults to all cores)
+    Output: List of truth_table results in the order of jobs
+    """
+    from multiprocessing import Pool
+
+    with Pool(processes) as pool:
+        return pool.map(_evaluate_gate, jobs)
@@ -0,0 +1,195 @@
+import numpy as np
+from contextlib import contextmanager
+
+# Genelet block of the parameter file, in the order of the genelet types of Parametric Analysis/Parameter Test.ipynb
+
+GENELET_TYPE_PARAMETERS = [("Genelet", name) for name in ["ktx", "kleak", "kdeg", "kM_tx", "kM_leak", "kM_deg", "ku_tx",
+                                                          "ku_leak", "ku_deg", "kon", "koff", "ka"]]
+
+# Named parameter sets: the two genelet types of Parameter Test.ipynb, and the RNase of the liposome experiments
+# (Sub-SBML liposomes/default_parameters.txt)
+
+PARAMETER_SETS = {
+    "type_21": dict(zip(GENELET_TYPE_PARAMETERS, [0.064, 0.007, 0.176, 259e-3, 1.05, 91e-3, 10, 10, 10, 3.94e-3, 6.96e-2, 6.96e-2])),
+    "type_12": dict(zip(GENELET_TYPE_PARAMETERS, [0.105, 0.023, 0.004, 316e-3, 1.27, 10e-3, 10, 10, 10, 1.20e-3, 1.52e-2, 1.52e-2])),
+    "liposome": {("RNase", "kcat"): 2.3},
+}
+
+# Named Genelet/Source parameters (as in GeneletTemplate.parameters) that have their own line in the parameter file
+
+PARAMETER_FILE_ENTRIES = {name: ("Genelet", name) for part, name in GENELET_TYPE_PARAMETERS}
+PARAMETER_FILE_ENTRIES.update({"kcat": ("RNase", "kcat"), "ktx_source": ("Source", "ktx")})
+
+
+class ParameterStore:
+    """
+    Parameter file loaded once into an indexed table, with named parameter sets and override layers.
+    Every line of the file is a row, found by the key BioCRNpyler gives it: (mechanism_id, part_id, param_name),
+    (part_id, param_name), (mechanism_id, param_name) or param_name, depending on which fields are filled in. Rows
+    with a mechanism_id and a part_id can also be found by (part_id, param_name) when that is unique, e.g.
+    ("Genelet", "kon") for the transcription_switch line.
+    The values seen by components are the values of the file with every layer applied in order (see push), so
+    switching genelet types or trying a variant needs no new parameter file. A store can be passed as the
+    parameter_file of GeneletTemplate (and of every function that takes one).
+    Arguments: parameter_file to load
+    Optional arguments: sets, dictionary of set name -> dictionary of key -> value, added to PARAMETER_SETS
+    """
+    def __init__(self, parameter_file = "default_parameters.txt", sets = None):
+
+        with open(parameter_file) as f:
+            self.lines = f.read().split("\n")
+        self.parameter_file = parameter_file
+        header = self.lines[0].split("\t")
+        for field in ["mechanism_id", "part_id", "param_name", "param_val"]:
+            if field not in header:
+                raise RuntimeError('Parameter file ' + parameter_file + ' has no ' + field + ' column')
+        column = {field: header.index(field) for field in header}
+        last = max(column[field] for field in ["mechanism_id", "part_id", "param_name", "param_val"])
+
+        self.keys = []
+        self.line_numbers = []
+        values = []
+        self.index = {}
+        short_keys = {}
+        for number, line in enumerate(self.lines[1:], start = 1):
+            fields = line.split("\t")
+            if len(fields) <= last or not fields[column["param_name"]].strip():
+                continue
+            mechanism, part_id, name = [fields[column[f]].strip() for f in ["mechanism_id", "part_id", "param_name"]]
+            key = tuple(f for f in (mechanism, part_id) if f) + (name,)
+            key = key[0] if len(key) == 1 else key
+
+            # Later lines override earlier ones with the same key, as in BioCRNpyler
+
+            if key in self.index:
+                row = self.index[key]
+                self.line_numbers[row] = number
+                values[row] = float(fields[column["param_val"]])
+                continue
+            self.index[key] = len(self.keys)
+            if mechanism and part_id:
+                short_keys.setdefault((part_id, name), []).append(len(self.keys))
+            self.keys.append(key)
+            self.line_numbers.append(number)
+            values.append(float(fields[column["param_val"]]))
+        for key, rows in short_keys.items():
+            if len(rows) == 1 and key not in self.index:
+                self.index[key] = rows[0]
+
+        self._column = column["param_val"]
+        self.base = np.array(values, dtype = float)
+        self.sets = dict(PARAMETER_SETS)
+        self.sets.update(sets or {})
+        self.layers = []
+        self._values = None
+
+    def rows(self, keys):
+        """
+        Row numbers of a list of keys, for vectorized updates.
+        Arguments: List of keys, each a tuple or param_name as described above
+        Output: Integer array of row numbers
+        """
+        unknown = [key for key in keys if key not in self.index]
+        if unknown:
+            raise RuntimeError('Unknown parameters: ' + ", ".join(str(key) for key in unknown))
+        return np.array([self.index[key] for key in keys], dtype = int)
+
+    def _layer(self, overlay, label):
+        if isinstance(overlay, str):
+            if overlay not in self.sets:
+                raise RuntimeError('Unknown parameter set ' + overlay + ', known sets are ' + ", ".join(self.sets))
+            overlay, label = self.sets[overlay], overlay
+        keys = list(overlay)
+        return label, self.rows(keys), np.array([overlay[key] for key in keys], dtype = float)
+
+    @property
+    def values(self):
+        """Array of the current value of every row, the file values with every layer applied"""
+        if self._values is None:
+            values = self.base.copy()
+            for label, rows, layer in self.layers:
+                values[rows] = layer
+            self._values = values
+        return self._values
+
+    def get(self, key):
+        """Current value of one parameter"""
+        return float(self.values[self.rows([key])[0]])
+
+    def update(self, keys, values = None):
+        """
+        Function to change values of the base table in place, below every layer.
+        Arguments: Dictionary of key -> value, or a list of keys (or row numbers from rows())
+        Optional argument: array of values when keys is a list
+        """
+        if isinstance(keys, dict):
+            keys, values = list(keys), list(keys.values())
+        rows = np.asarray(keys) if len(keys) and isinstance(keys[0], (int, np.integer)) else self.rows(keys)
+        self.base[rows] = values
+        self._values = None
+
+    def push(self, overlay, label = None):
+        """
+        Function to apply an override layer on top of the current values.
+        Arguments: Name of a parameter set, or dictionary of key -> value
+        Optional argument: label of a dictionary layer
+        Output: The store, so calls can be chained
+        """
+        self.layers.append(self._layer(overlay, label))
+        self._values = None
+        return self
+
+    def pop(self):
+        """Function to remove the top layer, returns its label"""
+        if not self.layers:
+            raise RuntimeError('The parameter store has no layers to remove')
+        label = self.layers.pop()[0]
+        self._values = None
+        return label
+
+    @contextmanager
+    def overlay(self, *overlays):
+        """
+        Context manager applying parameter sets or dictionaries for the duration of a with block, e.g.
+        with store.overlay("type_12", {("Genelet", "kon"): 1e-3}): template = GeneletTemplate(circuit, parameter_file = store)
+        """
+        depth = len(self.layers)
+        try:
+            for overlay in overlays:
+                self.push(overlay)
+            yield self
+        finally:
+            del self.layers[depth:]
+            self._values = None
+
+    def parameter_dictionary(self):
+        """Dictionary of key -> current value, in the form BioCRNpyler builds from a parameter file"""
+        return dict(zip(self.keys, self.values.tolist()))
+
+    def genelet_parameters(self, names = None):
+        """
+        Current values under their GeneletTemplate.parameters names, to rebind a compiled template without recompiling.
+        Optional argument: names, list of parameter names (defaults to every name in PARAMETER_FILE_ENTRIES)
+        Output: Dictionary of parameter name -> value
+        """
+        names = list(PARAMETER_FILE_ENTRIES) if names is None else names
+        unknown = [name for name in names if name not in PARAMETER_FILE_ENTRIES]
+        if unknown:
+            raise RuntimeError('Parameters without a line of their own in the parameter file: ' + ", ".join(unknown))
+        values = self.values[self.rows([PARAMETER_FILE_ENTRIES[name] for name in names])]
+        return dict(zip(names, values.tolist()))
+
+    def write(self, filename):
+        """
+        Function to write the current values in the parameter file format. Every line of the loaded file is copied,
+        lines whose value changed get the new value.
+        Arguments: Name of the file to write
+        """
+        lines = list(self.lines)
+        file_values = np.array([float(self.lines[n].split("\t")[self._column]) for n in self.line_numbers])
+        for row in np.nonzero(self.values != file_values)[0]:
+            fields = lines[self.line_numbers[row]].split("\t")
+            fields[self._column] = "%.6g" % self.values[row]
+            lines[self.line_numbers[row]] = "\t".join(fields)
+        with open(filename, "w") as f:
+            f.write("\n".join(lines))
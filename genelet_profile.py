@@ -0,0 +1,204 @@
+import functools
+import json
+import time
+from contextlib import contextmanager, nullcontext
+
+
+class _Profiler:
+    # The record being filled, None while profiling is off: instrumented code tests this one attribute and returns
+    record = None
+
+profiler = _Profiler()
+
+_NULL = nullcontext()
+
+
+@contextmanager
+def profile(label = None, sink = None, **metadata):
+    """
+    Context manager collecting one profiling record of the Genelet pipeline run inside it.
+    The record holds the inclusive time and number of calls of every instrumented stage (Genelet and Source
+    update_species, labelled_reactions and get_parameter, GeneletTemplate, Mixture.compile_crn, SBML export,
+    simulations) and counters: species and reactions built, parameter lookups and misses (parameters found only under a
+    less specific key than (mechanism, part_id, param_name), as BioCRNpyler warns), RHS and Jacobian evaluations, LU
+    decompositions, accepted and rejected solver steps. Profiles can be nested, each collects its own record.
+    Outside a profile the instrumentation costs one attribute test per instrumented call.
+    Optional arguments: label of the record
+                        sink, function called with the finished record, or name of a JSON lines file to append it to
+                        Other keywords are stored as the metadata of the record (e.g. the parameters of a sweep run)
+    Output: The record, a dictionary with "label", "metadata", "start" (Unix time), "wall_time", "timers" (stage ->
+            seconds), "calls" (stage -> number of calls) and "counters"
+    """
+    _install()
+    record = {"label": label, "metadata": metadata, "start": time.time(), "wall_time": 0.0, "timers": {}, "calls": {},
+              "counters": {}}
+    outer = profiler.record
+    profiler.record = record
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record["wall_time"] = time.perf_counter() - start
+        profiler.record = outer
+        if isinstance(sink, str):
+            write_record(record, sink)
+        elif sink is not None:
+            sink(record)
+
+
+def write_record(record, filename):
+    """Function to append a profiling record to a JSON lines file"""
+    with open(filename, "a") as f:
+        f.write(json.dumps(record, default = float) + "\n")
+
+
+def read_records(filename):
+    """Function to read the profiling records of a JSON lines file, as a list of dictionaries"""
+    with open(filename) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def count(name, n = 1):
+    """Function to add n to a counter of the current record, if profiling"""
+    record = profiler.record
+    if record is not None:
+        record["counters"][name] = record["counters"].get(name, 0) + n
+
+
+class _Stage:
+
+    def __init__(self, record, name):
+        self.record, self.name = record, name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exception):
+        timers, calls = self.record["timers"], self.record["calls"]
+        timers[self.name] = timers.get(self.name, 0.0) + time.perf_counter() - self.start
+        calls[self.name] = calls.get(self.name, 0) + 1
+
+
+def stage(name):
+    """Context manager timing a stage of the current record, if profiling (a shared no-op context otherwise)"""
+    record = profiler.record
+    return _NULL if record is None else _Stage(record, name)
+
+
+def profiled(name, output = None):
+    """
+    Decorator timing every call of a function as a stage of the current record.
+    Arguments: Name of the stage
+    Optional argument: output, name of a counter the length of the returned list is added to
+    """
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*arguments, **keywords):
+            record = profiler.record
+            if record is None:
+                return function(*arguments, **keywords)
+            with _Stage(record, name):
+                result = function(*arguments, **keywords)
+            if output is not None:
+                count(output, len(result))
+            return result
+        wrapper.profiled = True
+        return wrapper
+    return decorate
+
+
+def parameter_lookup(get_parameter, component, param_name, part_id = None, mechanism = None):
+    """
+    Function to look up a component parameter through BioCRNpyler, counting lookups and misses when profiling.
+    A miss is a parameter not found under its most specific key, so BioCRNpyler fell back to a more general one
+    (or found none, which also counts as a failure).
+    """
+    record = profiler.record
+    if record is None:
+        return get_parameter(component, param_name, part_id = part_id, mechanism = mechanism)
+    with _Stage(record, "get_parameter"):
+        count("parameter_lookups")
+        parameters = component.parameters
+        if part_id is not None and mechanism is not None:
+            exact = (mechanism.name, part_id, param_name) in parameters or \
+                    (mechanism.mechanism_type, part_id, param_name) in parameters
+        elif part_id is not None:
+            exact = (part_id, param_name) in parameters
+        elif mechanism is not None:
+            exact = (mechanism.name, param_name) in parameters or (mechanism.mechanism_type, param_name) in parameters
+        else:
+            exact = param_name in parameters
+        if not exact:
+            count("parameter_misses")
+        try:
+            return get_parameter(component, param_name, part_id = part_id, mechanism = mechanism)
+        except ValueError:
+            count("parameter_failures")
+            raise
+
+
+# Solver statistics
+
+_solvers = {}
+
+def _counting_solver(method):
+    # Subclass of a scipy multistep solver counting accepted steps and rejected attempts: every attempt of BDF and
+    # LSODA evaluates the RHS at one new time, so each extra evaluation time within a step is a rejected attempt
+    if method not in _solvers:
+        import scipy.integrate
+
+        base = getattr(scipy.integrate, method)
+
+        class CountingSolver(base):
+
+            def __init__(self, fun, t0, y0, t_bound, **options):
+                self._times = set()
+
+                def counted(t, y):
+                    self._times.add(t)
+                    return fun(t, y)
+
+                base.__init__(self, counted, t0, y0, t_bound, **options)
+
+            def _step_impl(self):
+                t_old = self.t
+                self._times = set()
+                success, message = base._step_impl(self)
+                if success:
+                    count("accepted_steps")
+                    count("rejected_steps", max(len(self._times - {t_old}) - 1, 0))
+                return success, message
+
+        CountingSolver.__name__ = "Counting" + method
+        _solvers[method] = CountingSolver
+    return _solvers[method]
+
+
+def solver_method(method):
+    """
+    solve_ivp method to integrate with: the method itself, or while profiling BDF and LSODA a subclass that counts
+    accepted and rejected steps (other methods are not counted)
+    """
+    if profiler.record is None or method not in ("BDF", "LSODA"):
+        return method
+    return _counting_solver(method)
+
+
+def record_solution(sol):
+    """Function to add the evaluation counts of a solve_ivp solution (or of an OdeSolver) to the current record, if profiling"""
+    if profiler.record is not None:
+        count("simulations")
+        count("rhs_evaluations", int(sol.nfev))
+        count("jacobian_evaluations", int(sol.njev))
+        count("lu_decompositions", int(sol.nlu))
+
+
+# Stages of BioCRNpyler itself are instrumented the first time a profile starts
+
+def _install():
+    from biocrnpyler import ChemicalReactionNetwork, Mixture
+
+    if not getattr(Mixture.compile_crn, "profiled", False):
+        Mixture.compile_crn = profiled("compile_crn")(Mixture.compile_crn)
+    if not getattr(ChemicalReactionNetwork.write_sbml_file, "profiled", False):
+        ChemicalReactionNetwork.write_sbml_file = profiled("write_sbml_file")(ChemicalReactionNetwork.write_sbml_file)
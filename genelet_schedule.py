@@ -0,0 +1,252 @@
+import numpy as np
+from genelet_profile import record_solution, solver_method, stage
+
+# Kinds of schedule events and what they do to the state
+
+EVENT_KINDS = ["add", "remove", "set", "dilute", "hold", "release"]
+
+
+class InputSchedule:
+    """
+    Timed inputs of a Genelet circuit experiment: additions or removals of activator and inhibitor strands (or of any
+    species), concentrations set to a value, dilution steps, and species held at a value over an interval. Replaces the
+    Heaviside assignment rules of Logic Gate Testing.ipynb, e.g. InputSchedule().hold(600, "rna_I1", 500) holds
+    inhibitor I1 at 500 nM from t = 10 min on, and InputSchedule().add(600, "rna_I1", 500) adds a single bolus of it.
+    Events are (time, kind, species, value) tuples; events at the same time are applied in the order they were added.
+    Every method returns the schedule so calls can be chained, and copy() forks a schedule to extend it.
+    Optional argument: events, list of event tuples
+    """
+    def __init__(self, events = None):
+
+        self.events = []
+        for event in events or []:
+            self._event(*event)
+
+    def _event(self, time, kind, species, value):
+        if kind not in EVENT_KINDS:
+            raise RuntimeError('Unknown schedule event ' + str(kind) + ', known events are ' + ", ".join(EVENT_KINDS))
+        # Keep events sorted by time, after the events already scheduled at the same time
+        event = (float(time), kind, species, None if value is None else float(value))
+        position = len([e for e in self.events if e[0] <= event[0]])
+        self.events.insert(position, event)
+        return self
+
+    def add(self, time, species, amount):
+        """Function to add an amount of a species at a time"""
+        return self._event(time, "add", species, amount)
+
+    def remove(self, time, species, amount = None):
+        """Function to remove an amount of a species at a time (all of it by default), never going below 0"""
+        return self._event(time, "remove", species, amount)
+
+    def set(self, time, species, value):
+        """Function to set the concentration of a species at a time"""
+        return self._event(time, "set", species, value)
+
+    def dilute(self, time, factor):
+        """Function to dilute every species by a factor at a time (e.g. 2 for a 1:1 dilution)"""
+        if factor <= 0:
+            raise RuntimeError('Dilution factors must be positive')
+        return self._event(time, "dilute", None, factor)
+
+    def hold(self, time, species, value, end = None):
+        """
+        Function to hold a species at a value from a time, as an assignment rule would: the species is set to the value
+        and its derivative is zeroed, so it stays at the value whatever consumes or produces it (other events on it are
+        overridden, dilutions included).
+        Optional argument: end, time the species is released (see release), defaults to the end of the experiment
+        """
+        self._event(time, "hold", species, value)
+        if end is not None:
+            if end <= time:
+                raise RuntimeError('A hold must end after it starts')
+            self.release(end, species)
+        return self
+
+    def release(self, time, species):
+        """Function to release a held species at a time, after which it evolves freely from the held value"""
+        return self._event(time, "release", species, None)
+
+    def copy(self):
+        """Copy of the schedule, to extend without changing this one"""
+        return InputSchedule(self.events)
+
+
+def apply_events(x, events, species_index):
+    """
+    Function to apply schedule events to a state.
+    Arguments: State vector, list of event tuples, dictionary of species name -> index in the state
+    Output: New state vector
+    """
+    x = np.array(x, dtype = float)
+    for time, kind, species, value in events:
+        if kind == "dilute":
+            x /= value
+            continue
+        if species not in species_index:
+            raise RuntimeError('Schedule event at t = ' + str(time) + ' on a species not in the CRN: ' + str(species))
+        i = species_index[species]
+        if kind == "release":
+            continue
+        if kind == "add":
+            x[i] += value
+        elif kind == "remove":
+            x[i] = 0.0 if value is None else max(x[i] - value, 0.0)
+        else:
+            x[i] = value
+    return x
+
+
+def held_species(events, species_index):
+    """
+    Function to find the species held after schedule events.
+    Arguments: List of event tuples, dictionary of species name -> index in the state
+    Output: Dictionary of index in the state -> held value
+    """
+    held = {}
+    for time, kind, species, value in events:
+        if kind == "hold":
+            held[species_index[species]] = value
+        elif kind == "release":
+            held.pop(species_index[species], None)
+    return held
+
+
+class ScheduleSimulator:
+    """
+    Simulates a CRNModel under input schedules. The solver stops at every event time and restarts from the
+    updated state, so it never steps across the discontinuity of an input.
+    Schedules that share their first events also share the simulation up to the next event. For every prefix of
+    events (the events applied so far) the simulator caches the trajectory since the last event, with the state at
+    every timepoint and event time it reached as a checkpoint. A schedule whose events before t match a cached prefix
+    starts from the latest checkpoint at or before t, so a fork only integrates from the timepoint before it.
+    While species are held, the RHS and the rows of the Jacobian of the held species are zeroed.
+    Arguments: CRNModel (e.g. GeneletTemplate.bind()), timepoints
+    Optional arguments: method, rtol, atol, sparse and other keywords as for CRNModel.simulate
+    """
+    def __init__(self, model, timepoints, method = None, rtol = 1e-6, atol = 1e-9, sparse = None, **keywords):
+
+        self.model = model
+        self.timepoints = np.asarray(timepoints, dtype = float)
+        self.keywords = dict(keywords, rtol = rtol, atol = atol)
+        self.method = model.solver_options(method, sparse, self.keywords)
+        self.checkpoints = {}
+
+    def _integrate(self, t0, t1, x0, t_eval, held):
+        from scipy.integrate import solve_ivp
+        from scipy.sparse import diags, issparse
+
+        rhs, keywords = self.model.rhs, self.keywords
+        if held:
+            # Held species neither change nor change anything through their own derivative
+            rows = list(held)
+            free = np.ones(len(x0))
+            free[rows] = 0.0
+            model_rhs, model_jac = rhs, keywords.get("jac")
+
+            def rhs(t, x):
+                dx = model_rhs(t, x)
+                dx[rows] = 0.0
+                return dx
+
+            keywords = dict(keywords)
+            if callable(model_jac):
+                def jac(t, x):
+                    J = model_jac(t, x)
+                    return diags(free) @ J if issparse(J) else J * free[:, np.newaxis]
+                keywords["jac"] = jac
+
+        with stage("simulate"):
+            sol = solve_ivp(rhs, (t0, t1), x0, method = solver_method(self.method), t_eval = t_eval, **keywords)
+        record_solution(sol)
+        if not sol.success:
+            raise RuntimeError('Simulation failed: ' + sol.message)
+        return sol
+
+    def _advance(self, prefix, start, x, end):
+        # State at end and trajectory rows over [start, end) of the segment that follows prefix
+        held = held_species(prefix, self.model.topology.species_index)
+        entry = self.checkpoints.get(prefix)
+        if entry is None:
+            entry = {"states": {start: x}, "reached": start, "indices": [], "rows": []}
+            self.checkpoints[prefix] = entry
+
+        if end > entry["reached"]:
+            t0 = entry["reached"]
+            tp = self.timepoints
+            indices = np.nonzero((tp >= t0) & (tp < end))[0]
+            sol = self._integrate(t0, end, entry["states"][t0], np.append(tp[indices], end), held)
+            rows = sol.y[:, :len(indices)].T
+            entry["indices"].append(indices)
+            entry["rows"].append(rows)
+            # Every timepoint passed is a checkpoint, so a later fork within the segment restarts from the timepoint
+            # before it instead of from the last event
+            entry["states"].update(zip(tp[indices], rows))
+            entry["states"][end] = sol.y[:, -1]
+            entry["reached"] = end
+        elif end not in entry["states"]:
+            t0 = max(t for t in entry["states"] if t <= end)
+            entry["states"][end] = self._integrate(t0, end, entry["states"][t0], [end], held).y[:, -1]
+
+        indices = np.concatenate(entry["indices"] + [np.zeros(0, dtype = int)])
+        rows = np.concatenate(entry["rows"] + [np.zeros((0, len(x)))])
+        keep = self.timepoints[indices] < end
+        return entry["states"][end], indices[keep], rows[keep]
+
+    def state(self, schedule, time):
+        """State vector at a time, after the events of the schedule up to and including that time"""
+        return self._run(schedule, time)[0]
+
+    def _run(self, schedule, end):
+        topology = self.model.topology
+        t_start = self.timepoints[0]
+        if schedule.events and schedule.events[0][0] < t_start:
+            raise RuntimeError('Schedule events before the first timepoint ' + str(t_start))
+        events = [e for e in schedule.events if e[0] <= end]
+        boundaries = sorted(set([e[0] for e in events] + [end]))
+
+        prefix = ()
+        start, x = t_start, self.model.x0
+        indices, rows = [], []
+        for boundary in boundaries:
+            x, segment_indices, segment_rows = self._advance(prefix, start, x, boundary)
+            indices.append(segment_indices)
+            rows.append(segment_rows)
+            now = [e for e in events if e[0] == boundary]
+            x = apply_events(x, now, topology.species_index)
+            prefix = prefix + tuple(now)
+            held = held_species(prefix, topology.species_index)
+            x[list(held)] = list(held.values())
+            start = boundary
+        return x, indices, rows
+
+    def simulate(self, schedule):
+        """
+        Function to simulate the model under a schedule. Timepoints at an event time report the state after the event.
+        Arguments: InputSchedule (events after the last timepoint are ignored)
+        Output: Pandas DataFrame with one column per species and a "time" column, like CRNModel.simulate
+        """
+        import pandas as pd
+
+        end = self.timepoints[-1]
+        x, indices, rows = self._run(schedule, end)
+        Y = np.empty((len(self.timepoints), self.model.topology.n_species))
+        for segment_indices, segment_rows in zip(indices, rows):
+            Y[segment_indices] = segment_rows
+        Y[self.timepoints == end] = x
+
+        R = pd.DataFrame(Y, columns = self.model.species)
+        R["time"] = self.timepoints
+        return R
+
+
+def simulate_schedules(model, schedules, timepoints, **keywords):
+    """
+    Function to simulate a CRNModel under many input schedules, sharing the simulation of their common prefixes
+    (see ScheduleSimulator).
+    Arguments: CRNModel, list of InputSchedules, timepoints
+    Optional arguments: method, rtol, atol, sparse and other keywords as for CRNModel.simulate
+    Output: List of Pandas DataFrames, one per schedule
+    """
+    simulator = ScheduleSimulator(model, timepoints, **keywords)
+    return [simulator.simulate(schedule) for schedule in schedules]
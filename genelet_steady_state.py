@@ -0,0 +1,121 @@
+import numpy as np
+
+
+def _positive_update(x, dx, fraction = 0.99):
+    # Step along dx, shortened so no positive concentration crosses zero; species already at zero are clipped
+    shrinking = (dx < 0) & (x > 0)
+    step = 1.0
+    if np.any(shrinking):
+        step = min(1.0, fraction * np.min(x[shrinking] / -dx[shrinking]))
+    return np.maximum(x + step * dx, 0.0)
+
+
+def _reduced_system(topology):
+    # Species consumed by some reaction (the only ones with a fixed point) and the conservation laws among them,
+    # each replacing the equation of its pivot species: (active, position of every species in active or -1, L, pivots)
+    consumed = np.zeros(topology.n_species + 1, dtype = bool)
+    consumed[topology.reactant_1] = True
+    consumed[topology.reactant_2] = True
+    active = np.nonzero(consumed[:-1])[0]
+    position = -np.ones(topology.n_species, dtype = int)
+    position[active] = np.arange(len(active))
+
+    L, pivots = topology.conservation_laws()
+    keep = [i for i in range(len(pivots)) if position[pivots[i]] >= 0 and not np.any(np.delete(L[i], active))]
+    return active, position, L[keep][:, active], position[pivots[keep]]
+
+
+def steady_state(model, x0 = None, tol = 1e-8, max_iter = 50, ptc_iter = 500, dt0 = 1e-2):
+    """
+    Function to find a fixed point of a CRNModel without integrating the full trajectory.
+    Newton's method uses the analytic Jacobian with one equation per conservation law (switch totals, activators,
+    RNAP, RNAseH, RNAse; see CRNTopology.conservation_laws) in place of a dependent species, so the fixed point
+    found has the same totals as the initial state. If Newton does not converge, pseudo-transient continuation
+    (implicit Euler steps with a growing time step) brings the state into Newton's basin and Newton finishes.
+    Species that are never consumed (e.g. the transcript of the last switch of a gate) have no fixed point and
+    do not act back on the rest of the circuit, so they keep their initial value and their final production
+    rate is reported instead.
+    Arguments: CRNModel (e.g. from GeneletTemplate.bind)
+    Optional arguments: x0, initial state that sets the conserved totals (defaults to model.x0)
+                        tol, convergence tolerance on the residual, relative to the largest concentration
+                        max_iter, maximum number of Newton iterations
+                        ptc_iter, maximum number of pseudo-transient continuation steps
+                        dt0, initial pseudo time step
+    Output: (steady state array in the order of model.species, dictionary of solver information)
+    """
+    topology = model.topology
+    x = np.array(model.x0 if x0 is None else x0, dtype = float)
+    scale = max(1.0, np.max(np.abs(x)))
+    active, position, L, pivots = _reduced_system(topology)
+    start = x[active].copy()
+    totals = L @ start
+
+    def residual(xa):
+        x[active] = xa
+        return model.rhs(0, x)[active]
+
+    def jacobian(xa):
+        x[active] = xa
+        return model.jacobian(0, x)[np.ix_(active, active)]
+
+    def newton(xa):
+        for iteration in range(max_iter):
+            F = residual(xa)
+            F[pivots] = L @ xa - totals
+            if np.max(np.abs(F)) < tol * scale:
+                return xa, True, iteration
+            J = jacobian(xa)
+            J[pivots] = L
+            try:
+                dx = np.linalg.solve(J, -F)
+            except np.linalg.LinAlgError:
+                return xa, False, iteration
+            xa = _positive_update(xa, dx)
+        F = residual(xa)
+        F[pivots] = L @ xa - totals
+        return xa, np.max(np.abs(F)) < tol * scale, max_iter
+
+    xa, converged, newton_iterations = newton(start.copy())
+    method = "newton"
+    steps = 0
+
+    if not converged:
+
+        # Pseudo-transient continuation: (I / dt - J) dx = f, dt grown by switched evolution relaxation (at most 10x per step).
+        # Implicit Euler steps preserve the conservation laws, so no law rows are needed here.
+
+        method = "ptc"
+        xa = start.copy()
+        identity = np.eye(len(active))
+        dt = dt0
+        f = residual(xa)
+        norm = np.linalg.norm(f)
+        for steps in range(1, ptc_iter + 1):
+            dx = np.linalg.solve(identity / dt - jacobian(xa), f)
+
+            # A step that drives a concentration clearly negative is rejected and retried with a smaller dt,
+            # round-off below zero is clipped
+
+            x_new = xa + dx
+            if np.any(x_new < -1e-6 * scale):
+                dt = dt / 4
+                continue
+            xa = np.maximum(x_new, 0.0)
+            f = residual(xa)
+            new_norm = np.linalg.norm(f)
+            dt = min(dt * min(norm / max(new_norm, 1e-300), 10.0), 1e12)
+            norm = new_norm
+
+            if np.max(np.abs(f)) < np.sqrt(tol) * scale:
+                x_newton, converged, iterations = newton(xa)
+                newton_iterations += iterations
+                if converged:
+                    xa = x_newton
+                    break
+
+    x[active] = xa
+    rates = model.rhs(0, x)
+    accumulating = {topology.species[i]: float(rates[i]) for i in range(topology.n_species) if position[i] < 0}
+    info = {"converged": bool(converged), "method": method, "newton_iterations": newton_iterations,
+            "ptc_steps": steps, "accumulation_rates": accumulating}
+    return x, info
@@ -0,0 +1,428 @@
+import numpy as np
+from scipy.sparse import csr_matrix
+
+STOCHASTIC_METHODS = ["ssa", "tau"]
+
+# Trajectories per task of simulate_batch: fixed, so the order statistics are merged in does not depend on the machine
+
+BATCH_CHUNK_SIZE = 64
+
+
+class TrajectoryStatistics:
+    """
+    Streaming summary of stochastic trajectories: mean, variance, minimum, maximum and quantiles of every species at
+    every timepoint, updated one batch of trajectories at a time so the trajectories themselves are never stored.
+    Quantiles come from a histogram of the molecule counts of each species and timepoint. Bins start one molecule wide
+    and are merged in pairs whenever a count falls outside the histogram, so quantiles are exact (linear interpolation
+    between order statistics, as numpy.quantile) while a species stays below bins molecules and accurate to the bin
+    width above that. Statistics from different processes are combined
+    with merge.
+    Arguments: timepoints, list of species names
+    Optional arguments: bins, number of histogram bins per species and timepoint (even)
+                        scale, factor converting molecule counts to the reported units (1 / volume gives concentrations)
+    """
+    def __init__(self, timepoints, species, bins = 256, scale = 1.0):
+
+        if bins < 2 or bins % 2:
+            raise RuntimeError('Number of histogram bins must be even')
+        self.timepoints = np.asarray(timepoints, dtype = float)
+        self.species = list(species)
+        self.bins = int(bins)
+        self.scale = float(scale)
+        self.n_trajectories = 0
+        shape = (len(self.timepoints), len(self.species))
+        self._mean = np.zeros(shape)
+        self._m2 = np.zeros(shape)
+        self._minimum = np.full(shape, np.inf)
+        self._maximum = np.full(shape, -np.inf)
+        self.width = np.ones(len(self.species), dtype = np.int64)
+        self.histogram = np.zeros(shape + (self.bins,), dtype = np.int64)
+
+    def _coarsen(self, widths):
+        # Merge bin pairs of each species until its bins are widths wide
+        for s in np.nonzero(widths > self.width)[0]:
+            while self.width[s] < widths[s]:
+                h = self.histogram[:, s]
+                h[:, :self.bins // 2] = h[:, 0::2] + h[:, 1::2]
+                h[:, self.bins // 2:] = 0
+                self.width[s] *= 2
+
+    def _merge_moments(self, n, mean, m2):
+        # Chan et al. pairwise update of the mean and sum of squared deviations
+        total = self.n_trajectories + n
+        delta = mean - self._mean
+        self._mean += delta * n / total
+        self._m2 += m2 + delta ** 2 * self.n_trajectories * n / total
+        self.n_trajectories = total
+
+    def add(self, counts):
+        """Add trajectories of molecule counts, an array of shape (len(timepoints), len(species)) or (N, len(timepoints), len(species))"""
+        counts = np.asarray(counts).reshape((-1,) + self._mean.shape)
+        if len(counts) == 0:
+            return
+        if np.any(counts < 0):
+            raise RuntimeError('Molecule counts must not be negative')
+        counts = np.rint(counts).astype(np.int64)
+
+        mean = counts.mean(axis = 0)
+        self._merge_moments(len(counts), mean, ((counts - mean) ** 2).sum(axis = 0))
+        self._minimum = np.minimum(self._minimum, counts.min(axis = 0))
+        self._maximum = np.maximum(self._maximum, counts.max(axis = 0))
+
+        widths = self.width.copy()
+        largest = counts.max(axis = (0, 1))
+        while np.any(largest // widths >= self.bins):
+            widths[largest // widths >= self.bins] *= 2
+        self._coarsen(widths)
+
+        T, n = self._mean.shape
+        cells = (np.arange(T)[:, np.newaxis] * n + np.arange(n)) * self.bins
+        flat = (cells + counts // self.width).ravel()
+        self.histogram += np.bincount(flat, minlength = T * n * self.bins).reshape(self.histogram.shape)
+
+    def merge(self, other):
+        """Add the trajectories summarised by another TrajectoryStatistics of the same timepoints and species"""
+        if other.species != self.species or other.bins != self.bins or not np.array_equal(other.timepoints, self.timepoints):
+            raise RuntimeError('Can only merge statistics of the same timepoints, species and bins')
+        if other.n_trajectories == 0:
+            return self
+        widths = np.maximum(self.width, other.width)
+        self._coarsen(widths)
+        histogram = other.histogram.copy()
+        for s in np.nonzero(widths > other.width)[0]:
+            width = other.width[s]
+            while width < widths[s]:
+                h = histogram[:, s]
+                h[:, :self.bins // 2] = h[:, 0::2] + h[:, 1::2]
+                h[:, self.bins // 2:] = 0
+                width *= 2
+        self.histogram += histogram
+        self._merge_moments(other.n_trajectories, other._mean, other._m2)
+        self._minimum = np.minimum(self._minimum, other._minimum)
+        self._maximum = np.maximum(self._maximum, other._maximum)
+        return self
+
+    @property
+    def mean(self):
+        """Mean of every species at every timepoint, array of shape (len(timepoints), len(species))"""
+        return self._mean * self.scale
+
+    @property
+    def variance(self):
+        """Sample variance of every species at every timepoint"""
+        return self._m2 / max(self.n_trajectories - 1, 1) * self.scale ** 2
+
+    @property
+    def std(self):
+        return np.sqrt(self.variance)
+
+    @property
+    def minimum(self):
+        return self._minimum * self.scale
+
+    @property
+    def maximum(self):
+        return self._maximum * self.scale
+
+    def quantiles(self, q):
+        """
+        Quantiles of every species at every timepoint.
+        Arguments: q, quantile or list of quantiles between 0 and 1
+        Output: Array of shape (len(q), len(timepoints), len(species)), or (len(timepoints), len(species)) for a single q
+        """
+        if self.n_trajectories == 0:
+            raise RuntimeError('No trajectories have been added')
+        single = np.ndim(q) == 0
+        q = np.atleast_1d(np.asarray(q, dtype = float))
+        cumulative = np.cumsum(self.histogram, axis = -1)
+
+        def ranked(rank):
+            # Value of the rank-th smallest count, spread evenly over the width of its bin
+            b = np.argmax(cumulative >= rank, axis = -1)[..., np.newaxis]
+            inside = np.take_along_axis(self.histogram, b, axis = -1)[..., 0]
+            below = np.take_along_axis(cumulative, b, axis = -1)[..., 0] - inside
+            fraction = (rank - below - 1) / np.maximum(inside - 1, 1)
+            return b[..., 0] * self.width + fraction * (self.width - 1)
+
+        out = np.empty((len(q),) + self._mean.shape)
+        for i, level in enumerate(q):
+            position = np.clip(level, 0, 1) * (self.n_trajectories - 1) + 1
+            lower = ranked(np.floor(position))
+            out[i] = lower + (position - np.floor(position)) * (ranked(np.ceil(position)) - lower)
+            out[i] = np.clip(out[i], self._minimum, self._maximum)
+        out *= self.scale
+        return out[0] if single else out
+
+    def to_frame(self, q = (0.05, 0.5, 0.95)):
+        """Pandas DataFrame with a row per timepoint and species: time, species, mean, std and the quantiles q"""
+        import pandas as pd
+
+        T, n = self._mean.shape
+        frame = pd.DataFrame({"time": np.repeat(self.timepoints, n), "species": np.tile(self.species, T),
+                              "mean": self.mean.ravel(), "std": self.std.ravel()})
+        for level, values in zip(q, self.quantiles(list(q))):
+            frame["q" + str(level)] = values.ravel()
+        return frame
+
+
+class StochasticSimulator:
+    """
+    Gillespie stochastic simulation of a CRNModel, driven by its compiled stoichiometry.
+    Exact simulation ("ssa") uses the direct method and, after each reaction, recomputes only the propensities that
+    read a species it changed (the reaction dependency graph). Adaptive tau-leaping ("tau", Cao, Gillespie and Petzold
+    2006) fires Poisson numbers of non-critical reactions per leap, with the leap chosen so no propensity changes by
+    more than a fraction epsilon; reactions that could exhaust a reactant fire one at a time, and when the leap would
+    be shorter than a few exact steps the simulator takes exact steps instead.
+    Michaelis-Menten (QSSA) reactions use their deterministic rate law as propensity. The enzyme binding and unbinding
+    of full Genelet mechanisms are orders of magnitude faster than the rest of the circuit and keep both methods at one
+    event per binding step, so QSSA Genelets (qssa = True) are much faster to simulate stochastically.
+    Arguments: CRNModel (e.g. from GeneletTemplate.bind)
+    Optional argument: volume, molecules per unit of concentration (defaults to 1, molecule counts equal to
+                       concentrations as in bioscrape stochastic simulations)
+    """
+    def __init__(self, model, volume = 1.0):
+
+        topology = model.topology
+        self.model = model
+        self.topology = topology
+        self.species = topology.species
+        self.volume = float(volume)
+        n = topology.n_species
+        R = topology.n_reactions
+
+        # Propensity in molecules: k * x1 * x2 / volume^(order - 1), x2 - 1 for two molecules of the same species
+
+        self.reactant_1 = topology.reactant_1
+        self.reactant_2 = topology.reactant_2
+        order = (self.reactant_1 < n).astype(int) + (self.reactant_2 < n)
+        self.dimer = ((self.reactant_1 == self.reactant_2) & (self.reactant_1 < n)).astype(float)
+        self.rate = model.k * self.volume ** (1 - order)
+        self.K = None if model.K is None else np.asarray(model.K, dtype = float)
+        self.position = -np.ones(R, dtype = int)
+        self.position[topology.saturated] = np.arange(len(topology.saturated))
+
+        # State changes of each reaction and the square of the stoichiometry for tau selection
+
+        self.stoichiometry = topology.stoich_matrix
+        self.stoichiometry_squared = topology.stoich_matrix.multiply(topology.stoich_matrix).tocsr()
+        columns = topology.stoich_matrix.tocsc()
+        self._changes = [(columns.indices[columns.indptr[j]:columns.indptr[j + 1]], columns.data[columns.indptr[j]:columns.indptr[j + 1]])
+                         for j in range(R)]
+        consumed = columns.data < 0
+        self._consumed_reaction = np.repeat(np.arange(R), np.diff(columns.indptr))[consumed]
+        self._consumed_species = columns.indices[consumed]
+        self._consumed_amount = -columns.data[consumed]
+
+        # Dependency graph: reaction j affects reaction l when j changes a species that the propensity of l reads.
+        # Michaelis-Menten propensities read every substrate of their enzyme through the competition denominator.
+
+        rows, cols = [], []
+        for slot in (self.reactant_1, self.reactant_2):
+            mask = slot < n
+            rows.append(slot[mask])
+            cols.append(np.nonzero(mask)[0])
+        for g in range(topology.n_michaelis_groups):
+            members = topology.saturated[topology.michaelis_group == g]
+            substrates = topology.saturating[topology.michaelis_group == g]
+            rows.append(np.repeat(substrates, len(members)))
+            cols.append(np.tile(members, len(substrates)))
+        rows, cols = np.concatenate(rows), np.concatenate(cols)
+        reads = csr_matrix((np.ones(len(rows)), (rows, cols)), shape = (n, R))
+        changes = csr_matrix((np.ones(len(columns.indices)), columns.indices, columns.indptr), shape = (R, n))
+        graph = (changes @ reads).tocsr()
+        self._affected = [graph.indices[graph.indptr[j]:graph.indptr[j + 1]] for j in range(R)]
+
+        # Highest order of the reactions consuming each species (g of Cao et al.), homodimers handled per state
+
+        self.highest_order = np.zeros(n)
+        np.maximum.at(self.highest_order, self.reactant_1[order > 0], order[order > 0])
+        np.maximum.at(self.highest_order, self.reactant_2[order > 1], order[order > 1])
+        self._dimer_species = np.unique(self.reactant_1[self.dimer > 0])
+
+    def initial_counts(self, x0 = None):
+        """Molecule counts of an initial state (array or initial condition dictionary, defaults to model.x0)"""
+        if x0 is None:
+            x0 = self.model.x0
+        elif isinstance(x0, dict):
+            x0 = self.topology.initial_state(x0)
+        return np.rint(np.asarray(x0, dtype = float) * self.volume)
+
+    def propensities(self, xe, reactions = None):
+        """Propensities of reactions (all by default) for molecule counts xe with a constant 1 appended"""
+        if reactions is None:
+            reactions = slice(None)
+        rates = self.rate[reactions] * xe[self.reactant_1[reactions]] * (xe[self.reactant_2[reactions]] - self.dimer[reactions])
+        if len(self.topology.saturated):
+            position = self.position[reactions]
+            saturated = position >= 0
+            if np.any(saturated):
+                topology = self.topology
+                denominator = (xe[topology.saturating] / (self.K * self.volume)) @ topology.michaelis_members + 1
+                position = position[saturated]
+                rates[saturated] /= self.K[position] * denominator[topology.michaelis_group[position]]
+        return np.maximum(rates, 0.0)
+
+    def _fire(self, xe, a, j):
+        # Apply reaction j and update the propensities it affects
+        species, change = self._changes[j]
+        xe[species] += change
+        affected = self._affected[j]
+        a[affected] = self.propensities(xe, affected)
+
+    def _leap_size(self, x, a, epsilon, n_critical):
+        # Cao et al. tau selection over non-critical reactions; critical reactions could exhaust a reactant in n_critical firings
+        firings = np.full(len(a), np.inf)
+        np.minimum.at(firings, self._consumed_reaction, np.floor(x[self._consumed_species] / self._consumed_amount))
+        critical = (firings < n_critical) & (a > 0)
+        noncritical = np.where(critical, 0.0, a)
+        mu = np.abs(self.stoichiometry @ noncritical)
+        sigma2 = self.stoichiometry_squared @ noncritical
+
+        g = self.highest_order.copy()
+        if len(self._dimer_species):
+            g[self._dimer_species] = 2 + 1 / np.maximum(x[self._dimer_species] - 1, 1)
+        reactant = g > 0
+        bound = np.maximum(epsilon * x[reactant] / g[reactant], 1.0)
+        with np.errstate(divide = "ignore"):
+            tau = min(np.min(bound / mu[reactant], initial = np.inf), np.min(bound ** 2 / sigma2[reactant], initial = np.inf))
+        return tau, critical
+
+    def trajectory(self, timepoints, x0 = None, method = "tau", epsilon = 0.03, n_critical = 10, seed = None):
+        """
+        Simulate one trajectory.
+        Arguments: timepoints to record
+        Optional arguments: x0, initial state (array or initial condition dictionary, defaults to model.x0)
+                            method, "ssa" (exact) or "tau" (adaptive tau-leaping)
+                            epsilon, tau-leaping error control parameter
+                            n_critical, reactions that could exhaust a reactant in fewer firings are never leaped
+                            seed, seed or numpy Generator
+        Output: Array of molecule counts of shape (len(timepoints), n_species)
+        """
+        if method not in STOCHASTIC_METHODS:
+            raise RuntimeError('Unknown stochastic method ' + str(method) + ', must be one of ' + ", ".join(STOCHASTIC_METHODS))
+        rng = seed if isinstance(seed, np.random.Generator) else np.random.default_rng(seed)
+        timepoints = np.asarray(timepoints, dtype = float)
+        n = self.topology.n_species
+        T = len(timepoints)
+        out = np.empty((T, n))
+        xe = np.append(self.initial_counts(x0), 1.0)
+        a = self.propensities(xe)
+        t = timepoints[0]
+        record = 0
+
+        def ssa_step():
+            # One exact step; returns False once the next reaction happens after the last timepoint
+            nonlocal t, record
+            a0 = a.sum()
+            if a0 <= 0:
+                out[record:] = xe[:n]
+                record = T
+                return False
+            t_next = t + rng.exponential(1 / a0)
+            while record < T and timepoints[record] < t_next:
+                out[record] = xe[:n]
+                record += 1
+            if record == T:
+                return False
+            t = t_next
+            j = min(np.searchsorted(np.cumsum(a), rng.random() * a0, side = "right"), len(a) - 1)
+            self._fire(xe, a, j)
+            return True
+
+        while record < T and timepoints[record] <= t:
+            out[record] = xe[:n]
+            record += 1
+
+        while record < T:
+            if method == "ssa":
+                ssa_step()
+                continue
+
+            a0 = a.sum()
+            tau, critical = self._leap_size(xe[:n], a, epsilon, n_critical)
+            if a0 <= 0 or tau < 10 / a0:
+                for step in range(100):
+                    if not ssa_step():
+                        break
+                continue
+
+            a_critical = a[critical].sum()
+            noncritical = np.where(critical, 0.0, a)
+            remaining = timepoints[record] - t
+            while True:
+                tau_critical = rng.exponential(1 / a_critical) if a_critical > 0 else np.inf
+                step = min(tau, tau_critical, remaining)
+                fired = rng.poisson(noncritical * step).astype(float)
+                if tau_critical <= min(tau, remaining):
+                    fired[np.searchsorted(np.cumsum(np.where(critical, a, 0.0)), rng.random() * a_critical, side = "right")] += 1
+                x_new = xe[:n] + self.stoichiometry @ fired
+                if np.all(x_new >= 0):
+                    break
+                tau /= 2
+
+            xe[:n] = x_new
+            t = timepoints[record] if step == remaining else t + step
+            while record < T and timepoints[record] <= t:
+                out[record] = xe[:n]
+                record += 1
+            a = self.propensities(xe)
+
+        return out
+
+    def simulate(self, timepoints, x0 = None, method = "tau", epsilon = 0.03, seed = None):
+        """
+        Simulate one trajectory (see trajectory).
+        Output: Pandas DataFrame of concentrations with one column per species and a "time" column, like
+                simulate_with_bioscrape(..., stochastic = True)
+        """
+        import pandas as pd
+
+        counts = self.trajectory(timepoints, x0 = x0, method = method, epsilon = epsilon, seed = seed)
+        R = pd.DataFrame(counts / self.volume, columns = self.species)
+        R["time"] = np.asarray(timepoints, dtype = float)
+        return R
+
+    def simulate_batch(self, timepoints, n_trajectories, x0 = None, method = "tau", epsilon = 0.03, species = None,
+                       processes = None, chunk_size = None, bins = 256, seed = None):
+        """
+        Simulate many trajectories over a process pool and summarise them as they finish.
+        Every trajectory has its own random stream, spawned from seed by its index. Each worker simulates chunks of
+        trajectories and returns only their TrajectoryStatistics, which are merged in chunk order, so at most one chunk
+        of trajectories is held in memory per worker and a seeded batch gives the same results whatever the number of
+        processes.
+        Arguments: timepoints to record, number of trajectories
+        Optional arguments: x0, method, epsilon, see trajectory
+                            species, list of species to summarise (defaults to all)
+                            processes, number of worker processes (defaults to all cores, 1 runs in this process)
+                            chunk_size, trajectories per task (defaults to BATCH_CHUNK_SIZE)
+                            bins, histogram bins of the quantile estimate (see TrajectoryStatistics)
+                            seed for the random streams
+        Output: TrajectoryStatistics in concentration units
+        """
+        species = self.species if species is None else list(species)
+        columns = np.array([self.topology.species_index[s] for s in species], dtype = int)
+        counts = self.initial_counts(x0)
+        chunk_size = BATCH_CHUNK_SIZE if chunk_size is None else chunk_size
+        seeds = np.random.SeedSequence(seed).spawn(n_trajectories)
+        jobs = [(self, timepoints, counts / self.volume, seeds[start:start + chunk_size], method, epsilon, columns,
+                 species, bins) for start in range(0, n_trajectories, chunk_size)]
+
+        statistics = TrajectoryStatistics(timepoints, species, bins = bins, scale = 1 / self.volume)
+        if processes == 1:
+            for job in jobs:
+                statistics.merge(_simulate_chunk(job))
+        else:
+            from multiprocessing import Pool
+
+            with Pool(processes) as pool:
+                for part in pool.imap(_simulate_chunk, jobs):
+                    statistics.merge(part)
+        return statistics
+
+
+def _simulate_chunk(job):
+    simulator, timepoints, x0, seeds, method, epsilon, columns, species, bins = job
+    statistics = TrajectoryStatistics(timepoints, species, bins = bins, scale = 1 / simulator.volume)
+    for seed in seeds:
+        statistics.add(simulator.trajectory(timepoints, x0 = x0, method = method, epsilon = epsilon, seed = seed)[:, columns])
+    return statistics
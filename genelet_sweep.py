@@ -0,0 +1,276 @@
+import glob
+import itertools
+import os
+import numpy as np
+from genelet import GeneletTemplate
+from genelet_profile import profile, write_record
+from genelet_trajectory import TrajectoryBuffer, stream_simulate
+
+
+def parameter_grid(**values):
+    """
+    Function to create a full factorial grid of sweep points.
+    Arguments: One keyword per parameter or species name with the list of values to sweep it over
+    Output: List of dictionaries, one per sweep point
+    """
+    names = list(values)
+    return [dict(zip(names, point)) for point in itertools.product(*[values[name] for name in names])]
+
+
+def latin_hypercube(n, bounds, log = False, seed = None):
+    """
+    Function to create a Latin-hypercube sample of sweep points.
+    Arguments: Number of points
+               Dictionary of parameter or species name -> (low, high)
+    Optional arguments: log, sample uniformly in log space (for rate constants spanning decades)
+                        seed for the random number generator
+    Output: List of dictionaries, one per sweep point
+    """
+    rng = np.random.default_rng(seed)
+    names = list(bounds)
+
+    # One stratum per point in every dimension, strata shuffled independently per dimension
+
+    u = (rng.permuted(np.tile(np.arange(n), (len(names), 1)), axis = 1).T + rng.random((n, len(names)))) / n
+
+    points = [{} for i in range(n)]
+    for d, name in enumerate(names):
+        low, high = bounds[name]
+        if log:
+            column = np.exp(np.log(low) + u[:, d] * (np.log(high) - np.log(low)))
+        else:
+            column = low + u[:, d] * (high - low)
+        for i in range(n):
+            points[i][name] = float(column[i])
+    return points
+
+
+class SweepStore:
+    """
+    Columnar on-disk store for sweep results.
+    Each flushed chunk is one .npz file holding a "run" column, one column per swept name, one (runs x timepoints)
+    column per recorded species and one column per reduction (see run_sweep), so columns can be read without touching
+    the others and an interrupted sweep can be resumed.
+    Arguments: Directory of the store (created if needed)
+    """
+    def __init__(self, path):
+
+        self.path = path
+        os.makedirs(path, exist_ok = True)
+
+    def _chunks(self):
+        return sorted(glob.glob(os.path.join(self.path, "chunk_*.npz")))
+
+    def completed_runs(self):
+        """Set of run ids already stored"""
+        done = set()
+        for chunk in self._chunks():
+            with np.load(chunk) as data:
+                done.update(data["run"].tolist())
+        return done
+
+    def write_points(self, names, points, timepoints):
+        """
+        Record the sweep definition, or check that it matches the one already stored when resuming.
+        """
+        table = np.array([[point.get(name, np.nan) for name in names] for point in points], dtype = float)
+        definition = os.path.join(self.path, "sweep.npz")
+        if os.path.exists(definition):
+            with np.load(definition) as data:
+                same = list(data["names"]) == list(names) and np.array_equal(data["points"], table, equal_nan = True) and \
+                       np.array_equal(data["time"], timepoints)
+            if not same:
+                raise RuntimeError('Sweep store ' + self.path + ' holds a different sweep, use a new directory')
+        else:
+            self._write(definition, names = np.array(names), points = table, time = np.asarray(timepoints, dtype = float))
+
+    def write_chunk(self, columns):
+        """Write a dictionary of column name -> array as the next chunk"""
+        chunks = self._chunks()
+        index = int(os.path.basename(chunks[-1])[6:12]) + 1 if chunks else 0
+        self._write(os.path.join(self.path, "chunk_%06d.npz" % index), **columns)
+
+    def _write(self, filename, **columns):
+        # Write to a temporary file first so an interrupted sweep never leaves a partial chunk behind
+        tmp = filename + ".tmp"
+        with open(tmp, "wb") as f:
+            np.savez(f, **columns)
+        os.replace(tmp, filename)
+
+    def load(self, columns = None):
+        """
+        Read the stored results.
+        Optional argument: List of column names to read, defaults to all
+        Output: Dictionary of column name -> array ordered by run id, plus "time"
+        """
+        parts = {}
+        for chunk in self._chunks():
+            with np.load(chunk) as data:
+                for name in (data.files if columns is None else ["run"] + list(columns)):
+                    parts.setdefault(name, []).append(data[name])
+
+        result = {name: np.concatenate(values) for name, values in parts.items()}
+        if "run" in result:
+            order = np.argsort(result["run"])
+            result = {name: values[order] for name, values in result.items()}
+        with np.load(os.path.join(self.path, "sweep.npz")) as data:
+            result["time"] = data["time"]
+        return result
+
+
+# Worker process state, set once per process by _init_worker so the template is only pickled once per worker
+
+_worker = {}
+
+def _init_worker(template, timepoints, species, simulate_keywords, profiling = False, every = 1, reductions = None):
+    _worker["template"] = template
+    _worker["timepoints"] = timepoints
+    _worker["species"] = species
+    _worker["columns"] = [template.topology.species_index[s] for s in species]
+    _worker["keywords"] = simulate_keywords
+    _worker["profiling"] = profiling
+    _worker["every"] = every
+    _worker["reductions"] = reductions
+
+def _simulate_point(parameters, ic):
+    # Decimated or reduced runs are streamed, so a run never holds more than the columns and values it keeps
+    template = _worker["template"]
+    model = template.bind(parameters, ic)
+    if _worker["every"] == 1 and not _worker["reductions"]:
+        R = model.simulate(_worker["timepoints"], **_worker["keywords"])
+        return R.values[:, _worker["columns"]], {}
+    kept = TrajectoryBuffer()
+    reduced = stream_simulate(model, _worker["timepoints"], kept, species = _worker["species"], every = _worker["every"],
+                              reductions = _worker["reductions"], **_worker["keywords"])
+    return kept.load()[1], reduced
+
+def _run_point(job):
+    run, parameters, ic = job
+    return run, _simulate_point(parameters, ic)[0]
+
+
+def simulate_points(template, points, timepoints, species = None, processes = None, **simulate_keywords):
+    """
+    Function to simulate a compiled template at a list of points over a process pool, keeping the results in memory.
+    Arguments: GeneletTemplate
+               List of (parameters, ic) pairs, parameters a dictionary of parameter overrides and ic the initial
+               conditions of the run (None for those of the template)
+               Timepoints to simulate
+    Optional arguments: species, list of species to record (defaults to all)
+                        processes, number of worker processes (defaults to all cores, 1 runs in this process)
+                        Other keywords are passed on to CRNModel.simulate
+    Output: Array of shape (len(points), len(timepoints), len(species))
+    """
+    from multiprocessing import Pool
+
+    species = template.species if species is None else species
+    timepoints = np.asarray(timepoints, dtype = float)
+    jobs = [(run, parameters, ic) for run, (parameters, ic) in enumerate(points)]
+    initargs = (template, timepoints, species, simulate_keywords)
+    if processes == 1:
+        _init_worker(*initargs)
+        results = dict(map(_run_point, jobs))
+    else:
+        with Pool(processes, initializer = _init_worker, initargs = initargs) as pool:
+            results = dict(pool.imap_unordered(_run_point, jobs))
+    return np.stack([results[run] for run in range(len(jobs))])
+
+def _run_sweep_point(job):
+    # Profiled runs also return their profiling record
+    run, parameters, ic = job
+    if not _worker["profiling"]:
+        return (run,) + _simulate_point(parameters, ic) + (None,)
+    with profile(label = run, parameters = parameters, ic = ic) as record:
+        values, reduced = _simulate_point(parameters, ic)
+    return run, values, reduced, record
+
+
+def run_sweep(circuit, points, timepoints, store, species = None, ic = None, processes = None, chunk_size = 64,
+              parameter_file = "default_parameters.txt", profile_file = None, every = 1, reductions = None,
+              **simulate_keywords):
+    """
+    Function to simulate a Genelet circuit at every sweep point over a process pool.
+    Results are streamed into a SweepStore as runs complete, tagged with their run id and swept values.
+    Runs already in the store are skipped, so calling run_sweep again after an interruption resumes the sweep.
+    Arguments: GeneletTemplate, or list of Genelet/Source components (e.g. the first output of GeneletGate)
+               List of sweep points, dictionaries of parameter and/or species name -> value (see parameter_grid, latin_hypercube)
+               Timepoints to simulate
+               SweepStore or directory to store results in
+    Optional arguments: species, list of species to record (defaults to all)
+                        ic, base initial conditions that species values in the sweep points override
+                        processes, number of worker processes (defaults to all cores)
+                        chunk_size, number of runs per stored chunk
+                        profile_file, JSON lines file to append the profiling record of every run to (see genelet_profile.py),
+                        labelled with the run id
+                        every, record one timepoint out of every
+                        reductions, dictionary of name -> reduction of a species computed over every timepoint while the
+                        run streams (see genelet_trajectory.stream_simulate), stored as one value per run under its name,
+                        e.g. {"I4_max": ("max", "rna_I4")}; with species = [] the store only keeps those values
+    Output: SweepStore holding the results
+    """
+    from multiprocessing import Pool
+
+    if isinstance(circuit, GeneletTemplate):
+        template = circuit
+    else:
+        template = GeneletTemplate(circuit, parameter_file = parameter_file, ic = ic)
+    if not isinstance(store, SweepStore):
+        store = SweepStore(store)
+    if species is None:
+        species = template.species
+    base_ic = dict((template.ic if ic is None else ic) or {})
+
+    # Split every sweep point into parameter overrides and initial condition overrides
+
+    names = list(dict.fromkeys(name for point in points for name in point))
+    for name in names:
+        if name not in template.parameters and name not in template.topology.species_index:
+            raise RuntimeError('Sweep variable ' + name + ' is neither a Genelet parameter nor a species of the circuit')
+
+    reductions = dict(reductions or {})
+    clashes = [name for name in reductions if name in names or name in species or name in ("run", "time")]
+    if clashes:
+        raise RuntimeError('Reduction names already used by the sweep: ' + ", ".join(clashes))
+
+    timepoints = np.asarray(timepoints, dtype = float)
+    store.write_points(names, points, timepoints[::every])
+    done = store.completed_runs()
+
+    jobs = []
+    for run, point in enumerate(points):
+        if run in done:
+            continue
+        parameters = {name: value for name, value in point.items() if name in template.parameters}
+        run_ic = dict(base_ic)
+        run_ic.update({name: value for name, value in point.items() if name not in template.parameters})
+        jobs.append((run, parameters, run_ic))
+
+    def flush(buffer):
+        runs = [run for run, values, reduced in buffer]
+        if profile_file is not None:
+            for record in records:
+                write_record(record, profile_file)
+            del records[:]
+        columns = {"run": np.array(runs, dtype = int)}
+        for name in names:
+            columns[name] = np.array([points[run].get(name, np.nan) for run in runs], dtype = float)
+        for i, s in enumerate(species):
+            columns[s] = np.stack([values[:, i] for run, values, reduced in buffer])
+        for name in reductions:
+            columns[name] = np.array([reduced[name] for run, values, reduced in buffer], dtype = float)
+        store.write_chunk(columns)
+
+    buffer = []
+    records = []
+    initargs = (template, timepoints, species, simulate_keywords, profile_file is not None, every, reductions)
+    with Pool(processes, initializer = _init_worker, initargs = initargs) as pool:
+        for result in pool.imap_unordered(_run_sweep_point, jobs):
+            if profile_file is not None:
+                records.append(result[3])
+            buffer.append(result[:3])
+            if len(buffer) >= chunk_size:
+                flush(buffer)
+                buffer = []
+    if buffer:
+        flush(buffer)
+    return store
@@ -0,0 +1,82 @@
+import numpy as np
+from genelet import GeneletTemplate
+from genelet_sweep import simulate_points
+
+GAS_CONSTANT = 8.314462618  # J / (mol K)
+
+
+class Arrhenius:
+    """
+    Arrhenius temperature dependence of a rate constant: k(T) = k(T_ref) * exp(-Ea / R * (1 / T - 1 / T_ref)).
+    Arguments: Activation energy Ea in J/mol (negative for rates that slow down when heated, e.g. hybridization)
+    """
+    def __init__(self, Ea):
+
+        self.Ea = Ea
+
+    def factor(self, temperature, reference):
+        """Ratio k(temperature) / k(reference), temperatures in degrees Celsius"""
+        return np.exp(-self.Ea / GAS_CONSTANT * (1.0 / (temperature + 273.15) - 1.0 / (reference + 273.15)))
+
+    def __repr__(self):
+        return "Arrhenius(" + repr(self.Ea) + ")"
+
+
+class Empirical:
+    """
+    Empirical temperature dependence of Temperature-dependence/trial_mechanism_transcription.ipynb:
+    k(T) proportional to 1 / (A * T^2 + B * T + C), T in degrees Celsius.
+    Arguments: A, B, C coefficients of the quadratic
+    """
+    def __init__(self, A, B, C):
+
+        self.A, self.B, self.C = A, B, C
+
+    def _denominator(self, temperature):
+        return self.A * temperature ** 2 + self.B * temperature + self.C
+
+    def factor(self, temperature, reference):
+        """Ratio k(temperature) / k(reference), temperatures in degrees Celsius"""
+        denominator = self._denominator(temperature)
+        if np.any(np.asarray(denominator) <= 0):
+            raise RuntimeError('Empirical temperature model is not positive at ' + str(temperature) + ' C')
+        return self._denominator(reference) / denominator
+
+    def __repr__(self):
+        return "Empirical(" + ", ".join(repr(c) for c in (self.A, self.B, self.C)) + ")"
+
+
+def temperature_scaled(parameters, models, temperature, reference):
+    """
+    Function to rescale named Genelet/Source parameters from the reference temperature to another temperature.
+    Arguments: Dictionary of named parameters at the reference temperature (as in GeneletTemplate.parameters)
+               Dictionary of parameter name -> temperature model (Arrhenius, Empirical or any object with a
+               factor(temperature, reference) method)
+               Temperature and reference temperature in degrees Celsius
+    Output: Dictionary of rescaled parameters, parameters without a model are unchanged
+    """
+    scaled = dict(parameters)
+    for name, model in models.items():
+        scaled[name] = parameters[name] * model.factor(temperature, reference)
+    return scaled
+
+
+def temperature_sweep(circuit, temperatures, timepoints, species = None, parameters = None, ic = None, processes = None,
+                      **simulate_keywords):
+    """
+    Function to simulate a temperature-aware Genelet circuit at every temperature over a process pool.
+    The circuit is compiled once; every temperature only rebinds its rate constants (see GeneletTemplate.bind).
+    Arguments: GeneletTemplate created with a temperature_model
+               List of temperatures in degrees Celsius
+               Timepoints to simulate
+    Optional arguments: species, list of species to record (defaults to all)
+                        parameters, dictionary of parameter overrides at the reference temperature, applied to every run
+                        ic, initial conditions (defaults to the ic of the template)
+                        processes, number of worker processes (defaults to all cores, 1 runs in this process)
+                        Other keywords are passed on to CRNModel.simulate
+    Output: Array of shape (len(temperatures), len(timepoints), len(species))
+    """
+    if not isinstance(circuit, GeneletTemplate) or circuit.temperature_model is None:
+        raise RuntimeError('temperature_sweep needs a GeneletTemplate created with a temperature_model')
+    points = [(dict(parameters or {}, temperature = float(T)), ic) for T in temperatures]
+    return simulate_points(circuit, points, timepoints, species = species, processes = processes, **simulate_keywords)
@@ -0,0 +1,219 @@
+import json
+import os
+import numpy as np
+from genelet_profile import record_solution, solver_method, stage
+
+# Reductions computed while a trajectory streams past: name -> number of arguments after the species name
+
+REDUCTIONS = {"final": 0, "max": 0, "min": 0, "time_to_threshold": 1}
+
+
+class TrajectoryStore:
+    """
+    Columnar on-disk store for one trajectory, written in chunks as the simulation runs.
+    Every column ("time", then one per recorded species) is a .npy file that load() maps into memory rather than
+    reading, so a long trajectory can be plotted or reduced a few columns at a time.
+    columns.json lists the columns and the number of rows written, updated after every chunk, so the rows of an
+    interrupted simulation remain readable.
+    Arguments: Directory of the store (created if needed)
+    """
+    def __init__(self, path):
+
+        self.path = path
+        os.makedirs(path, exist_ok = True)
+        self._arrays = None
+
+    def _file(self, i):
+        return os.path.join(self.path, "column_%04d.npy" % i)
+
+    def _write_index(self):
+        tmp = os.path.join(self.path, "columns.json.tmp")
+        with open(tmp, "w") as f:
+            json.dump({"columns": self.columns, "length": self.length, "rows": self.rows}, f)
+        os.replace(tmp, os.path.join(self.path, "columns.json"))
+
+    def create(self, species, length):
+        """
+        Function to allocate the columns of a trajectory, replacing any trajectory already stored.
+        Arguments: List of species names, number of timepoints
+        """
+        self.columns = ["time"] + list(species)
+        self.length = int(length)
+        self.rows = 0
+        self._arrays = [np.lib.format.open_memmap(self._file(i), mode = "w+", dtype = float, shape = (self.length,))
+                        for i in range(len(self.columns))]
+        self._write_index()
+
+    def write(self, time, values):
+        """
+        Function to append a chunk of rows.
+        Arguments: Array of timepoints, array of shape (len(time), number of species) in the order given to create
+        """
+        if self._arrays is None:
+            raise RuntimeError('Trajectory store ' + self.path + ' was not created for writing')
+        end = self.rows + len(time)
+        if end > self.length:
+            raise RuntimeError('Trajectory store ' + self.path + ' holds ' + str(self.length) + ' rows')
+        self._arrays[0][self.rows:end] = time
+        for i, array in enumerate(self._arrays[1:]):
+            array[self.rows:end] = values[:, i]
+        for array in self._arrays:
+            array.flush()
+        self.rows = end
+        self._write_index()
+
+    def load(self, columns = None):
+        """
+        Read the stored trajectory as memory maps.
+        Optional argument: List of column names to read, defaults to all
+        Output: Dictionary of column name -> read-only memory-mapped array of the rows written, plus "time"
+        """
+        with open(os.path.join(self.path, "columns.json")) as f:
+            index = json.load(f)
+        names = index["columns"] if columns is None else ["time"] + [c for c in columns if c != "time"]
+        unknown = [name for name in names if name not in index["columns"]]
+        if unknown:
+            raise RuntimeError('Columns not in trajectory store ' + self.path + ': ' + ", ".join(unknown))
+        return {name: np.load(self._file(index["columns"].index(name)), mmap_mode = "r")[:index["rows"]]
+                for name in names}
+
+
+class TrajectoryBuffer:
+    """
+    In-memory counterpart of TrajectoryStore, collecting the chunks of a streamed trajectory (e.g. the decimated
+    columns a sweep keeps).
+    """
+    def __init__(self):
+
+        self.time = []
+        self.values = []
+
+    def create(self, species, length):
+        self.species = list(species)
+        self.time, self.values = [], []
+
+    def write(self, time, values):
+        self.time.append(np.array(time))
+        self.values.append(np.array(values))
+
+    def load(self):
+        """Output: (array of timepoints, array of shape (timepoints, species))"""
+        if not self.time:
+            return np.zeros(0), np.zeros((0, len(self.species)))
+        return np.concatenate(self.time), np.concatenate(self.values)
+
+
+class _Reductions:
+    # Running reductions of species columns, updated chunk by chunk
+
+    def __init__(self, reductions, species_index):
+
+        self.specs = {}
+        for name, spec in (reductions or {}).items():
+            kind, s = spec[0], spec[1]
+            if kind not in REDUCTIONS:
+                raise RuntimeError('Unknown reduction ' + str(kind) + ', known reductions are ' + ", ".join(REDUCTIONS))
+            if len(spec) != 2 + REDUCTIONS[kind]:
+                raise RuntimeError('Reduction ' + name + ' takes ' + str(REDUCTIONS[kind]) + ' argument(s) after the species')
+            if s not in species_index:
+                raise RuntimeError('Reduction ' + name + ' of unknown species ' + str(s))
+            self.specs[name] = (kind, species_index[s]) + tuple(spec[2:])
+        self.values = {name: np.nan for name in self.specs}
+        self._sides = {}
+        self._last = None
+
+    def update(self, t, X):
+        for name, spec in self.specs.items():
+            kind, x = spec[0], X[:, spec[1]]
+            if kind == "final":
+                self.values[name] = float(x[-1])
+            elif kind == "max":
+                self.values[name] = float(np.fmax(self.values[name], x.max()))
+            elif kind == "min":
+                self.values[name] = float(np.fmin(self.values[name], x.min()))
+            elif np.isnan(self.values[name]):
+                self.values[name] = self._crossing(name, t, x, spec[1], spec[2])
+        self._last = (t[-1], X[-1])
+
+    def _crossing(self, name, t, x, column, threshold):
+        # First time the species reaches the threshold from the side it started on, interpolated linearly
+        # between timepoints (the last point of the previous chunk included)
+        if self._last is None:
+            self._sides[name] = 1.0 if x[0] >= threshold else -1.0
+        else:
+            t, x = np.concatenate([[self._last[0]], t]), np.concatenate([[self._last[1][column]], x])
+        crossed = np.nonzero(self._sides[name] * (x - threshold) <= 0)[0]
+        if len(crossed) == 0:
+            return np.nan
+        i = crossed[0]
+        if i == 0:
+            return float(t[0])
+        return float(t[i - 1] + (threshold - x[i - 1]) * (t[i] - t[i - 1]) / (x[i] - x[i - 1]))
+
+
+def stream_simulate(model, timepoints, store = None, species = None, every = 1, reductions = None, chunk_size = 1000,
+                    method = None, rtol = 1e-6, atol = 1e-9, sparse = None, **keywords):
+    """
+    Function to integrate a CRNModel while streaming its trajectory, so memory does not grow with the number of
+    timepoints. The solver is stepped directly and interpolated at the timepoints each step passes (as solve_ivp
+    does for t_eval); every chunk_size timepoints the chunk updates the reductions and the kept rows go to the store.
+    Arguments: CRNModel (e.g. GeneletTemplate.bind()), increasing timepoints
+    Optional arguments: store, TrajectoryStore or directory to write the trajectory to, or TrajectoryBuffer to keep it
+                        in memory (None keeps only the reductions)
+                        species, list of species to store (defaults to all)
+                        every, store one timepoint out of every (reductions still see every timepoint)
+                        reductions, dictionary of name -> (kind, species, arguments): ("final", s) and ("max", s) and
+                        ("min", s) of a species, or ("time_to_threshold", s, threshold), the first time s reaches
+                        threshold from the side it started on (nan if it never does), e.g.
+                        {"I4_final": ("final", "rna_I4"), "I4_half": ("time_to_threshold", "rna_I4", 1000)}
+                        chunk_size, number of timepoints per chunk
+                        method, rtol, atol, sparse and other keywords as for CRNModel.simulate
+    Output: Dictionary of reduction name -> value
+    """
+    import scipy.integrate
+
+    topology = model.topology
+    timepoints = np.asarray(timepoints, dtype = float)
+    species = topology.species if species is None else list(species)
+    unknown = [s for s in species if s not in topology.species_index]
+    if unknown:
+        raise RuntimeError('Species not in the CRN: ' + ", ".join(unknown))
+    columns = [topology.species_index[s] for s in species]
+    reduced = _Reductions(reductions, topology.species_index)
+    if isinstance(store, str):
+        store = TrajectoryStore(store)
+    if store is not None:
+        store.create(species, len(range(0, len(timepoints), every)))
+
+    def flush(indices, X):
+        indices, X = np.concatenate(indices), np.concatenate(X)
+        reduced.update(timepoints[indices], X)
+        keep = indices % every == 0
+        if store is not None and keep.any():
+            store.write(timepoints[indices[keep]], X[keep][:, columns])
+
+    method = solver_method(model.solver_options(method, sparse, keywords))
+    solver_class = getattr(scipy.integrate, method) if isinstance(method, str) else method
+    with stage("simulate"):
+        solver = solver_class(model.rhs, timepoints[0], model.x0, timepoints[-1], rtol = rtol, atol = atol, **keywords)
+        indices, X = [np.array([0])], [model.x0[np.newaxis, :]]
+        pending = 1
+        done = 1
+        while done < len(timepoints):
+            message = solver.step()
+            if solver.status == "failed":
+                raise RuntimeError('Simulation failed: ' + message)
+            end = np.searchsorted(timepoints, solver.t, side = "right")
+            if end > done:
+                interpolant = solver.dense_output()
+                indices.append(np.arange(done, end))
+                X.append(interpolant(timepoints[done:end]).T)
+                pending += end - done
+                done = end
+            if pending >= chunk_size:
+                flush(indices, X)
+                indices, X, pending = [], [], 0
+        if pending:
+            flush(indices, X)
+    record_solution(solver)
+    return reduced.values
@@ -0,0 +1,12 @@
+import os
+import sys
+
+# The modules live at the root of the repository. The SBML readers live next to the notebooks of Parametric Analysis,
+# whose older genelet.py must not shadow the root one, so that directory goes last
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+PARAMETRIC_ANALYSIS = os.path.join(ROOT, "Parametric Analysis")
+if PARAMETRIC_ANALYSIS not in sys.path:
+    sys.path.append(PARAMETRIC_ANALYSIS)
@@ -0,0 +1,24 @@
+import os
+import numpy as np
+from sbml_crn import sbml_to_crn
+from sbml_to_ode2 import sbml_to_ode2
+
+NAND = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Parametric Analysis", "NAND_CRN.xml")
+
+
+def test_no_cache_by_default(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    sbml_to_ode2(NAND)
+    sbml_to_crn(NAND)
+    assert os.listdir(tmp_path) == []
+
+
+def test_cached_model_matches(tmp_path):
+    cache_dir = str(tmp_path / "cache")
+    fresh = sbml_to_crn(NAND)
+    sbml_to_crn(NAND, cache_dir = cache_dir)
+    cached = sbml_to_crn(NAND, cache_dir = cache_dir)
+    assert os.listdir(os.path.join(cache_dir, "sbml"))
+    x = np.random.default_rng(0).random(len(fresh.species))
+    np.testing.assert_allclose(cached.fun(0, x, cached.params_values), fresh.fun(0, x, fresh.params_values))
+    np.testing.assert_allclose(cached.jac(0, x, cached.params_values), fresh.jac(0, x, fresh.params_values))
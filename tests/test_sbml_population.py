@@ -0,0 +1,44 @@
+import os
+import numpy as np
+from scipy.sparse import identity
+from scipy.sparse.linalg import spsolve
+from sbml_crn import sbml_to_crn
+from sbml_population import LiposomePopulation
+
+LIPOSOMES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Sub-SBML liposomes")
+
+
+def _population(n_cells = 3):
+    internal, membrane, reservoir = [sbml_to_crn(os.path.join(LIPOSOMES, name), cache_dir = None)
+                                     for name in ("NOR_CRN.xml", "membrane.xml", "rI4_external_reservoir.xml")]
+    population = LiposomePopulation(internal, membrane, reservoir, n_cells)
+    rng = np.random.default_rng(0)
+    y = population.initial_state() + rng.random(len(population.initial_state()))
+    return population, y
+
+
+def _newton_matrix(population, y, c = 10.0):
+    J = population.jacobian(0.0, y)
+    return (identity(J.shape[0], format = "csc") - c * J).tocsc()
+
+
+def test_bordered_lu_solves_newton_systems():
+    population, y = _population()
+    A = _newton_matrix(population, y)
+    b = np.random.default_rng(1).random(A.shape[0])
+    factors = population._bordered_lu(A)
+    assert isinstance(factors, tuple)
+    np.testing.assert_allclose(population._bordered_solve(factors, b), spsolve(A, b), rtol = 1e-8, atol = 1e-10)
+
+
+def test_bordered_lu_falls_back_on_small_pivots():
+    population, y = _population()
+    A = _newton_matrix(population, y).tolil()
+    # A vanishing first pivot in the elimination order of one cell
+    k = population._order[0] + population.n_local
+    A[k, k] = 1e-14
+    A = A.tocsc()
+    b = np.random.default_rng(1).random(A.shape[0])
+    factors = population._bordered_lu(A)
+    assert not isinstance(factors, tuple)
+    np.testing.assert_allclose(population._bordered_solve(factors, b), spsolve(A, b), rtol = 1e-8, atol = 1e-10)
@@ -0,0 +1,49 @@
+import numpy as np
+from genelet import GeneletTemplate
+from genelet_benchmark import nor_gate
+from genelet_schedule import InputSchedule, ScheduleSimulator
+
+
+def _model():
+    components, ic, inputs = nor_gate()
+    return GeneletTemplate(components, ic = ic).bind()
+
+
+def _counted(simulator):
+    # Record the (start, end) of every integration of the simulator
+    calls = []
+    integrate = simulator._integrate
+
+    def counted(t0, t1, x0, t_eval, held):
+        calls.append((t0, t1))
+        return integrate(t0, t1, x0, t_eval, held)
+
+    simulator._integrate = counted
+    return calls
+
+
+def test_fork_after_parent_starts_from_last_timepoint():
+    timepoints = np.linspace(0, 3600, 181)
+    parent = InputSchedule().add(600, "rna_I1", 500)
+    fork = parent.copy().add(1810, "rna_I2", 500)
+
+    simulator = ScheduleSimulator(_model(), timepoints)
+    simulator.simulate(parent)
+    calls = _counted(simulator)
+    R = simulator.simulate(fork)
+
+    # The shared part up to the fork is only integrated from the timepoint before it, 1800
+    assert (1800.0, 1810.0) in calls
+    assert all(t0 >= 1800.0 for t0, t1 in calls)
+
+    fresh = ScheduleSimulator(_model(), timepoints).simulate(fork)
+    np.testing.assert_allclose(R.values, fresh.values, rtol = 1e-4, atol = 1e-3)
+
+
+def test_hold_keeps_species_fixed():
+    timepoints = np.linspace(0, 3000, 101)
+    schedule = InputSchedule().hold(600, "rna_I1", 500, end = 1200)
+    R = ScheduleSimulator(_model(), timepoints).simulate(schedule)
+    held = (R["time"] >= 600) & (R["time"] <= 1200)
+    np.testing.assert_allclose(R["rna_I1"][held], 500)
+    assert R["rna_I1"].iloc[-1] < 500
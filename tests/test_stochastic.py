@@ -0,0 +1,32 @@
+import numpy as np
+from genelet import GeneletTemplate
+from genelet_benchmark import nor_gate
+from genelet_stochastic import StochasticSimulator
+
+
+def _simulator():
+    components, ic, inputs = nor_gate(qssa = True)
+    return StochasticSimulator(GeneletTemplate(components, ic = ic).bind(), volume = 0.05)
+
+
+def _summary(statistics):
+    return [statistics.mean, statistics.variance, statistics.minimum, statistics.maximum,
+            statistics.quantiles([0.1, 0.5, 0.9])]
+
+
+def test_batch_does_not_depend_on_processes():
+    simulator = _simulator()
+    timepoints = np.linspace(0, 300, 11)
+    one = simulator.simulate_batch(timepoints, 80, processes = 1, seed = 7)
+    two = simulator.simulate_batch(timepoints, 80, processes = 2, seed = 7)
+    for a, b in zip(_summary(one), _summary(two)):
+        np.testing.assert_array_equal(a, b)
+
+
+def test_batch_trajectories_do_not_depend_on_chunks():
+    simulator = _simulator()
+    timepoints = np.linspace(0, 300, 11)
+    large = simulator.simulate_batch(timepoints, 30, processes = 1, seed = 7)
+    small = simulator.simulate_batch(timepoints, 30, processes = 1, chunk_size = 7, seed = 7)
+    for a, b in zip(_summary(large), _summary(small)):
+        np.testing.assert_allclose(a, b, rtol = 1e-12, atol = 1e-12)